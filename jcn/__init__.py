@@ -14,9 +14,15 @@
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
 from ._version import __version__
-from .terminal import Terminal, get_terminal
+from .terminal import Terminal, get_terminal, MouseEvent, Paste
+from .headless import HeadlessTerminal
 from .root import Root
+from .keymap import Keymap
 from .container_elements import (
-    Stack, Box, Zebra, VerticalSplitContainer, HorizontalSplitContainer)
-from .display_elements import Fill, Label, Text, ProgressBar
-from .input_elements import Input, LineInput
+    Stack, Box, Zebra, VerticalSplitContainer, HorizontalSplitContainer,
+    Grid, GridTrack)
+from .display_elements import Fill, Label, Text, ProgressBar, Spinner
+from .input_elements import Input, LineInput, TextEditor
+from .completion import CompletionIndex, Completer
+from .server import Server
+from .process import ProcessOutput
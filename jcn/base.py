@@ -16,6 +16,9 @@
 from abc import ABCMeta, abstractmethod
 from collections import namedtuple
 
+from . import profiling
+from .binding import Binding
+from .keymap import Keymap
 from .terminal import get_terminal
 from .formatting import (
     StringWithFormatting, FormatPlaceholder, PlaceholderGroup)
@@ -26,13 +29,17 @@ Geometry = namedtuple(
 
 
 class Block:
-    __slots__ = 'x', 'y', 'lines', 'default_format'
+    __slots__ = 'x', 'y', 'lines', 'default_format', 'element'
+    # The element that produced a block is just for information, such as
+    # profiling, so doesn't affect equality:
+    _compared_attrs = 'x', 'y', 'lines', 'default_format'
 
-    def __init__(self, x, y, lines, default_format):
+    def __init__(self, x, y, lines, default_format, element=None):
         self.x = x
         self.y = y
         self.lines = lines
         self.default_format = default_format
+        self.element = element
 
     def __repr__(self):
         args = [self.x, self.y, self.lines]
@@ -45,7 +52,7 @@ class Block:
         try:
             return all(
                 getattr(self, attr_name) == getattr(other, attr_name) for
-                attr_name in self.__slots__)
+                attr_name in self._compared_attrs)
         except AttributeError:
             return False
 
@@ -53,11 +60,34 @@ class Block:
         return iter(self.lines)
 
 
+def _size_constraint(name):
+    '''Creates a property for one of an element's size constraints, which
+    lets the element's container know when it has been changed so that the
+    container can decide whether or not its layout needs recalculating.
+    '''
+    private_name = '_' + name
+
+    def getter(self):
+        return getattr(self, private_name)
+
+    def setter(self, value):
+        setattr(self, private_name, value)
+        self._size_constraints_changed()
+        self.updated = True
+    return property(getter, setter)
+
+
 class ABCUIElement(metaclass=ABCMeta):
-    min_width = None
-    max_width = None
-    min_height = None
-    max_height = None
+    _min_width = None
+    _max_width = None
+    _min_height = None
+    _max_height = None
+    _keymap = None
+    _root = None
+    min_width = _size_constraint('min_width')
+    max_width = _size_constraint('max_width')
+    min_height = _size_constraint('min_height')
+    max_height = _size_constraint('max_height')
 
     _all_valigns = 'top', 'middle', 'bottom'
     _possible_valigns = _all_valigns
@@ -74,7 +104,9 @@ class ABCUIElement(metaclass=ABCMeta):
         self.updated = True
         self._previous_geometry = None
         self._default_format = None
+        self._attribute_bindings = {}
         self.root = None
+        self.parent = None
 
     def __repr__(self):
         if self.name:
@@ -134,6 +166,61 @@ class ABCUIElement(metaclass=ABCMeta):
         else:
             return self.max_height
 
+    def _size_constraints_changed(self):
+        '''Called whenever our size constraints may have changed, so that our
+        parent container can check whether it needs to lay itself out again.
+        '''
+        if self.parent is not None:
+            self.parent._child_size_constraints_changed(self)
+
+    @property
+    def root(self):
+        '''The :class:`Root` that this element is attached to, if any.
+        '''
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        if root is None and self._root is not None:
+            # Once we're off screen there's no point keeping our attributes
+            # up to date:
+            for name in list(self._attribute_bindings):
+                self.unbind_attribute(name)
+        self._root = root
+
+    def bind_attribute(self, name, source, interval=None, loop=None):
+        '''Keeps the attribute called ``name`` up to date with the values
+        from ``source``, which is either an asynchronous iterator, or a
+        callable that is polled every ``interval`` seconds::
+
+            text.bind_attribute('content', read_log_tail, interval=0.5)
+            progress_bar.bind_attribute(
+                'fraction', download.progress_updates())
+
+        Values equal to the previous one are ignored, so that only sources
+        that actually change cause the element to be redrawn. Binding an
+        attribute that is already bound replaces the old binding, and all our
+        bindings are cancelled when we're detached from our :class:`Root`.
+        The source runs on ``loop``, or else our root's loop, or else the
+        running loop.
+
+        :returns: The :class:`jcn.binding.Binding`.
+        '''
+        self.unbind_attribute(name)
+        if loop is None and self.root is not None:
+            loop = self.root.loop
+        binding = Binding(self, name, source, interval, loop)
+        self._attribute_bindings[name] = binding
+        return binding
+
+    def unbind_attribute(self, name):
+        '''Stops updating the attribute called ``name`` from the source it was
+        bound to with :meth:`bind_attribute`, if any.
+        '''
+        binding = self._attribute_bindings.pop(name, None)
+        if binding is not None:
+            binding.cancel()
+
     @property
     def default_format(self):
         return self._default_format
@@ -146,15 +233,21 @@ class ABCUIElement(metaclass=ABCMeta):
     def draw(self, width, height, x=0, y=0, x_crop='left', y_crop='top',
              terminal=None, styles=None):
         blocks = self.get_all_blocks(width, height, x, y, x_crop, y_crop)
+        if profiling.active_tracer:
+            profiling.active_tracer.mark('layout')
         self._do_draw(blocks, terminal, styles)
 
     def update(self, default_format=None, terminal=None, styles=None):
         blocks = self.get_updated_blocks(default_format)
+        if profiling.active_tracer:
+            profiling.active_tracer.mark('layout')
         self._do_draw(blocks, terminal, styles)
 
     def _do_draw(self, blocks, terminal, styles):
         terminal = terminal or get_terminal()
         styles = styles or {}
+        profiler = profiling.active_profiler
+        tracer = profiling.active_tracer
         for block in blocks:
             if block.default_format:
                 default_esq_seq = (
@@ -164,7 +257,23 @@ class ABCUIElement(metaclass=ABCMeta):
                 default_esq_seq = terminal.normal
             lines = self._populate_lines(
                 block, terminal, styles, default_esq_seq)
-            terminal.draw_lines(lines, block.x, block.y)
+            if tracer:
+                # Populate up front so that writing is timed separately:
+                lines = list(lines)
+                tracer.mark('populate')
+                terminal.draw_lines(lines, block.x, block.y)
+                tracer.mark('write')
+            elif profiler:
+                element = block.element or self
+                lines = profiler.profile_iterator(
+                    element, '_populate_lines', lines)
+                profiler.enter(element, 'draw_lines')
+                terminal.draw_lines(lines, block.x, block.y)
+                profiler.exit()
+            else:
+                terminal.draw_lines(lines, block.x, block.y)
+        # The time until the output actually reaches the terminal is marked
+        # by whoever started the tracing (see Root._read_input):
         terminal.stream.flush()
 
     def _populate_lines(self, block, terminal, styles, default_esc_seq):
@@ -188,8 +297,13 @@ class ABCUIElement(metaclass=ABCMeta):
                 default_format = default_format + self.default_format
             else:
                 default_format = self.default_format
+        profiler = profiling.active_profiler
+        if profiler:
+            profiler.enter(self, 'get_all_blocks')
         blocks = self._get_all_blocks(
             width, height, x, y, x_crop, y_crop, default_format)
+        if profiler:
+            profiler.exit()
         self._previous_geometry = Geometry(width, height, x, y, x_crop, y_crop)
         self.updated = False
         return blocks
@@ -210,7 +324,12 @@ class ABCUIElement(metaclass=ABCMeta):
                 default_format = self.default_format
         blocks = []
         if self.updated:
+            profiler = profiling.active_profiler
+            if profiler:
+                profiler.enter(self, 'get_updated_blocks')
             blocks.extend(self._get_updated_blocks(default_format))
+            if profiler:
+                profiler.exit()
             self.updated = False
         return blocks
 
@@ -218,7 +337,45 @@ class ABCUIElement(metaclass=ABCMeta):
     def _get_updated_blocks(self, default_format):
         pass
 
+    @property
+    def keymap(self):
+        '''This element's :class:`Keymap`, or ``None`` if it has no key
+        bindings. Bindings apply whilst this element, or any element within it,
+        is focused.
+        '''
+        return self._keymap
+
+    @keymap.setter
+    def keymap(self, value):
+        if self._keymap is not None:
+            self._keymap._owners.discard(self)
+        self._keymap = value
+        if value is not None:
+            value._owners.add(self)
+        self._key_bindings_changed()
+
+    def _key_bindings_changed(self):
+        # Only the dispatcher of the root we're attached to can have resolved
+        # our bindings:
+        if self.root is not None:
+            self.root.key_dispatcher.invalidate(self)
+
+    def bind(self, keys, handler):
+        '''Binds a key, or a chord of keys, to a handler whilst this element
+        (or any element within it) is focused. See :meth:`Keymap.bind`.
+        '''
+        if self._keymap is None:
+            self.keymap = Keymap()
+        self._keymap.bind(keys, handler)
+
     #@abstractmethod
     def handle_input(self, data):
         #print('{!r} got {!r}'.format(self, data))
         return data
+
+    def handle_mouse(self, event):
+        '''Called with a :class:`MouseEvent` that happened over this element.
+        Return the event if you don't handle it, and it will be passed on to
+        our parent.
+        '''
+        return event
@@ -0,0 +1,100 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import inspect
+
+_no_value = object()
+
+
+class Binding:
+    '''Keeps an attribute of a UI element up to date with the values from a
+    source, which is either an asynchronous iterator or a callable that is
+    polled every ``interval`` seconds. Use
+    :meth:`ABCUIElement.bind_attribute` rather than creating these yourself.
+
+    :parameter element: The UI element whose attribute we set.
+    :parameter name: The name of the attribute, e.g. ``'content'``.
+    :parameter source: An asynchronous iterable, or a callable (which may
+        return an awaitable) when ``interval`` is given.
+    :parameter interval: How often to call ``source``, in seconds.
+    :parameter loop: The :mod:`asyncio` event loop to run on. (Optional,
+        defaults to the running loop.)
+
+    Each value is compared with the previous one, and if it's equal the
+    element is left alone, so that sources that mostly return the same
+    thing don't cause redraws. This means sources should return new values
+    rather than mutating the old ones in place. Whilst the element is
+    attached to a :class:`Root`, values are set via
+    :meth:`Root.call_from_thread`, so that however many bindings change at
+    once the screen is redrawn at most once per frame. Any exception raised
+    by the source stops the binding, and is passed to the loop's exception
+    handler (which logs it, by default).
+    '''
+    def __init__(self, element, name, source, interval=None, loop=None):
+        if interval is None and not hasattr(source, '__aiter__'):
+            raise TypeError(
+                'Bound source {!r} must be an asynchronous iterable, or a '
+                'callable polled at an interval'.format(source))
+        self.element = element
+        self.name = name
+        self.source = source
+        self.interval = interval
+        # Raises a RuntimeError if we aren't given a loop and there isn't one
+        # running:
+        self.loop = loop or asyncio.get_running_loop()
+        self._value = _no_value
+        self._task = self.loop.create_task(self._run())
+        self._task.add_done_callback(self._done)
+
+    @property
+    def running(self):
+        return not self._task.done()
+
+    async def _run(self):
+        if self.interval is None:
+            async for value in self.source:
+                self._receive(value)
+        else:
+            while True:
+                value = self.source()
+                if inspect.isawaitable(value):
+                    value = await value
+                self._receive(value)
+                await asyncio.sleep(self.interval)
+
+    def _done(self, task):
+        if task.cancelled() or task.exception() is None:
+            return
+        self.loop.call_exception_handler({
+            'message': 'Source of {!r} bound to {!r} failed'.format(
+                self.name, self.element),
+            'exception': task.exception(),
+            'task': task})
+
+    def _receive(self, value):
+        previous = self._value
+        if previous is not _no_value and (
+                value is previous or value == previous):
+            return
+        self._value = value
+        root = self.element.root
+        if root is not None:
+            root.call_from_thread(setattr, self.element, self.name, value)
+        else:
+            setattr(self.element, self.name, value)
+
+    def cancel(self):
+        self._task.cancel()
@@ -0,0 +1,240 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import inspect
+from bisect import bisect_left
+
+from .container_elements import Stack
+from .display_elements import Label
+from .formatting import FormatPlaceholderFactory
+
+
+_format = FormatPlaceholderFactory()
+
+
+def _is_coroutine_function(func):
+    return inspect.iscoroutinefunction(func) or (
+        inspect.iscoroutinefunction(getattr(func, '__call__', None)))
+
+
+class CompletionIndex:
+    '''A sorted index of words that can be searched by prefix.
+
+    :parameter words: The words to complete.
+
+    An index can be used directly as the ``provider`` of a :class:`Completer`,
+    and shared between any number of them. As the user types, each prefix
+    usually extends the previous one, so a :meth:`search` only looks amongst
+    its previous matches rather than the whole index; each completer keeps
+    its own search. Building a large index can take a while, so see
+    :meth:`build` for doing so without blocking the event loop.
+    '''
+    def __init__(self, words=()):
+        self._words = sorted(set(words))
+
+    def __len__(self):
+        return len(self._words)
+
+    @classmethod
+    async def build(cls, words, loop=None, executor=None):
+        '''Builds an index in a thread pool (the loop's default one, unless
+        an ``executor`` is given).
+        '''
+        loop = loop or asyncio.get_event_loop()
+        return await loop.run_in_executor(executor, cls, words)
+
+    def _range(self, prefix, start=0, end=None):
+        if end is None:
+            end = len(self._words)
+        start = bisect_left(self._words, prefix, start, end)
+        # Every word that starts with the prefix sorts before this:
+        end = bisect_left(self._words, prefix + '\U0010ffff', start, end)
+        return start, end
+
+    def _slice(self, start, end, limit):
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._words[start:end]
+
+    def complete(self, prefix, limit=None):
+        '''Returns a list of the words that start with the given prefix, in
+        order, stopping after ``limit`` of them if given.
+        '''
+        return self._slice(*self._range(prefix), limit)
+
+    def __call__(self, prefix, limit=None):
+        return self.complete(prefix, limit)
+
+    def search(self):
+        '''Returns a :class:`CompletionSearch` of this index, for a series
+        of queries as the user types.
+        '''
+        return CompletionSearch(self)
+
+
+class CompletionSearch:
+    '''A series of queries of a :class:`CompletionIndex`, each of which is
+    narrowed from the previous one's matches when its prefix extends the
+    previous prefix. It can be called (or used as a provider) just like the
+    index itself.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self._previous_prefix = None
+        self._previous_range = 0, len(index)
+
+    def complete(self, prefix, limit=None):
+        start, end = 0, None
+        previous_prefix = self._previous_prefix
+        if previous_prefix is not None and prefix.startswith(previous_prefix):
+            start, end = self._previous_range
+        start, end = self.index._range(prefix, start, end)
+        self._previous_prefix = prefix
+        self._previous_range = start, end
+        return self.index._slice(start, end, limit)
+
+    def __call__(self, prefix, limit=None):
+        return self.complete(prefix, limit)
+
+
+class Completer:
+    '''Offers completions for what's been typed into a :class:`LineInput`, in
+    a popup list that you place in your layout (e.g. just below the input).
+
+    :parameter line_input: The :class:`LineInput` to complete.
+    :parameter provider: A callable that is given the input's content and
+        the most completions we want (``max_items``), and returns an iterable
+        of completions for it, e.g. a :class:`CompletionIndex`. It may instead
+        return an awaitable (e.g. be a coroutine function), in which case the
+        completions are shown when they arrive, unless the content has changed
+        again in the meantime, in which case the stale query is cancelled.
+    :parameter max_items: The most completions to show at once.
+    :parameter loop: The :mod:`asyncio` event loop to run asynchronous
+        queries on. (Optional, defaults to the loop of the input's
+        :class:`Root`, or else the running loop.)
+
+    Whilst completions are shown, :kbd:`Up` and :kbd:`Down` choose between
+    them and :kbd:`Tab` accepts the chosen one.
+    '''
+    selected_format = _format.reverse
+
+    def __init__(self, line_input, provider, max_items=5, loop=None):
+        self.line_input = line_input
+        self.provider = provider
+        # An index may be shared, so we keep our own narrowing search of it:
+        if isinstance(provider, CompletionIndex):
+            self._search = provider.search()
+        else:
+            self._search = provider
+        self.loop = loop
+        self.max_items = max_items
+        self.popup = Stack()
+        self.completions = []
+        self.selected = 0
+        self._task = None
+        self._accepting = False
+        self._previous_callback = line_input.content_updated_callback
+        line_input.content_updated_callback = self._content_updated
+        line_input.bind('up', lambda: self.move_selection(-1))
+        line_input.bind('down', lambda: self.move_selection(1))
+        line_input.bind('tab', self.accept)
+
+    def _content_updated(self, line_buffer):
+        if self._previous_callback:
+            self._previous_callback(line_buffer)
+        if not self._accepting:
+            self.query(line_buffer.content)
+
+    def query(self, text):
+        '''Asks our provider for completions of the given text, cancelling
+        any query that's still outstanding.
+        '''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if not text:
+            self.show([])
+            return
+        if _is_coroutine_function(self._search):
+            # We only call the provider once the task starts, so that if the
+            # query is cancelled before then there's no coroutine left
+            # un-awaited:
+            self._task = self._get_loop().create_task(
+                self._await_completions(text))
+            return
+        completions = self._search(text, self.max_items)
+        if inspect.isawaitable(completions):
+            self._task = self._get_loop().create_task(
+                self._await_completions(completions=completions))
+        else:
+            self.show(completions)
+
+    def _get_loop(self):
+        if self.loop is not None:
+            return self.loop
+        if self.line_input.root is not None:
+            return self.line_input.root.loop
+        # Raises a RuntimeError if there isn't a loop running either:
+        return asyncio.get_running_loop()
+
+    async def _await_completions(self, text=None, completions=None):
+        if completions is None:
+            completions = self._search(text, self.max_items)
+        completions = await completions
+        self._task = None
+        self.show(completions)
+
+    def show(self, completions):
+        '''Shows the given completions in the popup.
+        '''
+        self.completions = []
+        for completion in completions:
+            if len(self.completions) == self.max_items:
+                break
+            self.completions.append(completion)
+        self.selected = 0
+        self._update_popup()
+
+    def _update_popup(self):
+        labels = []
+        for i, completion in enumerate(self.completions):
+            label = Label(completion)
+            if i == self.selected:
+                label.default_format = self.selected_format
+            labels.append(label)
+        self.popup.content = labels
+
+    def move_selection(self, delta):
+        if not self.completions:
+            return False
+        self.selected = (self.selected + delta) % len(self.completions)
+        self._update_popup()
+
+    def accept(self):
+        '''Replaces the input's content with the chosen completion.
+        '''
+        if not self.completions:
+            return False
+        completion = self.completions[self.selected]
+        line_buffer = self.line_input.line_buffer
+        self._accepting = True
+        try:
+            line_buffer.content = completion
+        finally:
+            self._accepting = False
+        line_buffer.cursor_position = len(completion)
+        self.line_input.updated = True
+        self.show([])
@@ -15,23 +15,51 @@
 
 from abc import abstractmethod, abstractproperty
 
+from . import profiling
 from .base import ABCUIElement, Block
-from .util import weighted_round_robin
+from .util import weighted_round_robin, FenwickTree
 
 
 class ABCContainerElement(ABCUIElement):
-    def __init__(self, *elements, **kwargs):
+    '''
+    :parameter elements: Our initial child elements.
+    :parameter source: An optional iterable or asynchronous iterable of
+        further child elements, which will be added after ``elements``. See
+        :attr:`source`.
+    '''
+    def __init__(self, *elements, source=None, **kwargs):
         self._content = []
-        self.active_element = None
+        self._active_element = None
         self._root = None
         self._updated = True
+        # The size constraints of each child that we took into account when we
+        # last laid ourselves out, keyed by child:
+        self._layout_keys = {}
+        self._layout_invalid = True
+        self._source = None
+        self._async_source = None
+        self._source_task = None
         super().__init__(**kwargs)
         for element in elements:
             self.add_element(element)
+        if source is not None:
+            self.source = source
 
     def __iter__(self):
         return iter(self._content)
 
+    @property
+    def active_element(self):
+        '''The child that keyboard input is routed to.
+        '''
+        return self._active_element
+
+    @active_element.setter
+    def active_element(self, element):
+        self._active_element = element
+        # Focus may have moved, so different key bindings may apply:
+        self._key_bindings_changed()
+
     def __len__(self):
         return len(self._content)
 
@@ -47,9 +75,75 @@ class ABCContainerElement(ABCUIElement):
 
     @content.setter
     def content(self, value):
+        self._detach_elements(self._content, value)
         self._content = value
-        if self.root:
-            self.root.draw()
+        for element in value:
+            element.root = self.root
+            element.parent = self
+        self._membership_changed()
+
+    @property
+    def source(self):
+        '''A lazy source of further child elements, which are only
+        *materialized*, i.e. taken from the source and added to us, when we
+        need them. If the source is a normal iterable, we only take as many
+        elements from it as we need to lay ourselves out (a :class:`Stack`
+        only takes enough to fill its height). If it is an asynchronous
+        iterable, once we are attached to a :class:`Root` its elements are
+        added as they arrive, on the root's event loop. Our length, iteration
+        and size constraints only ever reflect materialized children.
+
+        A lazy :class:`Stack` has no height of its own to fill when its
+        parent gives it its minimum height (e.g. when it's inside another
+        :class:`Stack`), so there it only ever materializes its first child.
+        Put it somewhere that decides its height, such as a split container,
+        instead.
+        '''
+        return self._source or self._async_source
+
+    @source.setter
+    def source(self, value):
+        if self._source_task is not None:
+            self._source_task.cancel()
+            self._source_task = None
+        self._source = self._async_source = None
+        if hasattr(value, '__aiter__'):
+            self._async_source = value
+            self._start_async_source()
+        elif value is not None:
+            self._source = iter(value)
+            self._invalidate_layout()
+
+    def _materialize(self, count=None):
+        '''Takes up to ``count`` more children (or all of them, if ``count``
+        is ``None``) from our synchronous :attr:`source`. This happens as part
+        of laying ourselves out, so we only let our parent know that our size
+        constraints may have changed. Returns the number of children we added.
+        '''
+        added = 0
+        while self._source is not None and (count is None or added < count):
+            try:
+                element = next(self._source)
+            except StopIteration:
+                self._source = None
+            else:
+                self._add_element(element)
+                added += 1
+        if added:
+            self._size_constraints_changed()
+        return added
+
+    def _start_async_source(self):
+        if (self._async_source is not None and self._source_task is None and
+                self.root is not None):
+            self._source_task = self.root.loop.create_task(
+                self._consume_async_source())
+
+    async def _consume_async_source(self):
+        async for element in self._async_source:
+            self.add_element(element)
+        self._async_source = None
+        self._source_task = None
 
     @property
     def root(self):
@@ -57,9 +151,10 @@ class ABCContainerElement(ABCUIElement):
 
     @root.setter
     def root(self, root_element):
-        self._root = root_element
+        ABCUIElement.root.fset(self, root_element)
         for element in self:
             element.root = root_element
+        self._start_async_source()
 
     @property
     def updated(self):
@@ -71,6 +166,31 @@ class ABCContainerElement(ABCUIElement):
         if value and self.root:
             self.root.update()
 
+    def _layout_key(self, element):
+        '''Returns the size constraints of the given child element that
+        affect how we lay out our children. If these change, we need to lay
+        ourselves out again; otherwise only the child itself needs redrawing.
+        '''
+        return (
+            element.min_width, element.max_width, element.min_height,
+            element.max_height)
+
+    def _invalidate_layout(self):
+        '''Marks us as needing to lay out our children again at the next
+        update. Only this subtree is redrawn, within the geometry we were last
+        allocated.
+        '''
+        self._layout_invalid = True
+        self.updated = True
+
+    def _child_size_constraints_changed(self, element):
+        # Our own constraints are typically derived from our children's, so
+        # our parent gets to check whether it is affected first:
+        self._size_constraints_changed()
+        if element in self._layout_keys and (
+                self._layout_key(element) != self._layout_keys[element]):
+            self._invalidate_layout()
+
     @abstractmethod
     def _get_elements_and_parameters(
             self, width, height, x, y, default_format):
@@ -78,46 +198,91 @@ class ABCContainerElement(ABCUIElement):
         width, height, x and y position and default_format.
         '''
 
-    def add_element(self, element):
+    def _membership_changed(self):
+        self._size_constraints_changed()
+        self._invalidate_layout()
+        # Elements may have gained or lost ancestors, and so key bindings:
+        self._key_bindings_changed()
+
+    @staticmethod
+    def _detach_elements(elements, remaining):
+        # Detached elements mustn't keep hold of our root, e.g. so that
+        # animated ones stop asking its frame clock for frames:
+        remaining = set(remaining)
+        for element in elements:
+            if element not in remaining:
+                element.parent = None
+                element.root = None
+
+    def _add_element(self, element):
         self._content.append(element)
         if self.active_element is None:
             self.active_element = element
         element.root = self.root
-        if self.root:
-            self.root.draw()
+        element.parent = self
+
+    def add_element(self, element):
+        self._add_element(element)
+        self._membership_changed()
 
     def remove_element(self, element):
         self._content.remove(element)
         if element is self.active_element:
             self.active_element = None
-        self.updated = True
+        self._detach_elements([element], self._content)
+        self._membership_changed()
 
     def replace_element(self, old_element, new_element):
         i = self._content.index(old_element)
         self._content[i] = new_element
         if old_element is self.active_element:
             self.active_element = new_element
+        self._detach_elements([old_element], self._content)
         new_element.root = self.root
-        if self.root:
-            self.root.draw()
+        new_element.parent = self
+        self._membership_changed()
 
     def _get_all_blocks(
             self, width, height, x=0, y=0, x_crop=None, y_crop=None,
             default_format=None):
-        blocks = [Block(x, y, [' ' * width] * height, default_format)]
         x_crop = x_crop or self._halign
         y_crop = y_crop or self._valign
-        for element, width, height, x, y, default_format in (
-                self._get_elements_and_parameters(
-                    width, height, x, y, default_format)):
+        # Laying out our children may materialize some of their children,
+        # changing their size constraints, in which case we lay them out
+        # again straight away (sources only ever shrink, so this settles):
+        self._layout_invalid = True
+        while self._layout_invalid:
+            self._layout_invalid = False
+            blocks = self._layout(
+                width, height, x, y, x_crop, y_crop, default_format)
+        return blocks
+
+    def _layout(self, width, height, x, y, x_crop, y_crop, default_format):
+        blocks = [Block(x, y, [' ' * width] * height, default_format, self)]
+        self._layout_keys = {}
+        parameters = self._get_elements_and_parameters(
+            width, height, x, y, default_format)
+        profiler = profiling.active_profiler
+        if profiler:
+            parameters = profiler.profile_iterator(
+                self, '_get_elements_and_parameters', parameters)
+        for element, width, height, x, y, default_format in parameters:
+            self._layout_keys[element] = self._layout_key(element)
             blocks.extend(element.get_all_blocks(
                 width, height, x, y, x_crop=x_crop, y_crop=y_crop,
                 default_format=default_format))
         return blocks
 
     def _get_updated_blocks(self, default_format):
+        if self._layout_invalid:
+            if self.root is not None:
+                self.root.layout_changed()
+            return self._get_all_blocks(
+                *self._previous_geometry, default_format=default_format)
         blocks = []
-        for element in self:
+        # Only the children we actually laid out have anything on screen to
+        # update:
+        for element in self._layout_keys:
             blocks.extend(element.get_updated_blocks(default_format))
         return blocks
 
@@ -129,8 +294,8 @@ class ABCContainerElement(ABCUIElement):
 
 
 class Box(ABCContainerElement):
-    min_width = 2
-    min_height = 2
+    _min_width = 2
+    _min_height = 2
 
     def __init__(self, content, chars=None, **kwargs):
         super().__init__(content, **kwargs)
@@ -172,6 +337,9 @@ class Box(ABCContainerElement):
     def max_height(self):
         return self.active_element.max_height + 2
 
+    def _layout_key(self, element):
+        return ()
+
     def _get_elements_and_parameters(
             self, width, height, x, y, default_format):
         yield (
@@ -187,16 +355,29 @@ class Box(ABCContainerElement):
             self._bottom_right]
         right = [self._right] * (height - 2)
         blocks.extend([
-            Block(x, y, top, self.default_format),
-            Block(x, y + 1, left, self.default_format),
-            Block(x, y + height - 1, bottom, self.default_format),
-            Block(x + width - 1, y + 1, right, self.default_format)])
+            Block(x, y, top, self.default_format, self),
+            Block(x, y + 1, left, self.default_format, self),
+            Block(x, y + height - 1, bottom, self.default_format, self),
+            Block(x + width - 1, y + 1, right, self.default_format, self)])
         return blocks
 
 
 class Stack(ABCContainerElement):
+    '''Lays out its children one above the other, giving each its minimum
+    height. The heights of the children are indexed so that finding the child
+    at a given line offset, and starting layout from an arbitrary
+    :attr:`offset`, take time logarithmic in the number of children.
+    '''
     _possible_valigns = 'top', 'bottom'
 
+    def __init__(self, *elements, **kwargs):
+        self._heights = FenwickTree()
+        # The indices at which each child appears in our content, or None if
+        # they need working out again:
+        self._indices = {}
+        self._offset = 0
+        super().__init__(*elements, **kwargs)
+
     @property
     def min_width(self):
         try:
@@ -207,35 +388,144 @@ class Stack(ABCContainerElement):
 
     @property
     def min_height(self):
-        return sum(element.min_height or 1 for element in self)
+        return self._heights.total
 
-    def _get_elements_and_parameters(
+    @staticmethod
+    def _element_height(element):
+        return element.min_height or 1
+
+    @ABCContainerElement.content.setter
+    def content(self, value):
+        self._heights = FenwickTree(
+            self._element_height(element) for element in value)
+        self._indices = None
+        ABCContainerElement.content.fset(self, value)
+
+    def _element_indices(self, element):
+        '''Returns the indices at which the given child appears in our
+        content (the same element may appear more than once).
+        '''
+        if self._indices is None:
+            self._indices = {}
+            for index, child in enumerate(self._content):
+                self._indices.setdefault(child, []).append(index)
+        return self._indices.get(element, ())
+
+    def _add_element(self, element):
+        self._heights.append(self._element_height(element))
+        if self._indices is not None:
+            self._indices.setdefault(element, []).append(len(self._content))
+        super()._add_element(element)
+
+    def remove_element(self, element):
+        indices = self._element_indices(element)
+        if indices:
+            del self._heights[indices[0]]
+        # Everything after the removed element moves up:
+        self._indices = None
+        super().remove_element(element)
+
+    def replace_element(self, old_element, new_element):
+        index = self._content.index(old_element)
+        self._heights[index] = self._element_height(new_element)
+        self._indices = None
+        super().replace_element(old_element, new_element)
+
+    def _child_size_constraints_changed(self, element):
+        height = self._element_height(element)
+        for index in self._element_indices(element):
+            self._heights[index] = height
+        super()._child_size_constraints_changed(element)
+
+    def _layout_key(self, element):
+        return (element.min_height,)
+
+    @property
+    def offset(self):
+        '''The number of lines of our content that are scrolled out of view
+        beyond our aligned edge (i.e. off the top when top-aligned, or off the
+        bottom when bottom-aligned). Layout always starts at the beginning of a
+        child, so an offset part way through a child is rounded down to the
+        start of that child.
+        '''
+        return self._offset
+
+    @offset.setter
+    def offset(self, value):
+        self._offset = max(value, 0)
+        self._invalidate_layout()
+
+    def row_at_offset(self, offset):
+        '''Returns the index of the child that covers the given line offset,
+        counted from the top of our content.
+        '''
+        if not 0 <= offset < self._heights.total:
+            raise IndexError(
+                'Offset {} is outside the content of {!r}'.format(
+                    offset, self))
+        return self._heights.find(offset)
+
+    def offset_of_row(self, index):
+        '''Returns the line offset at which the child at the given index
+        starts, counted from the top of our content.
+        '''
+        return self._heights.prefix_sum(index)
+
+    def scroll_to(self, index):
+        '''Scrolls so that the child at the given index is the first one
+        displayed at our aligned edge.
+        '''
+        if self.valign == 'top':
+            self.offset = self.offset_of_row(index)
+        else:
+            self.offset = self._heights.total - self.offset_of_row(index + 1)
+
+    def _get_indexed_elements_and_parameters(
             self, width, height, x, y, default_format):
         if self.valign == 'top':
+            # Make sure we have enough children to reach our offset:
+            while self._heights.total <= self._offset and self._materialize(1):
+                pass
+            total = self._heights.total
+            offset = min(self._offset, max(total - 1, 0))
+            index = self._heights.find(offset)
             current_y = y
-            for element in self:
-                elem_height = min(height, element.min_height or 1)
-                if elem_height:
-                    yield (
-                        element, width, elem_height, x, current_y,
-                        default_format)
-                    current_y += elem_height
-                    height -= elem_height
-                else:
+            while height > 0:
+                if index == len(self) and not self._materialize(1):
                     break
+                element = self._content[index]
+                elem_height = min(height, self._heights[index])
+                yield (
+                    index, element, width, elem_height, x, current_y,
+                    default_format)
+                current_y += elem_height
+                height -= elem_height
+                index += 1
         elif self.valign == 'bottom':
+            # We're laid out from our end, so we need all our children:
+            self._materialize()
+            total = self._heights.total
+            offset = min(self._offset, max(total - 1, 0))
             current_y = y + height
-            for element in reversed(self._content):
-                elem_height = min(height, element.min_height or 1)
+            last = min(self._heights.find(total - offset - 1), len(self) - 1)
+            for index in range(last, -1, -1):
+                element = self._content[index]
+                elem_height = min(height, self._heights[index])
                 if elem_height:
                     current_y -= elem_height
                     yield (
-                        element, width, elem_height, x, current_y,
+                        index, element, width, elem_height, x, current_y,
                         default_format)
                     height -= elem_height
                 else:
                     break
 
+    def _get_elements_and_parameters(
+            self, width, height, x, y, default_format):
+        for index, *parameters in self._get_indexed_elements_and_parameters(
+                width, height, x, y, default_format):
+            yield parameters
+
 
 class Zebra(Stack):
     def __init__(self, *args, odd_format=None, even_format=None, **kwargs):
@@ -249,11 +539,14 @@ class Zebra(Stack):
 
     def _get_elements_and_parameters(
             self, width, height, x, y, default_format):
-        parent = super()._get_elements_and_parameters(
+        parent = self._get_indexed_elements_and_parameters(
             width, height, x, y, default_format)
-        for i, (element, width, height, x, y, default_format) in enumerate(
-                parent):
-            zebra_format = self._formats[i % 2]
+        for index, element, width, height, x, y, default_format in parent:
+            # Count from our aligned edge so that stripes stay put when we
+            # scroll:
+            if self.valign == 'bottom':
+                index = len(self) - 1 - index
+            zebra_format = self._formats[index % 2]
             if zebra_format:
                 if default_format:
                     default_format = default_format + zebra_format
@@ -282,15 +575,31 @@ class SplitContainer(ABCContainerElement):
         self._min_height = None
         self._max_height = None
 
-    def add_element(self, element, weight=1):
+    def _add_element(self, element, weight=1):
         self._weights.append(weight)
-        super().add_element(element)
+        super()._add_element(element)
+
+    def add_element(self, element, weight=1):
+        self._add_element(element, weight)
+        self._membership_changed()
 
     def remove_element(self, element):
         index = self._content.index(element)
         del self._weights[index]
         super().remove_element(element)
 
+    def set_weight(self, element, weight):
+        '''Changes the weight with which spare space is allocated to the given
+        child element.
+        '''
+        self._weights[self._content.index(element)] = weight
+        self._invalidate_layout()
+
+    def _layout_key(self, element):
+        return (
+            element.get_min_size(self._dimension),
+            element.get_max_size(self._dimension))
+
     def get_min_size(self, dimension):
         override_min = getattr(self, '_min_' + dimension)
         if override_min:
@@ -310,6 +619,7 @@ class SplitContainer(ABCContainerElement):
     @min_width.setter
     def min_width(self, value):
         self._min_width = value
+        self._size_constraints_changed()
 
     @property
     def min_height(self):
@@ -318,6 +628,7 @@ class SplitContainer(ABCContainerElement):
     @min_height.setter
     def min_height(self, value):
         self._min_height = value
+        self._size_constraints_changed()
 
     def get_max_size(self, dimension):
         override_max = getattr(self, '_max_' + dimension)
@@ -338,6 +649,7 @@ class SplitContainer(ABCContainerElement):
     @max_width.setter
     def max_width(self, value):
         self._max_width = value
+        self._size_constraints_changed()
 
     @property
     def max_height(self):
@@ -346,6 +658,7 @@ class SplitContainer(ABCContainerElement):
     @max_height.setter
     def max_height(self, value):
         self._max_height = value
+        self._size_constraints_changed()
 
     def _calculate_element_sizes(self, size):
         allocated_size = 0
@@ -371,6 +684,8 @@ class SplitContainer(ABCContainerElement):
 
     def _get_elements_and_parameters(
             self, width, height, x, y, default_format):
+        # How we share out space depends on all our children:
+        self._materialize()
         size = height if self._dimension == 'height' else width
         processed_size = 0
         for element, size in self._calculate_element_sizes(size):
@@ -391,3 +706,230 @@ class HorizontalSplitContainer(SplitContainer):
 
 class VerticalSplitContainer(SplitContainer):
     _dimension = 'width'
+
+
+class GridTrack:
+    '''Describes how a row or column of a :class:`Grid` is sized. A track
+    with a fixed ``size`` is always exactly that size; otherwise the track is
+    given at least ``min_size``, and any spare space is shared out between
+    such flexible tracks in proportion to their ``weight``, up to their
+    ``max_size``.
+    '''
+    def __init__(self, size=None, weight=1, min_size=0, max_size=None):
+        self.size = size
+        self.weight = weight
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def __repr__(self):
+        return (
+            '{}(size={!r}, weight={!r}, min_size={!r}, '
+            'max_size={!r})'.format(
+                self.__class__.__name__, self.size, self.weight,
+                self.min_size, self.max_size))
+
+    @property
+    def minimum(self):
+        return self.min_size if self.size is None else self.size
+
+    @property
+    def maximum(self):
+        return self.max_size if self.size is None else self.size
+
+
+class Grid(ABCContainerElement):
+    '''Lays out its children in cells of a grid of rows and columns, each of
+    which is sized according to a :class:`GridTrack`. Children may span
+    several rows and/or columns. The sizes of the tracks depend only on the
+    space we are given, so they are calculated once for each geometry and
+    cached, and children's own size constraints don't affect the layout.
+
+    :parameter columns: Either a list of :class:`GridTrack` objects, or the
+        number of equally weighted columns we should have.
+    :parameter rows: As for ``columns``.
+    '''
+    def __init__(self, *elements, columns=1, rows=1, **kwargs):
+        self._columns = self._make_tracks(columns)
+        self._rows = self._make_tracks(rows)
+        self._cells = []
+        self._occupied = set()
+        self._next_cell = 0
+        self._track_cache = None
+        super().__init__(*elements, **kwargs)
+
+    @staticmethod
+    def _make_tracks(tracks):
+        if isinstance(tracks, int):
+            return [GridTrack() for _ in range(tracks)]
+        return list(tracks)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @columns.setter
+    def columns(self, tracks):
+        self._columns = self._make_tracks(tracks)
+        self._tracks_changed()
+
+    @property
+    def rows(self):
+        return list(self._rows)
+
+    @rows.setter
+    def rows(self, tracks):
+        self._rows = self._make_tracks(tracks)
+        self._tracks_changed()
+
+    def _tracks_changed(self):
+        self._track_cache = None
+        self._size_constraints_changed()
+        self._invalidate_layout()
+
+    @staticmethod
+    def _covered_cells(row, column, row_span, column_span):
+        return {
+            (r, c) for r in range(row, row + row_span) for
+            c in range(column, column + column_span)}
+
+    def _next_free_cell(self):
+        num_columns = len(self._columns)
+        for i in range(self._next_cell, num_columns * len(self._rows)):
+            row, column = divmod(i, num_columns)
+            if (row, column) not in self._occupied:
+                self._next_cell = i + 1
+                return row, column
+        raise ValueError('No free cells left in {!r}'.format(self))
+
+    def add_element(
+            self, element, row=None, column=None, row_span=1, column_span=1):
+        '''Adds an element to the cell at the given row and column, spanning
+        the given number of rows and columns. If no row and column are given,
+        the element is placed in the next free cell, working along each row
+        in turn.
+        '''
+        self._add_element(element, row, column, row_span, column_span)
+        self._membership_changed()
+
+    def _add_element(
+            self, element, row=None, column=None, row_span=1, column_span=1):
+        if row is None or column is None:
+            row, column = self._next_free_cell()
+        covered = self._covered_cells(row, column, row_span, column_span)
+        if (row < 0 or column < 0 or row_span < 1 or column_span < 1 or
+                row + row_span > len(self._rows) or
+                column + column_span > len(self._columns) or
+                covered & self._occupied):
+            raise ValueError(
+                "Can't place {!r} at row {}, column {} spanning {}x{} cells "
+                "in {!r}".format(
+                    element, row, column, row_span, column_span, self))
+        self._cells.append((row, column, row_span, column_span))
+        self._occupied |= covered
+        super()._add_element(element)
+
+    @ABCContainerElement.content.setter
+    def content(self, value):
+        '''Replaces all our children, placing each new child in the next free
+        cell in turn, as :meth:`add_element` does.
+        '''
+        self._detach_elements(self._content, value)
+        self._content = []
+        self._cells = []
+        self._occupied = set()
+        self._next_cell = 0
+        self.active_element = None
+        for element in value:
+            self._add_element(element)
+        self._membership_changed()
+
+    def _materialize(self, count=None):
+        # Only take as many children as there are free cells to put them in:
+        free = len(self._rows) * len(self._columns) - len(self._occupied)
+        if count is None or count > free:
+            count = free
+        return super()._materialize(count)
+
+    def remove_element(self, element):
+        index = self._content.index(element)
+        self._occupied -= self._covered_cells(*self._cells[index])
+        del self._cells[index]
+        # Allow the freed cells to be filled again:
+        self._next_cell = 0
+        super().remove_element(element)
+
+    @property
+    def min_width(self):
+        return sum(track.minimum for track in self._columns)
+
+    @property
+    def min_height(self):
+        return sum(track.minimum for track in self._rows)
+
+    def _get_max_size(self, tracks):
+        maximums = [track.maximum for track in tracks]
+        if None not in maximums:
+            return sum(maximums)
+
+    @property
+    def max_width(self):
+        return self._get_max_size(self._columns)
+
+    @property
+    def max_height(self):
+        return self._get_max_size(self._rows)
+
+    @staticmethod
+    def _size_tracks(tracks, size):
+        '''Returns the offsets at which each of the given tracks starts, plus
+        the offset at which the last one ends.
+        '''
+        sizes = [track.minimum for track in tracks]
+        spare = size - sum(sizes)
+        flexible = [
+            (i, track.weight) for i, track in enumerate(tracks) if
+            track.size is None and track.weight > 0]
+        total_weight = sum(weight for _, weight in flexible)
+        stalled = 0
+        if flexible:
+            for i in weighted_round_robin(flexible):
+                if spare <= 0 or stalled >= total_weight:
+                    break
+                max_size = tracks[i].max_size
+                if max_size is None or sizes[i] < max_size:
+                    sizes[i] += 1
+                    spare -= 1
+                    stalled = 0
+                else:
+                    stalled += 1
+        offsets = [0]
+        for track_size in sizes:
+            offsets.append(offsets[-1] + track_size)
+        return offsets
+
+    def _get_track_offsets(self, width, height):
+        if self._track_cache is None or self._track_cache[:2] != (
+                width, height):
+            self._track_cache = (
+                width, height, self._size_tracks(self._columns, width),
+                self._size_tracks(self._rows, height))
+        return self._track_cache[2:]
+
+    def _layout_key(self, element):
+        return ()
+
+    def _get_elements_and_parameters(
+            self, width, height, x, y, default_format):
+        self._materialize()
+        column_offsets, row_offsets = self._get_track_offsets(width, height)
+        for element, (row, column, row_span, column_span) in zip(
+                self, self._cells):
+            elem_x = column_offsets[column]
+            elem_y = row_offsets[row]
+            elem_width = min(
+                column_offsets[column + column_span], width) - elem_x
+            elem_height = min(row_offsets[row + row_span], height) - elem_y
+            if elem_width > 0 and elem_height > 0:
+                yield (
+                    element, elem_width, elem_height, x + elem_x, y + elem_y,
+                    default_format)
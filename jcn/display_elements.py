@@ -15,6 +15,7 @@
 
 from abc import abstractmethod
 
+from . import profiling
 from .base import ABCUIElement, Block
 from .util import clamp, crop_or_expand
 from .textwrap import wrap
@@ -56,13 +57,58 @@ class ABCDisplayElement(ABCUIElement):
             self, width, height, x, y, x_crop, y_crop, default_format):
         full_width = clamp(width, min_=self.min_width, max_=self.max_width)
         full_height = clamp(height, min_=self.min_height, max_=self.max_height)
+        profiler = profiling.active_profiler
+        if profiler:
+            profiler.enter(self, '_get_lines')
         lines = self._get_lines(full_width, full_height)
+        if profiler:
+            profiler.exit()
+            profiler.enter(self, '_do_crop')
         lines = self._do_crop(
             lines, full_width, full_height, self._halign, self._valign)
         # Perform an additional crop with *different alignment* to resize the
         # UI element's rendered area text to the required area:
         lines = self._do_crop(lines, width, height, x_crop, y_crop)
-        return [Block(x, y, lines, default_format)]
+        if profiler:
+            profiler.exit()
+        return [Block(x, y, lines, default_format, self)]
+
+
+class _Animated:
+    '''Mixin for display elements that animate, which subscribes
+    :meth:`_on_frame` to the root's :attr:`Root.frame_clock` whilst the
+    element is both attached to a root and :attr:`_animating`.
+    '''
+    _root = None
+    _animating = False
+
+    @property
+    def root(self):
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._unsubscribe()
+        ABCUIElement.root.fset(self, root)
+        self._subscribe()
+
+    def _set_animating(self, animating):
+        self._unsubscribe()
+        self._animating = animating
+        self._subscribe()
+
+    def _subscribe(self):
+        if self._root is not None and self._animating:
+            self._root.frame_clock.subscribe(self._on_frame)
+
+    def _unsubscribe(self):
+        if self._root is not None and self._animating:
+            self._root.frame_clock.unsubscribe(self._on_frame)
+
+    def _on_frame(self, frame_time):
+        self._frame_time = frame_time
+        self.updated = True
+        self.root.update()
 
 
 class Fill(ABCDisplayElement):
@@ -86,6 +132,8 @@ class Text(ABCDisplayElement):
 
     @content.setter
     def content(self, value):
+        if value == self._content:
+            return
         self._content = value
         self.updated = True
         if self.root:
@@ -103,18 +151,62 @@ class Text(ABCDisplayElement):
 
 
 class Label(Text):
-    min_height = max_height = 1
+    _min_height = _max_height = 1
 
     def _get_lines(self, width, height):
         return [self.content]
 
 
-class ProgressBar(ABCDisplayElement):
-    min_width = 3
-    min_height = 1
-    max_height = 1
+class Spinner(_Animated, ABCDisplayElement):
+    '''A single character that cycles through ``chars`` to show that
+    something is happening, changing every ``interval`` seconds whilst
+    :attr:`spinning`.
+    '''
+    _min_height = _max_height = 1
 
-    def __init__(self, chars=None):
+    def __init__(self, chars='|/-\\', interval=0.1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chars = chars
+        self.interval = interval
+        self._frame_time = 0
+        self.spinning = True
+
+    @property
+    def spinning(self):
+        return self._animating
+
+    @spinning.setter
+    def spinning(self, value):
+        self._set_animating(value)
+
+    def _index(self, frame_time):
+        return int(frame_time / self.interval) % len(self.chars)
+
+    def _on_frame(self, frame_time):
+        # The frame clock probably ticks faster than we change:
+        if self._index(frame_time) != self._index(self._frame_time):
+            super()._on_frame(frame_time)
+
+    def _get_lines(self, width, height):
+        return [self.chars[self._index(self._frame_time)]]
+
+
+class ProgressBar(_Animated, ABCDisplayElement):
+    '''
+    :parameter chars: The characters to draw the bar with: the start cap,
+        the background, one or more characters for increasing amounts of
+        progress, and the end cap.
+    :parameter indeterminate: Whether to show that something is happening,
+        without knowing how far through it we are, by sweeping a block back
+        and forth instead of filling the bar by :attr:`fraction`.
+    '''
+    _min_width = 3
+    _min_height = 1
+    _max_height = 1
+    # The time taken to sweep back and forth in indeterminate mode:
+    sweep_period = 2
+
+    def __init__(self, chars=None, indeterminate=False):
         super().__init__()
         if not chars or len(chars) < 4:
             chars = '[ -=]'
@@ -123,6 +215,17 @@ class ProgressBar(ABCDisplayElement):
         self._bg_char = chars[1]
         self._progress_chars = chars[2:-1]
         self._fraction = 0
+        self._frame_time = 0
+        self.indeterminate = indeterminate
+
+    @property
+    def indeterminate(self):
+        return self._animating
+
+    @indeterminate.setter
+    def indeterminate(self, value):
+        self._set_animating(value)
+        self.updated = True
 
     @property
     def fraction(self):
@@ -130,7 +233,10 @@ class ProgressBar(ABCDisplayElement):
 
     @fraction.setter
     def fraction(self, value):
-        self._fraction = clamp(value, 0, 1)
+        value = clamp(value, 0, 1)
+        if value == self._fraction:
+            return
+        self._fraction = value
         self.updated = True
         if self.root:
             self.root.update()
@@ -138,6 +244,13 @@ class ProgressBar(ABCDisplayElement):
     def _get_lines(self, width, height):
         width = max(width, self.min_width) - 2
         chars = [self._bg_char] * width
+        if self.indeterminate:
+            block = max(width // 4, 1)
+            phase = self._frame_time % self.sweep_period / self.sweep_period
+            start = round((width - block) * (1 - abs(1 - 2 * phase)))
+            chars[start:start + block] = self._progress_chars[-1] * block
+            return ['{}{}{}'.format(
+                self._start_cap, ''.join(chars), self._end_cap)]
         filled = self._fraction * width
         over = filled - int(filled)
         filled = int(filled)
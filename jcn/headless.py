@@ -0,0 +1,216 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import re
+from io import StringIO
+
+from .terminal import Terminal
+
+
+_escape_sequence = re.compile(
+    r'\x1b\[([0-9;?]*)([@-~])|\x1b\(.|\x1b.?|([^\x1b\r\n]+)|(\r|\n)')
+
+# The attribute that each simple SGR parameter turns on:
+_sgr_attributes = {
+    1: 'bold', 2: 'dim', 3: 'italic', 4: 'underline', 5: 'blink',
+    7: 'reverse', 8: 'hidden', 9: 'strikethrough'}
+# ...and the attributes that each SGR parameter turns off:
+_sgr_resets = {
+    22: {'bold', 'dim'}, 23: {'italic'}, 24: {'underline'}, 25: {'blink'},
+    27: {'reverse'}, 28: {'hidden'}, 29: {'strikethrough'}}
+
+_no_attributes = frozenset()
+
+
+class Screen:
+    '''An in-memory grid of character cells, each with a set of attributes,
+    that can be written to like a terminal's stream: text is put in the
+    cells at the cursor, and the escape sequences that :mod:`jcn` writes
+    (cursor movement and text formatting) are interpreted rather than
+    stored.
+
+    Each cell's attributes are a frozenset of strings such as ``'bold'``,
+    ``'reverse'``, ``'fg 1'`` (for foreground colour 1) or ``'bg 200'``.
+    '''
+    def __init__(self, width=80, height=24, fillchar=' '):
+        self.fillchar = fillchar
+        self.width = width
+        self.height = height
+        self.x = self.y = 0
+        self.attributes = _no_attributes
+        self.clear()
+
+    def clear(self):
+        self.chars = [
+            [self.fillchar] * self.width for _ in range(self.height)]
+        self.cell_attributes = [
+            [_no_attributes] * self.width for _ in range(self.height)]
+
+    def resize(self, width, height):
+        '''Changes the size of the screen, keeping the contents of the cells
+        that are still on it.
+        '''
+        chars, cell_attributes = self.chars, self.cell_attributes
+        self.width, self.height = width, height
+        self.clear()
+        for y in range(min(height, len(chars))):
+            row = chars[y][:width]
+            self.chars[y][:len(row)] = row
+            row = cell_attributes[y][:width]
+            self.cell_attributes[y][:len(row)] = row
+
+    def write(self, data):
+        for match in _escape_sequence.finditer(data):
+            parameters, command, text, control = match.groups()
+            if text is not None:
+                self._put_text(text)
+            elif command is not None:
+                self._control_sequence(parameters, command)
+            elif control == '\n':
+                self.x, self.y = 0, self.y + 1
+            elif control == '\r':
+                self.x = 0
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _put_text(self, text):
+        if not 0 <= self.y < self.height:
+            self.x += len(text)
+            return
+        start = max(self.x, 0)
+        end = min(self.x + len(text), self.width)
+        if start < end:
+            self.chars[self.y][start:end] = text[start - self.x:end - self.x]
+            self.cell_attributes[self.y][start:end] = (
+                [self.attributes] * (end - start))
+        self.x += len(text)
+
+    def _control_sequence(self, parameters, command):
+        if parameters.startswith('?'):
+            # Private modes, e.g. the alternate screen or hiding the cursor:
+            return
+        numbers = [int(p) if p else 0 for p in parameters.split(';')]
+        if command in 'Hf':
+            row = numbers[0] if numbers[0] else 1
+            column = numbers[1] if len(numbers) > 1 and numbers[1] else 1
+            self.x, self.y = column - 1, row - 1
+        elif command == 'm':
+            self._select_graphic_rendition(numbers)
+        elif command == 'J' and numbers[0] == 2:
+            self.clear()
+        elif command == 'K' and 0 <= self.y < self.height:
+            # Erase to the end of the line, to the cursor, or the whole line:
+            start, end = {
+                0: (self.x, self.width), 1: (0, self.x + 1)}.get(
+                    numbers[0], (0, self.width))
+            start, end = max(start, 0), min(end, self.width)
+            self.chars[self.y][start:end] = [self.fillchar] * (end - start)
+            self.cell_attributes[self.y][start:end] = (
+                [_no_attributes] * (end - start))
+
+    def _select_graphic_rendition(self, numbers):
+        attributes = set(self.attributes)
+        numbers = iter(numbers)
+        for number in numbers:
+            if number == 0:
+                attributes.clear()
+            elif number in _sgr_attributes:
+                attributes.add(_sgr_attributes[number])
+            elif number in _sgr_resets:
+                attributes -= _sgr_resets[number]
+            elif number in (38, 48):
+                layer = 'fg' if number == 38 else 'bg'
+                mode = next(numbers, None)
+                if mode == 5:
+                    colour = str(next(numbers, 0))
+                elif mode == 2:
+                    colour = '#{:02x}{:02x}{:02x}'.format(
+                        *(next(numbers, 0) for _ in range(3)))
+                else:
+                    continue
+                self._set_colour(attributes, layer, colour)
+            elif number in (39, 49):
+                self._set_colour(attributes, 'fg' if number == 39 else 'bg')
+            elif 30 <= number <= 37 or 90 <= number <= 97:
+                colour = number - 30 if number < 90 else number - 82
+                self._set_colour(attributes, 'fg', str(colour))
+            elif 40 <= number <= 47 or 100 <= number <= 107:
+                colour = number - 40 if number < 100 else number - 92
+                self._set_colour(attributes, 'bg', str(colour))
+        self.attributes = frozenset(attributes)
+
+    @staticmethod
+    def _set_colour(attributes, layer, colour=None):
+        for attribute in list(attributes):
+            if attribute.startswith(layer + ' '):
+                attributes.discard(attribute)
+        if colour is not None:
+            attributes.add('{} {}'.format(layer, colour))
+
+    def lines(self):
+        '''Returns the text on the screen as a list of strings, one per row.
+        '''
+        return [''.join(row) for row in self.chars]
+
+    def __str__(self):
+        return '\n'.join(self.lines())
+
+    def cell(self, x, y):
+        '''Returns a tuple of the character and the attributes of a cell.
+        '''
+        return self.chars[y][x], self.cell_attributes[y][x]
+
+
+class HeadlessTerminal(Terminal):
+    '''A :class:`Terminal` that draws to an in-memory :class:`Screen`
+    (available as :attr:`screen`) rather than to a real terminal, for
+    benchmarking and for testing what your application draws::
+
+        terminal = HeadlessTerminal(width=40, height=10)
+        root = Root(element, terminal=terminal)
+        root.draw()
+        assert terminal.screen.lines()[0].startswith('Hello')
+
+    :parameter width: The width of the screen.
+    :parameter height: The height of the screen.
+    :parameter kind: The terminal type whose escape sequences to use.
+    :parameter screen: The :class:`Screen` to draw to. (Optional, we will
+        create one of the given size.)
+
+    Everything is written exactly as it would be to a real terminal, and the
+    screen interprets it, so the whole of :mod:`jcn`'s rendering is
+    exercised.
+    '''
+    def __init__(
+            self, width=80, height=24, kind='xterm-256color', screen=None,
+            **kwargs):
+        self.screen = screen if screen is not None else Screen(width, height)
+        kwargs.setdefault('infile', StringIO())
+        super().__init__(
+            kind=kind, stream=self.screen, force_styling=True,
+            handle_signals=False, **kwargs)
+
+    @property
+    def width(self):
+        return self.screen.width
+
+    @property
+    def height(self):
+        return self.screen.height
+
+    def resize(self, width, height):
+        self.screen.resize(width, height)
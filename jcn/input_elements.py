@@ -13,38 +13,168 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
-from .util import clamp
+from collections import deque, namedtuple
+from functools import partial, reduce
+from itertools import islice
+
+from .util import clamp, GapBuffer, PieceTable
 from .display_elements import ABCDisplayElement, Text
-from .terminal import get_terminal
+from .formatting import FormatPlaceholderFactory
+from .keymap import Keymap
+from .terminal import get_terminal, Paste
+from .textwrap import TextWrapper
+
+
+_format = FormatPlaceholderFactory()
+
+
+# A single change to some text: at ``position``, ``removed`` was replaced by
+# ``inserted`` (either of which may be empty):
+Edit = namedtuple('Edit', ['position', 'removed', 'inserted'])
+
+
+class EditHistory:
+    '''A log of the edits made to some text, so that they can be undone and
+    redone.
+
+    :parameter max_size: The most characters of edits to remember. The
+        oldest edits are forgotten to stay within it.
+
+    Only the text that each edit changed is kept, and runs of typing (or of
+    deleting) at consecutive positions are merged into a single edit, so that
+    they're undone together, until :meth:`seal` is called (e.g. because the
+    cursor was moved).
+    '''
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self._undo = deque()
+        self._redo = []
+        self._size = 0
+        self._sealed = True
+
+    def __len__(self):
+        return len(self._undo)
+
+    @staticmethod
+    def _edit_size(edit):
+        return len(edit.removed) + len(edit.inserted)
+
+    def _merge(self, last, edit):
+        if last.removed or edit.removed:
+            if last.inserted or edit.inserted:
+                return None
+            if edit.position == last.position:
+                # Deleting forwards:
+                return Edit(last.position, last.removed + edit.removed, '')
+            if edit.position + len(edit.removed) == last.position:
+                # Backspacing:
+                return Edit(edit.position, edit.removed + last.removed, '')
+            return None
+        if edit.position == last.position + len(last.inserted):
+            return Edit(last.position, '', last.inserted + edit.inserted)
+        return None
+
+    def record(self, position, removed, inserted):
+        '''Records that ``removed`` was replaced by ``inserted`` at the given
+        position. This forgets anything that had been undone.
+        '''
+        edit = Edit(position, removed, inserted)
+        for undone in self._redo:
+            self._size -= self._edit_size(undone)
+        self._redo.clear()
+        merged = None
+        if self._undo and not self._sealed:
+            merged = self._merge(self._undo[-1], edit)
+        if merged is not None:
+            self._size -= self._edit_size(self._undo.pop())
+            edit = merged
+        self._undo.append(edit)
+        self._size += self._edit_size(edit)
+        self._sealed = False
+        while self._undo and self._size > self.max_size:
+            self._size -= self._edit_size(self._undo.popleft())
+
+    def seal(self):
+        '''Stops the next edit being merged with the previous one.
+        '''
+        self._sealed = True
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._size = 0
+        self._sealed = True
+
+    def undo(self):
+        '''Returns the :class:`Edit` that reverses the most recent edit, or
+        ``None`` if there's nothing to undo.
+        '''
+        if not self._undo:
+            return None
+        edit = self._undo.pop()
+        self._redo.append(edit)
+        self._sealed = True
+        return Edit(edit.position, edit.inserted, edit.removed)
+
+    def redo(self):
+        '''Returns the :class:`Edit` that reapplies the most recently undone
+        edit, or ``None`` if there's nothing to redo.
+        '''
+        if not self._redo:
+            return None
+        edit = self._redo.pop()
+        self._undo.append(edit)
+        self._sealed = True
+        return edit
 
 
 class LineBuffer:
+    '''Holds a single line of text being edited, along with the position of
+    the cursor within it. The text is kept in a :class:`jcn.util.GapBuffer`,
+    so typing and deleting at the cursor doesn't copy the whole line each
+    time; :attr:`content` is only joined back into a string when asked for.
+    For the same reason, :attr:`content_updated_callback` is called with the
+    line buffer itself after each change, rather than with its content.
+
+    :parameter history_size: The most characters of edits that :meth:`undo`
+        can remember. (Optional.)
+    '''
     # Yes, the irony of re-implementing a bunch of stuff we've gone out of way
     # to turn off in the terminal is not lost on me ;-)
-    def __init__(self):
+    def __init__(self, history_size=65536):
+        self._buffer = GapBuffer()
         self._content = ''
         self.cursor_position = 0
+        self.history = EditHistory(history_size)
         self.content_updated_callback = None
         self.line_received_callback = None
 
     def __bool__(self):
-        return bool(self.content)
+        return len(self._buffer) > 0
 
     def __len__(self):
-        return len(self.content)
+        return len(self._buffer)
 
     def __str__(self):
         return self.content
 
     @property
     def content(self):
+        if self._content is None:
+            self._content = str(self._buffer)
         return self._content
 
     @content.setter
     def content(self, value):
+        self._buffer = GapBuffer(value)
         self._content = value
+        self.cursor_position = min(self.cursor_position, len(value))
+        self.history.clear()
+        self._content_changed()
+
+    def _content_changed(self):
         if self.content_updated_callback:
-            self.content_updated_callback(self._content)
+            self.content_updated_callback(self)
 
     def draw(self):
         # FIXME: Might want to reconsider how we do formatting so that the
@@ -62,51 +192,110 @@ class LineBuffer:
         self.content = ''
         self.cursor_position = 0
 
+    # The keys that edit the line, and the names of the methods they call.
+    # Elements holding a line buffer bind these in their default keymap (see
+    # _editing_keymap), so that they go through the key dispatcher and can be
+    # rebound:
+    _editing_keys = {
+        'space': '_insert_space',
+        'backspace': '_backspace_char',
+        'delete': '_delete_at_cursor',
+        'left': '_cursor_left',
+        'right': '_cursor_right',
+        'home': '_cursor_home',
+        'end': '_cursor_end',
+        'return': '_line_received',
+    }
+
     def handle_input(self, data):
-        if len(data) == 1:
+        if isinstance(data, Paste):
+            # We only hold one line:
+            self.history.seal()
+            self.insert(data.text.replace('\n', ' '))
+            self.history.seal()
+        elif len(data) == 1:
             self._insert_char(data)
-        elif data == 'space':
-            self._insert_char(' ')
-        elif data == 'backspace':
-            self._backspace_char()
-        elif data == 'delete':
-            self._delete_char(self.cursor_position)
-        elif data == 'left':
-            self._move_cursor(-1)
-        elif data == 'right':
-            self._move_cursor(1)
-        elif data == 'home':
-            self.cursor_position = 0
-        elif data == 'end':
-            self.cursor_position = len(self.content)
-        elif data == 'return':
-            self._line_received()
+        elif data in self._editing_keys:
+            getattr(self, self._editing_keys[data])()
         else:
             return data
 
+    def insert(self, text):
+        '''Inserts the given text at the cursor, as a single change to our
+        content, and moves the cursor to the end of it.
+        '''
+        self._buffer.insert(self.cursor_position, text)
+        self._content = None
+        self.history.record(self.cursor_position, '', text)
+        self.cursor_position += len(text)
+        self._content_changed()
+
     def _insert_char(self, char):
-        pos = self.cursor_position
-        if pos == len(self.content):
-            self.content += char
-        else:
-            self.content = self.content[:pos] + char + self.content[pos:]
-        self.cursor_position += 1
+        self.insert(char)
+
+    def _insert_space(self):
+        self._insert_char(' ')
 
     def _backspace_char(self):
         if self.cursor_position == 0:
             return
-        if self.cursor_position == len(self.content):
-            self.content = self.content[:-1]
-        else:
-            self._delete_char(self.cursor_position - 1)
         self.cursor_position -= 1
+        self._delete_char(self.cursor_position)
 
     def _delete_char(self, pos):
-        self.content = self.content[:pos] + self.content[pos + 1:]
+        if pos >= len(self._buffer):
+            return
+        self.history.record(pos, self._buffer[pos], '')
+        self._buffer.delete(pos)
+        self._content = None
+        self._content_changed()
+
+    def _delete_at_cursor(self):
+        self._delete_char(self.cursor_position)
 
     def _move_cursor(self, delta):
         self.cursor_position = clamp(
             self.cursor_position + delta, min_=0, max_=len(self))
+        self.history.seal()
+
+    def _cursor_left(self):
+        self._move_cursor(-1)
+
+    def _cursor_right(self):
+        self._move_cursor(1)
+
+    def _cursor_home(self):
+        self._move_cursor(-self.cursor_position)
+
+    def _cursor_end(self):
+        self._move_cursor(len(self) - self.cursor_position)
+
+    def _apply(self, edit):
+        self._buffer.delete(edit.position, len(edit.removed))
+        self._buffer.insert(edit.position, edit.inserted)
+        self._content = None
+        self.cursor_position = edit.position + len(edit.inserted)
+        self._content_changed()
+
+    def undo(self):
+        '''Undoes the most recent edit (or run of typing). Returns ``False``
+        if there was nothing to undo.
+        '''
+        edit = self.history.undo()
+        if edit is None:
+            return False
+        self._apply(edit)
+        return True
+
+    def redo(self):
+        '''Redoes the most recently undone edit. Returns ``False`` if there
+        was nothing to redo.
+        '''
+        edit = self.history.redo()
+        if edit is None:
+            return False
+        self._apply(edit)
+        return True
 
     def _line_received(self):
         if self.line_received_callback:
@@ -114,12 +303,25 @@ class LineBuffer:
         self.clear()
 
 
+def _editing_keymap(edit):
+    # Binds each of a line buffer's editing keys to ``edit``, which is called
+    # with the name of the LineBuffer method to call:
+    return Keymap({
+        key: partial(edit, name)
+        for key, name in LineBuffer._editing_keys.items()})
+
+
+def _is_text(data):
+    return isinstance(data, Paste) or len(data) == 1
+
+
 class Input(Text):
     # I'm not sure I'm liking the constraints that the interrelationship of
     # Text and Input imposes...
     def __init__(self, placeholder_text, *args, **kwargs):
         super().__init__(content=LineBuffer(), *args, **kwargs)
         self.placeholder_text = placeholder_text
+        self.keymap = _editing_keymap(self._edit)
 
     @property
     def content(self):
@@ -132,19 +334,28 @@ class Input(Text):
     def content(self, value):
         self._content.content = value
 
+    def _edit(self, name):
+        getattr(self._content, name)()
+        # FIXME: this is a temporary hack to try proof of concept
+        self.root.draw()
+
     def handle_input(self, data):
+        # The editing keys are bound in our keymap, leaving just text to us:
+        if not _is_text(data):
+            return data
         self._content.handle_input(data)
         # FIXME: this is a temporary hack to try proof of concept
         self.root.draw()
 
 
 class LineInput(ABCDisplayElement):
-    min_height = max_height = 1
+    _min_height = _max_height = 1
 
     def __init__(self, placeholder_text, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.placeholder_text = placeholder_text
         self.line_buffer = LineBuffer()
+        self.keymap = _editing_keymap(self._edit)
 
     @property
     def content_updated_callback(self):
@@ -162,15 +373,377 @@ class LineInput(ABCDisplayElement):
     def line_received_callback(self, callback):
         self.line_buffer.line_received_callback = callback
 
+    def _edit(self, name):
+        getattr(self.line_buffer, name)()
+        self._line_buffer_edited()
+
     def handle_input(self, data):
-        result = self.line_buffer.handle_input(data)
+        # The editing keys are bound in our keymap (so that they can be
+        # rebound), leaving just text to us:
+        if not _is_text(data):
+            return data
+        self.line_buffer.handle_input(data)
+        self._line_buffer_edited()
+
+    def _line_buffer_edited(self):
         self.updated = True
         # FIXME: this is a temporary hack to try proof of concept
         self.root.update()
-        return result
 
     def _get_lines(self, width, height):
         if self.line_buffer:
             return [self.line_buffer.draw()]
         else:
             return [self.placeholder_text]
+
+
+class TextEditor(ABCDisplayElement):
+    '''A multi-line text editing area.
+
+    :parameter content: The initial text to edit. (Optional, defaults to an
+        empty string.)
+
+    The text is held in a :class:`jcn.util.PieceTable`, and only the text
+    that is visible is ever looked at when drawing, so the editor copes
+    with documents of many megabytes, even if they're all on one line. Long
+    lines are soft wrapped to the width of the editor unless :attr:`wrap` is
+    set to ``False``.
+
+    As well as typing, the arrow keys, :kbd:`Home`, :kbd:`End`,
+    :kbd:`Page Up` and :kbd:`Page Down` move the cursor, and holding
+    :kbd:`Shift` with any of them selects text. If set,
+    :attr:`content_updated_callback` is called with the editor itself after
+    each change, rather than with the (possibly huge) content.
+    '''
+    cursor_format = _format.reverse
+    selection_format = _format.reverse
+
+    def __init__(self, content='', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = PieceTable(content)
+        self.cursor_position = 0
+        self.selection_anchor = None
+        # The first line shown, which we scroll to keep the cursor in view,
+        # and the offset into it of the first row shown (for lines taller
+        # than the editor):
+        self._top_line = 0
+        self._top_column = 0
+        self.wrap = True
+        self.content_updated_callback = None
+        # The column that up and down try to keep the cursor in:
+        self._goal_column = None
+        self._page_height = 1
+
+    @property
+    def content(self):
+        return str(self.buffer)
+
+    @content.setter
+    def content(self, value):
+        self.buffer = PieceTable(value)
+        self.cursor_position = min(self.cursor_position, len(value))
+        self.selection_anchor = None
+        self.top_line = 0
+        self._content_changed()
+
+    @property
+    def top_line(self):
+        '''The first line shown, which we scroll to keep the cursor in
+        view.
+        '''
+        return self._top_line
+
+    @top_line.setter
+    def top_line(self, line):
+        self._top_line = line
+        self._top_column = 0
+
+    def _content_changed(self):
+        self.updated = True
+        if self.content_updated_callback:
+            self.content_updated_callback(self)
+
+    @property
+    def selection(self):
+        '''The ``(start, end)`` offsets of the selected text, or ``None`` if
+        nothing is selected.
+        '''
+        if self.selection_anchor is None or (
+                self.selection_anchor == self.cursor_position):
+            return None
+        return (
+            min(self.selection_anchor, self.cursor_position),
+            max(self.selection_anchor, self.cursor_position))
+
+    @property
+    def selected_text(self):
+        selection = self.selection
+        if selection is None:
+            return ''
+        return self.buffer.text(*selection)
+
+    def select(self, start, end):
+        '''Selects the text between the given offsets, leaving the cursor at
+        the end of the selection.
+        '''
+        self.selection_anchor = clamp(start, min_=0, max_=len(self.buffer))
+        self.cursor_position = clamp(end, min_=0, max_=len(self.buffer))
+        self.updated = True
+
+    def insert(self, text):
+        '''Inserts the given text at the cursor, replacing the selection if
+        there is one, and moves the cursor to the end of it.
+        '''
+        self._delete_selection()
+        self.buffer.insert(self.cursor_position, text)
+        self.cursor_position += len(text)
+        self._goal_column = None
+        self._content_changed()
+
+    def _delete_selection(self):
+        selection = self.selection
+        self.selection_anchor = None
+        if selection is None:
+            return False
+        self.buffer.delete(*selection)
+        self.cursor_position = selection[0]
+        self._content_changed()
+        return True
+
+    def _backspace_char(self):
+        if self._delete_selection() or self.cursor_position == 0:
+            return
+        self.cursor_position -= 1
+        self.buffer.delete(self.cursor_position, self.cursor_position + 1)
+        self._content_changed()
+
+    def _delete_char(self):
+        if self._delete_selection():
+            return
+        if self.cursor_position < len(self.buffer):
+            self.buffer.delete(self.cursor_position, self.cursor_position + 1)
+            self._content_changed()
+
+    def _move_cursor(self, key):
+        buffer = self.buffer
+        position = self.cursor_position
+        line = buffer.line_of(position)
+        if key in ('up', 'down', 'pageup', 'pagedown'):
+            if self._goal_column is None:
+                self._goal_column = position - buffer.line_start(line)
+            distance = 1 if key in ('up', 'down') else self._page_height
+            if key in ('up', 'pageup'):
+                distance = -distance
+            line = clamp(line + distance, min_=0, max_=buffer.line_count - 1)
+            self.cursor_position = min(
+                buffer.line_start(line) + self._goal_column,
+                buffer.line_end(line))
+            return
+        self._goal_column = None
+        if key == 'left':
+            self.cursor_position = max(position - 1, 0)
+        elif key == 'right':
+            self.cursor_position = min(position + 1, len(buffer))
+        elif key == 'home':
+            self.cursor_position = buffer.line_start(line)
+        elif key == 'end':
+            self.cursor_position = buffer.line_end(line)
+
+    _motions = ('left', 'right', 'up', 'down', 'home', 'end', 'pageup',
+                'pagedown')
+
+    def handle_input(self, data):
+        if isinstance(data, Paste):
+            self.insert(data.text)
+        elif data in self._motions:
+            self.selection_anchor = None
+            self._move_cursor(data)
+        elif data.startswith('shift ') and data[6:] in self._motions:
+            if self.selection_anchor is None:
+                self.selection_anchor = self.cursor_position
+            self._move_cursor(data[6:])
+        elif len(data) == 1:
+            self.insert(data)
+        elif data == 'space':
+            self.insert(' ')
+        elif data == 'return':
+            self.insert('\n')
+        elif data == 'backspace':
+            self._backspace_char()
+        elif data == 'delete':
+            self._delete_char()
+        else:
+            return data
+        self.updated = True
+        if self.root:
+            self.root.update()
+
+    def _row(self, start, line_end, width):
+        '''Returns the text of the soft wrapped row that starts at the given
+        offset, in a line that ends at ``line_end``, and the offset at which
+        the next row starts (which is just past ``line_end`` if this row ends
+        the line). Rows are broken where :class:`jcn.textwrap.TextWrapper`
+        would break them, but only a couple of rows' worth of text is looked
+        at.
+        '''
+        buffer = self.buffer
+        if width <= 0:
+            return '', line_end + 1
+        if not self.wrap or line_end - start <= width:
+            return buffer.text(start, min(line_end, start + width)), (
+                line_end + 1)
+        # A chunk that starts within the row and runs on past the end of this
+        # window is longer than a row, so the window is enough to find the
+        # same break as wrapping the whole line would:
+        window = buffer.text(start, min(line_end, start + 2 * width + 1))
+        # Indentation at the start of a line is kept (elsewhere, rows start
+        # after the whitespace at the break):
+        wrapper = TextWrapper(width, keep_indent=True)
+        end = len(wrapper.wrap(window)[0])
+        text = window[:end]
+        # Whitespace at the break is dropped:
+        next_start = start + end
+        chunk_size = max(width, 256)
+        while next_start < line_end:
+            chunk = buffer.text(
+                next_start, min(next_start + chunk_size, line_end))
+            stripped = chunk.lstrip()
+            next_start += len(chunk) - len(stripped)
+            if stripped:
+                return text, next_start
+        return text, line_end + 1
+
+    def _iter_rows(self, start, width):
+        '''Yields each soft wrapped row from the given offset onwards, as
+        the offset it starts at, its text, the offset at which the next row
+        starts, and whether it starts its line.
+        '''
+        buffer = self.buffer
+        line = buffer.line_of(start)
+        line_start = buffer.line_start(line)
+        while line < buffer.line_count:
+            line_end = buffer.line_end(line)
+            while True:
+                text, next_start = self._row(start, line_end, width)
+                yield start, text, next_start, start == line_start
+                start = next_start
+                if next_start > line_end:
+                    break
+            line += 1
+            line_start = start
+
+    def _wrap_from(self, position, earliest, width, height):
+        '''Returns where to start wrapping from to find the rows up to the
+        one containing ``position``: ``earliest`` if that's within a few
+        screenfuls, or else the start of a nearer row. In a very long line
+        the rows we find from there may be broken differently from those we
+        would find from the start of the line, but we never wrap megabytes of
+        text to draw one screen.
+        '''
+        if not self.wrap:
+            return earliest
+        nearest = position - (width + 1) * (height + 1)
+        return max(earliest, nearest)
+
+    def _row_start(self, position, width, height):
+        '''Returns the offset of the start of the row containing
+        ``position``.
+        '''
+        line_start = self.buffer.line_start(self.buffer.line_of(position))
+        start = self._wrap_from(position, line_start, width, height)
+        for start, text, end, line_starts in self._iter_rows(start, width):
+            if position < end:
+                return start
+
+    def _scroll_to(self, position, top, width, height):
+        '''Returns the offset of the row to show at the top so that the row
+        containing ``position``, which is below ``top``, is the last one
+        shown, preferring to scroll by whole lines.
+        '''
+        start = self._wrap_from(position, top, width, height)
+        starts = deque(maxlen=max(height, 1))
+        for row in self._iter_rows(start, width):
+            starts.append(row)
+            if position < row[2]:
+                break
+        for start, text, end, line_starts in starts:
+            if line_starts:
+                return start
+        return starts[0][0]
+
+    def _set_top(self, offset):
+        self._top_line = self.buffer.line_of(offset)
+        self._top_column = offset - self.buffer.line_start(self._top_line)
+
+    def _top_offset(self):
+        buffer = self.buffer
+        line = min(self._top_line, buffer.line_count - 1)
+        return min(
+            buffer.line_start(line) + self._top_column, buffer.line_end(line))
+
+    def _cursor_column(self, start, end, width):
+        '''Returns the column of the cursor in the row between the given
+        offsets, or ``None`` if it isn't in that row.
+        '''
+        if not start <= self.cursor_position < end:
+            return None
+        # Like a terminal, we keep the cursor in the last column rather than
+        # letting it go past the edge (e.g. onto whitespace dropped where a
+        # row is broken):
+        return min(self.cursor_position - start, max(width - 1, 0))
+
+    def _format_segment(self, text, offset, cursor=None):
+        '''Applies the cursor and selection formats to a piece of a line
+        that starts at the given offset into the buffer, with the cursor in
+        the given column, if any.
+        '''
+        show_cursor = cursor is not None
+        if show_cursor and cursor > len(text):
+            # The cursor is on whitespace dropped where the row was broken:
+            text += ' ' * (cursor - len(text))
+        selection = self.selection
+        breaks = {0, len(text)}
+        if selection is not None:
+            breaks.update(
+                clamp(position - offset, min_=0, max_=len(text))
+                for position in selection)
+        if show_cursor and cursor < len(text):
+            breaks.update((cursor, cursor + 1))
+        breaks = sorted(breaks)
+        parts = []
+        for start, stop in zip(breaks, breaks[1:]):
+            part = text[start:stop]
+            if show_cursor and start == cursor:
+                part = self.cursor_format(part)
+            elif selection is not None and (
+                    selection[0] <= offset + start < selection[1]):
+                part = self.selection_format(part)
+            parts.append(part)
+        if show_cursor and cursor == len(text):
+            parts.append(self.cursor_format(' '))
+        parts = [part for part in parts if part] or ['']
+        return reduce(lambda x, y: x + y, parts[1:], parts[0])
+
+    def _get_lines(self, width, height):
+        self._page_height = max(height, 1)
+        cursor = self.cursor_position
+        cursor_line = self.buffer.line_of(cursor)
+        # Every line takes at least one row, so the cursor's line is at most
+        # a screenful further down:
+        top_line = clamp(
+            self._top_line, min_=cursor_line - height + 1, max_=cursor_line)
+        if top_line != self._top_line:
+            self.top_line = top_line
+        top = self._top_offset()
+        if cursor < top:
+            top = self._row_start(cursor, width, height)
+        rows = list(islice(self._iter_rows(top, width), height))
+        if rows and cursor >= rows[-1][2]:
+            # Soft wrapping has pushed the cursor out of view:
+            top = self._scroll_to(cursor, top, width, height)
+            rows = list(islice(self._iter_rows(top, width), height))
+        self._set_top(top)
+        return [
+            self._format_segment(
+                text, start, self._cursor_column(start, end, width)) for
+            start, text, end, line_starts in rows]
@@ -0,0 +1,184 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+from weakref import WeakSet
+
+
+def _normalize(keys):
+    if isinstance(keys, str):
+        return (keys,)
+    keys = tuple(keys)
+    if not keys:
+        raise ValueError('A binding needs at least one key')
+    return keys
+
+
+class Keymap:
+    '''A table of key bindings for a UI element.
+
+    :parameter bindings: An optional mapping of keys to handlers to start
+        with. See :meth:`bind`.
+
+    Each binding maps either a single key name (e.g. ``'ctrl s'``) or a
+    sequence of key names that must be pressed one after the other (a chord,
+    e.g. ``('ctrl x', 'ctrl s')``) to a handler, which is called with no
+    arguments when the key (or the whole chord) is pressed. A handler may
+    return ``False`` to decline the key, which is then handled as if it
+    weren't bound.
+    '''
+    def __init__(self, bindings=None):
+        self._bindings = {}
+        # The elements this keymap is assigned to, which need to know when
+        # its bindings change:
+        self._owners = WeakSet()
+        for keys, handler in (bindings or {}).items():
+            self.bind(keys, handler)
+
+    def __len__(self):
+        return len(self._bindings)
+
+    def __contains__(self, keys):
+        return _normalize(keys) in self._bindings
+
+    def __getitem__(self, keys):
+        return self._bindings[_normalize(keys)]
+
+    def bind(self, keys, handler):
+        self._bindings[_normalize(keys)] = handler
+        self._changed()
+
+    def unbind(self, keys):
+        del self._bindings[_normalize(keys)]
+        self._changed()
+
+    def _changed(self):
+        for owner in self._owners:
+            owner._key_bindings_changed()
+
+    def compile_into(self, trie):
+        '''Adds our bindings to a trie of nested dicts, in which each key
+        leads either to a handler or to a dict of the keys that may follow it
+        in a chord. Our bindings replace any that clash with them.
+        '''
+        for keys, handler in self._bindings.items():
+            node = trie
+            for key in keys[:-1]:
+                next_node = node.get(key)
+                if not isinstance(next_node, dict):
+                    next_node = node[key] = {}
+                node = next_node
+            node[keys[-1]] = handler
+        return trie
+
+    def compile(self):
+        return self.compile_into({})
+
+
+class KeyDispatcher:
+    '''Finds and calls the handler bound to each key pressed, looking first
+    at the bindings of the focused element, then at those of each of its
+    ancestors in turn.
+
+    The bindings of the whole chain of elements are merged into one trie
+    the first time a key is pressed with a given element focused, and that
+    trie is kept until something changes (see :meth:`invalidate`), so that
+    dispatching a key is just a dict lookup.
+    '''
+    def __init__(self):
+        self._stale = True
+        self._focused = None
+        # The elements from the root down to the focused one:
+        self._chain = frozenset()
+        self._tries = {}
+        # Where we've got to in a chord, if the user is part way through one:
+        self._node = None
+
+    @property
+    def pending(self):
+        '''``True`` if the keys pressed so far are the start of a chord.
+        '''
+        return self._node is not None
+
+    def invalidate(self, element=None):
+        '''Lets us know that the bindings we have resolved may no longer be
+        correct, because the bindings, children or focus of ``element`` have
+        changed (or, if ``element`` isn't given, because anything might have).
+        '''
+        if element is None or element in self._chain:
+            self._stale = True
+        elif len(self._tries) > 1:
+            # Only the focused element's trie is certain to be unaffected by
+            # changes away from the focus:
+            trie = self._tries.get(self._focused)
+            self._tries.clear()
+            if trie is not None:
+                self._tries[self._focused] = trie
+
+    def _refresh(self, element):
+        if not self._stale:
+            return
+        self._stale = False
+        self._tries.clear()
+        self._node = None
+        chain = [element]
+        while getattr(element, 'active_element', None) is not None:
+            element = element.active_element
+            chain.append(element)
+        self._focused = element
+        self._chain = frozenset(chain)
+
+    def resolve(self, element):
+        '''Returns the trie of all the bindings that apply when the given
+        element is focused.
+        '''
+        trie = self._tries.get(element)
+        if trie is None:
+            chain = []
+            while element is not None:
+                chain.append(element)
+                element = element.parent
+            trie = {}
+            # Nearer elements override their ancestors:
+            for ancestor in reversed(chain):
+                if ancestor.keymap is not None:
+                    ancestor.keymap.compile_into(trie)
+            self._tries[chain[0]] = trie
+        return trie
+
+    def dispatch(self, element, key):
+        '''Dispatches a key to the bindings that apply to the element focused
+        within the given (root) element. Returns ``True`` if the key was
+        handled, or is part of a chord that has been started.
+        '''
+        self._refresh(element)
+        if self._focused is None:
+            return False
+        node = self._node
+        if node is None:
+            node = self.resolve(self._focused)
+        target = node.get(key)
+        if target is None:
+            if self._node is not None:
+                # This key doesn't continue the chord, so abandon it and look
+                # the key up afresh:
+                self._node = None
+                return self.dispatch(element, key)
+            return False
+        if isinstance(target, dict):
+            self._node = target
+        else:
+            self._node = None
+            return target() is not False
+        return True
@@ -0,0 +1,342 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import codecs
+import re
+from collections import deque
+from itertools import islice
+
+from .display_elements import ABCDisplayElement, _Animated
+from .formatting import (
+    FormatPlaceholder, ParameterizingFormatPlaceholder, PlaceholderGroup,
+    StringComponent, StringWithFormatting, null_placeholder)
+from .headless import _sgr_attributes, _sgr_resets
+
+
+# Any CSI escape sequence, of which we only keep SGR ('m') ones:
+_escape_sequence = re.compile(r'\x1b\[([0-?]*)[ -/]*([@-~])|\x1b.?')
+_sgr_sequence = re.compile(r'\x1b\[([0-?]*)m')
+# Caches of the formatting states we've seen, and of the escape sequences
+# that take us from one to another:
+_states = {}
+_transitions = {}
+_max_transitions = 1024
+_colour_names = (
+    'black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan', 'white')
+
+
+def _colour_placeholder(layer, colour):
+    prefix = '' if layer == 'fg' else 'on_'
+    if isinstance(colour, str):
+        return FormatPlaceholder(prefix + colour)
+    return ParameterizingFormatPlaceholder(prefix + 'color')(colour)
+
+
+def _nearest_256_colour(red, green, blue):
+    # The 6x6x6 colour cube of a 256 colour terminal starts at 16:
+    return 16 + sum(
+        round(value / 255 * 5) * scale for value, scale in
+        zip((red, green, blue), (36, 6, 1)))
+
+
+class SGRParser:
+    '''Turns lines of text containing ANSI "select graphic rendition" escape
+    sequences (as written by programs that colour their output) into
+    :class:`jcn.formatting.StringWithFormatting` objects with the equivalent
+    formatting. Any other escape sequences are dropped.
+
+    :parameter state: The :attr:`state` to start in, from another parser.
+
+    Formatting carries on from one line to the next, as it would on a
+    terminal. Lines with no formatting are returned as plain :class:`str`
+    objects.
+    '''
+    def __init__(self, state=None):
+        # Maps 'fg', 'bg' or an attribute name to its placeholder. We replace
+        # rather than modify this, so that it can be shared as a snapshot:
+        self.state = state or {}
+        self._placeholder = None
+
+    @property
+    def placeholder(self):
+        if self._placeholder is None:
+            if len(self.state) > 1:
+                self._placeholder = PlaceholderGroup(self.state.values())
+            elif self.state:
+                self._placeholder, = self.state.values()
+            else:
+                self._placeholder = null_placeholder
+        return self._placeholder
+
+    def _select_graphic_rendition(self, parameters):
+        # Programs tend to use the same few escape sequences over and over,
+        # so we remember which state each one takes us to from each state:
+        key = id(self.state), parameters
+        transition = _transitions.get(key)
+        if transition is not None and transition[0] is self.state:
+            self.state = transition[1]
+            self._placeholder = None
+            return
+        previous = self.state
+        if len(_transitions) >= _max_transitions:
+            _transitions.clear()
+            _states.clear()
+        self._apply_parameters(parameters)
+        # We keep hold of the previous state, so that its id isn't reused:
+        _transitions[key] = previous, self.state
+
+    def _apply_parameters(self, parameters):
+        numbers = iter(
+            int(number) if number.isdigit() else 0 for number in
+            parameters.split(';'))
+        state = dict(self.state)
+        for number in numbers:
+            if number == 0:
+                state.clear()
+            elif number in _sgr_attributes:
+                name = _sgr_attributes[number]
+                state[name] = FormatPlaceholder(name)
+            elif number in _sgr_resets:
+                for name in _sgr_resets[number]:
+                    state.pop(name, None)
+            elif number in (38, 48):
+                layer = 'fg' if number == 38 else 'bg'
+                mode = next(numbers, None)
+                if mode == 5:
+                    colour = next(numbers, 0)
+                elif mode == 2:
+                    colour = _nearest_256_colour(
+                        *(next(numbers, 0) for _ in range(3)))
+                else:
+                    continue
+                state[layer] = _colour_placeholder(layer, colour)
+            elif number in (39, 49):
+                state.pop('fg' if number == 39 else 'bg', None)
+            elif 30 <= number <= 37 or 90 <= number <= 97:
+                state['fg'] = _colour_placeholder('fg', self._colour(number))
+            elif 40 <= number <= 47 or 100 <= number <= 107:
+                state['bg'] = _colour_placeholder(
+                    'bg', self._colour(number - 10))
+        # Equal states are shared, so that we can recognise them by identity:
+        key = tuple(
+            (name, placeholder.attr_name, getattr(placeholder, 'args', None))
+            for name, placeholder in sorted(state.items()))
+        state = _states.setdefault(key, state)
+        if state is not self.state:
+            self.state = state
+            self._placeholder = None
+
+    @staticmethod
+    def _colour(number):
+        if number < 90:
+            return _colour_names[number - 30]
+        return 'bright_' + _colour_names[number - 90]
+
+    def track(self, line):
+        '''Updates our :attr:`state` with the formatting in ``line``, without
+        building the formatted line itself.
+        '''
+        # Most coloured output resets its formatting at the end of each line,
+        # in which case there's nothing before the reset to look at:
+        reset = max(line.rfind('\x1b[0m'), line.rfind('\x1b[m'))
+        if reset >= 0:
+            if self.state:
+                self.state = {}
+                self._placeholder = None
+            line = line[reset:]
+        for parameters in _sgr_sequence.findall(line):
+            self._select_graphic_rendition(parameters)
+
+    def parse(self, line):
+        '''Returns ``line`` with its escape sequences replaced by formatting.
+        '''
+        if '\x1b' not in line:
+            if not self.state:
+                return line
+            return StringWithFormatting(
+                (StringComponent(self.placeholder, line),))
+        components = []
+        text = []
+        placeholder = self.placeholder
+        position = 0
+        for match in _escape_sequence.finditer(line):
+            text.append(line[position:match.start()])
+            position = match.end()
+            if match.group(2) != 'm':
+                continue
+            self._select_graphic_rendition(match.group(1))
+            if self.placeholder != placeholder:
+                components.append(StringComponent(placeholder, ''.join(text)))
+                text = []
+                placeholder = self.placeholder
+        text.append(line[position:])
+        components.append(StringComponent(placeholder, ''.join(text)))
+        components = [component for component in components if component]
+        if all(c.placeholder is null_placeholder for c in components):
+            return ''.join(components)
+        return StringWithFormatting(components)
+
+
+class _OutputStream:
+    '''The state of reading one of a process's output pipes: the incomplete
+    line we've read so far, and the formatting that's in effect.
+    '''
+    def __init__(self, encoding):
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.parser = SGRParser()
+        self.partial = ''
+
+
+class ProcessOutput(_Animated, ABCDisplayElement):
+    '''Shows the most recent lines of output from a subprocess, with any
+    colours and other formatting the process writes.
+
+    :parameter max_lines: The number of lines of output to keep; older ones
+        are forgotten.
+    :parameter encoding: The encoding of the process's output.
+
+    Call :meth:`run` to start a process::
+
+        output = ProcessOutput()
+        await output.run('make', '-j8')
+
+    Both stdout and stderr are read in large chunks as they arrive, without
+    ever blocking the event loop, and however quickly the process writes
+    we redraw at most once per frame of the root's
+    :attr:`Root.frame_clock`. As we arrive, we only split the output into
+    lines and keep track of the formatting in effect at the start of each;
+    lines are only turned into formatted strings when they're on screen.
+    Carriage returns without newlines (e.g. from progress indicators)
+    overwrite the line they're on.
+    '''
+    chunk_size = 65536
+
+    def __init__(self, max_lines=10000, encoding='utf-8', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Pairs of the SGRParser.state at the start of a line, and the line:
+        self._lines = deque(maxlen=max_lines)
+        self.encoding = encoding
+        self.process = None
+        self.returncode = None
+        self._changed = False
+
+    @property
+    def max_lines(self):
+        return self._lines.maxlen
+
+    @property
+    def lines(self):
+        '''The lines of output we have kept, as they would be shown.
+        '''
+        return [self._format_line(*line) for line in self._lines]
+
+    @property
+    def running(self):
+        return self.process is not None and self.returncode is None
+
+    async def run(self, program, *args, **kwargs):
+        '''Runs ``program`` with ``args`` (and any other keyword arguments to
+        :func:`asyncio.create_subprocess_exec`), showing its output as it
+        arrives.
+
+        :returns: The process's return code, once it has exited.
+        '''
+        if self.running:
+            raise RuntimeError(
+                '{!r} is already running a process'.format(self))
+        self._lines.clear()
+        self.returncode = None
+        self.process = await asyncio.create_subprocess_exec(
+            program, *args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, **kwargs)
+        await asyncio.gather(
+            self._read(self.process.stdout), self._read(self.process.stderr))
+        self.returncode = await self.process.wait()
+        self._changed_output()
+        return self.returncode
+
+    def terminate(self):
+        '''Asks the running process, if any, to stop.
+        '''
+        if self.running:
+            self.process.terminate()
+
+    async def _read(self, pipe):
+        stream = _OutputStream(self.encoding)
+        while True:
+            data = await pipe.read(self.chunk_size)
+            if not data:
+                break
+            self._feed(stream, stream.decoder.decode(data))
+        text = stream.decoder.decode(b'', final=True)
+        if text:
+            self._feed(stream, text)
+        if stream.partial:
+            self._add_lines(stream, [stream.partial])
+            stream.partial = ''
+            self._changed_output()
+
+    def _feed(self, stream, text):
+        lines = (stream.partial + text).split('\n')
+        stream.partial = lines.pop()
+        if lines:
+            self._add_lines(stream, lines)
+        self._changed_output()
+
+    def _add_lines(self, stream, lines):
+        parser = stream.parser
+        # Lines that will scroll straight out of our buffer only need their
+        # formatting noting:
+        overflow = len(lines) - self.max_lines
+        if overflow > 0:
+            for line in lines[:overflow]:
+                if '\x1b' in line:
+                    parser.track(line)
+            lines = lines[overflow:]
+        append = self._lines.append
+        for line in lines:
+            append((parser.state, line))
+            if '\x1b' in line:
+                parser.track(line)
+
+    @staticmethod
+    def _format_line(state, line):
+        if '\r' in line:
+            line = line.rstrip('\r').rpartition('\r')[2]
+        if '\t' in line:
+            line = line.expandtabs()
+        return SGRParser(state).parse(line)
+
+    def _changed_output(self):
+        self._changed = True
+        if self.root is None:
+            self.updated = True
+        elif not self._animating:
+            self._set_animating(True)
+
+    def _on_frame(self, frame_time):
+        # We stay subscribed to the frame clock whilst output keeps arriving,
+        # so that we draw it at most once per frame:
+        if self._changed:
+            self._changed = False
+            super()._on_frame(frame_time)
+        else:
+            self._set_animating(False)
+
+    def _get_lines(self, width, height):
+        lines = list(islice(reversed(self._lines), height))
+        lines.reverse()
+        return [self._format_line(*line) for line in lines]
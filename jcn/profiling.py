@@ -0,0 +1,373 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import math
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+# The profiler recording the frame currently being drawn, if any. UI elements
+# check this at each phase of layout and rendering, so that profiling costs
+# next to nothing when it's turned off:
+active_profiler = None
+
+# Likewise, the latency tracer timing the input currently being handled:
+active_tracer = None
+
+
+PhaseStats = namedtuple(
+    'PhaseStats', ['element', 'phase', 'calls', 'total_time', 'self_time'])
+
+
+class ProfileNode:
+    '''One node of the call tree recorded for a frame: the time spent by an
+    element in one phase of layout or rendering, including the time spent in
+    the phases it called (its :attr:`children`).
+    '''
+    __slots__ = 'element', 'phase', 'calls', 'total_time', 'children'
+
+    def __init__(self, element, phase):
+        self.element = element
+        self.phase = phase
+        self.calls = 0
+        self.total_time = 0
+        self.children = {}
+
+    def __repr__(self):
+        return '<{} {!r} {} {} calls {:.3f}ms>'.format(
+            self.__class__.__name__, self.element, self.phase, self.calls,
+            self.total_time * 1000)
+
+    @property
+    def self_time(self):
+        return self.total_time - sum(
+            child.total_time for child in self.children.values())
+
+    def walk(self, depth=0):
+        '''Yields each node of the tree below this one, with its depth, in
+        depth-first order.
+        '''
+        for child in self.children.values():
+            yield child, depth
+            yield from child.walk(depth + 1)
+
+
+class ProfileFrame:
+    '''The timings recorded while drawing or updating a single frame.
+    '''
+    def __init__(self, kind):
+        self.kind = kind
+        self.duration = 0
+        self.call_tree = ProfileNode(None, kind)
+
+    def __repr__(self):
+        return '<{} {} {:.3f}ms>'.format(
+            self.__class__.__name__, self.kind, self.duration * 1000)
+
+    def stats(self):
+        '''Returns a list of :class:`PhaseStats`, one per element and phase,
+        sorted with the most expensive (by time spent in that phase itself)
+        first.
+        '''
+        totals = {}
+        for node, _ in self.call_tree.walk():
+            key = node.element, node.phase
+            calls, total_time, self_time = totals.get(key, (0, 0, 0))
+            totals[key] = (
+                calls + node.calls, total_time + node.total_time,
+                self_time + node.self_time)
+        stats = [
+            PhaseStats(element, phase, *values) for
+            (element, phase), values in totals.items()]
+        stats.sort(key=lambda stat: stat.self_time, reverse=True)
+        return stats
+
+    def report(self, bar_width=20):
+        '''Returns a flame-graph-like textual report of where the time went
+        in this frame, as a string. Each line shows an element and phase,
+        indented beneath the phase that called it, with a bar showing its
+        share of the whole frame.
+        '''
+        lines = ['{} {:.3f}ms'.format(self.kind, self.duration * 1000)]
+        for node, depth in self.call_tree.walk():
+            fraction = node.total_time / self.duration if self.duration else 0
+            bar = '#' * int(round(fraction * bar_width))
+            lines.append(
+                '{:<{}} {}{} {} ({} calls, {:.3f}ms, self {:.3f}ms)'.format(
+                    bar, bar_width, '  ' * depth, node.element, node.phase,
+                    node.calls, node.total_time * 1000,
+                    node.self_time * 1000))
+        return '\n'.join(lines)
+
+
+class Profiler:
+    '''Records per-element, per-phase timings and call counts for each frame
+    drawn or updated by a :class:`Root`. Turn profiling on by giving your
+    root a profiler::
+
+        root.profiler = Profiler()
+
+    and then inspect :attr:`frames`, e.g. ``print(root.profiler.frames[-1].
+    report())``.
+
+    :parameter max_frames: The number of most recent frames to keep.
+    :parameter clock: A function returning the current time in seconds.
+    '''
+    def __init__(self, max_frames=100, clock=time.perf_counter):
+        self.frames = deque(maxlen=max_frames)
+        self.clock = clock
+        self._stack = []
+        self._start_times = []
+
+    @contextmanager
+    def frame(self, kind):
+        '''Context manager within which all profiled phases are recorded as
+        part of a new frame.
+        '''
+        global active_profiler
+        previous_profiler = active_profiler
+        frame = ProfileFrame(kind)
+        self._stack = [frame.call_tree]
+        active_profiler = self
+        start = self.clock()
+        try:
+            yield frame
+        finally:
+            frame.duration = frame.call_tree.total_time = self.clock() - start
+            frame.call_tree.calls = 1
+            active_profiler = previous_profiler
+            self._stack = []
+            self._start_times = []
+            self.frames.append(frame)
+
+    def enter(self, element, phase, count=True):
+        '''Starts timing the given element in the given phase, nested within
+        whichever phase is currently being timed. Each :meth:`enter` must be
+        paired with an :meth:`exit`.
+        '''
+        parent = self._stack[-1]
+        key = element, phase
+        try:
+            node = parent.children[key]
+        except KeyError:
+            node = parent.children[key] = ProfileNode(element, phase)
+        if count:
+            node.calls += 1
+        self._stack.append(node)
+        self._start_times.append(self.clock())
+
+    def exit(self):
+        '''Stops timing the most recently entered phase.
+        '''
+        node = self._stack.pop()
+        node.total_time += self.clock() - self._start_times.pop()
+
+    def profile_iterator(self, element, phase, iterator):
+        '''Wraps a (lazy) iterator so that the time taken to produce each of
+        its items is recorded against the given element and phase. The phase
+        is counted as called once, however many items are produced.
+        '''
+        count = True
+        iterator = iter(iterator)
+        while True:
+            self.enter(element, phase, count)
+            count = False
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            yield item
+
+
+class LatencyHistogram:
+    '''Counts durations in logarithmically sized buckets, so that
+    percentiles can be estimated (to within the bucket size) using a fixed
+    amount of memory, however many durations are added.
+
+    :parameter resolution: The number of buckets per doubling of duration.
+        The default of 8 gives estimates to within about 9%.
+    :parameter minimum: Durations (in seconds) shorter than this all share
+        the first bucket.
+    '''
+    def __init__(self, resolution=8, minimum=1e-6):
+        self.resolution = resolution
+        self.minimum = minimum
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def _bucket(self, duration):
+        if duration <= self.minimum:
+            return 0
+        return math.ceil(
+            math.log2(duration / self.minimum) * self.resolution)
+
+    def _upper_bound(self, bucket):
+        return self.minimum * 2 ** (bucket / self.resolution)
+
+    def add(self, duration):
+        bucket = self._bucket(duration)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def buckets(self):
+        '''Returns a list of ``(upper_bound, count)`` tuples for each bucket
+        that holds any durations, shortest first.
+        '''
+        return [
+            (self._upper_bound(bucket), self.counts[bucket]) for
+            bucket in sorted(self.counts)]
+
+    def percentile(self, percent):
+        '''Returns an upper bound on the duration that the given percentage
+        of durations didn't exceed, or ``None`` if there aren't any yet.
+        '''
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for upper_bound, count in self.buckets():
+            seen += count
+            if seen >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+
+class _Trace:
+    '''The time spent so far in each stage of handling one chunk of input.
+    '''
+    def __init__(self, clock):
+        self.clock = clock
+        self.start = self.last = clock()
+        self.durations = {}
+
+    def mark(self, stage):
+        now = self.clock()
+        self.durations[stage] = self.durations.get(stage, 0) + now - self.last
+        self.last = now
+
+
+class LatencyTracer:
+    '''Measures the time from input arriving to the resulting update being
+    written to the terminal (keystroke-to-photon latency), broken down into
+    :attr:`stages`. Turn tracing on by giving your root a tracer::
+
+        root.latency_tracer = LatencyTracer(dump_path='latency.txt')
+
+    and then look at :meth:`report` (or :attr:`histograms`) whilst running,
+    or at the file it's dumped to when :meth:`Root.run` exits.
+
+    :parameter dump_path: Where to write the report when the root stops
+        running. (Optional.)
+    :parameter clock: A function returning the current time in seconds.
+    '''
+    stages = 'read', 'decode', 'handler', 'layout', 'populate', 'write'
+
+    def __init__(self, dump_path=None, clock=time.perf_counter):
+        self.dump_path = dump_path
+        self.clock = clock
+        self.histograms = {
+            stage: LatencyHistogram() for stage in self.stages + ('total',)}
+        self._trace = None
+
+    def begin(self):
+        '''Starts timing the handling of a new chunk of input.
+        '''
+        global active_tracer
+        active_tracer = self
+        self._trace = _Trace(self.clock)
+
+    def mark(self, stage):
+        '''Attributes the time since the previous mark to the given stage.
+        Stages may be marked several times (e.g. once per block written).
+        '''
+        if self._trace is not None:
+            self._trace.mark(stage)
+
+    def _stop(self):
+        global active_tracer
+        if active_tracer is self:
+            active_tracer = None
+        trace = self._trace
+        self._trace = None
+        return trace
+
+    def _record(self, trace):
+        for stage, duration in trace.durations.items():
+            self.histograms[stage].add(duration)
+        self.histograms['total'].add(self.clock() - trace.start)
+
+    def end(self, stage=None):
+        '''Finishes timing the current chunk of input, adding the time spent
+        in each stage to its histogram. If a ``stage`` is given, the time
+        since the previous mark is attributed to it first.
+        '''
+        trace = self._stop()
+        if trace is None:
+            return
+        if stage is not None:
+            trace.mark(stage)
+        self._record(trace)
+
+    def defer(self, stage):
+        '''Stops timing the current chunk of input for now, e.g. because the
+        output it caused is still waiting to be written, and returns a
+        function that finishes timing it (attributing the time since the
+        previous mark to ``stage``) when called. Meanwhile, we can
+        :meth:`begin` timing more input.
+        '''
+        trace = self._stop()
+
+        def finish():
+            if trace is not None:
+                trace.mark(stage)
+                self._record(trace)
+        return finish
+
+    def percentiles(self, *percents):
+        '''Returns a dict mapping each stage (and ``'total'``) to a tuple of
+        the given percentiles of its duration, in seconds. Defaults to the
+        50th and 99th percentiles.
+        '''
+        percents = percents or (50, 99)
+        return {
+            stage: tuple(histogram.percentile(p) for p in percents) for
+            stage, histogram in self.histograms.items()}
+
+    def report(self):
+        '''Returns a table of the p50, p99 and maximum durations of each
+        stage, as a string.
+        '''
+        lines = ['{:<9} {:>7} {:>9} {:>9} {:>9}'.format(
+            'stage', 'count', 'p50 ms', 'p99 ms', 'max ms')]
+        for stage in self.stages + ('total',):
+            histogram = self.histograms[stage]
+            if not histogram.count:
+                continue
+            lines.append('{:<9} {:>7} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                stage, histogram.count, histogram.percentile(50) * 1000,
+                histogram.percentile(99) * 1000, histogram.max * 1000))
+        return '\n'.join(lines)
+
+    def dump(self, path=None):
+        '''Writes :meth:`report` to the given file, or to :attr:`dump_path`.
+        '''
+        with open(path or self.dump_path, 'w') as f:
+            f.write(self.report() + '\n')
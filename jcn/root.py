@@ -15,11 +15,17 @@
 
 import asyncio
 import signal
+import threading
+from collections import deque
 from contextlib import contextmanager
 
+from . import profiling
 from .base import ABCUIElement
 from .formatting import FormatPlaceholderFactory, StylePlaceholderFactory
-from .terminal import get_terminal, Keyboard
+from .keymap import KeyDispatcher
+from .terminal import (
+    get_terminal, InputReader, Keyboard, MouseEvent, OutputWriter)
+from .util import FrameClock, SpatialIndex
 
 
 class Root(ABCUIElement):
@@ -32,6 +38,28 @@ class Root(ABCUIElement):
     :parameter loop: The asyncio event loop to use for the main :meth:`run`
         method. (Optional, we will grab a default if none is provided, and
         the loop can be reassigned so long as we're not currently running.)
+    :parameter mouse: Whether :meth:`run` should ask the terminal to report
+        mouse clicks, which are then dispatched to the element under the
+        mouse pointer. (Optional, defaults to ``False`` so that the user can
+        still select text with their mouse as normal.)
+
+    To find out where the time goes when drawing, set :attr:`profiler` to a
+    :class:`jcn.profiling.Profiler`, which will then record the time spent by
+    each element in each phase of layout and rendering for every frame.
+    Elements that animate, such as a :class:`Spinner`, subscribe to our
+    :attr:`frame_clock` (a :class:`jcn.util.FrameClock`), which redraws
+    everything that changed once per frame, and only runs whilst something
+    is animating.
+
+    Similarly, set :attr:`latency_tracer` to a
+    :class:`jcn.profiling.LatencyTracer` to measure how long it takes from
+    input arriving to the screen being updated in response.
+
+    Whilst running, we write to the terminal through a
+    :class:`jcn.terminal.OutputWriter`, so that a terminal that can't keep
+    up (e.g. over a slow SSH connection) never blocks the event loop: frames
+    drawn whilst it's catching up are dropped, and once it has, the newest
+    state of the screen is drawn in one go.
 
     A :class:`Root` object will normally form the nucleus of your application.
     It performs three key roles:
@@ -52,19 +80,43 @@ class Root(ABCUIElement):
     '''
     format = FormatPlaceholderFactory()
     style = StylePlaceholderFactory()
+    # How long (in seconds) to wait after the terminal is resized before
+    # redrawing, during which any further resizes are dealt with by the same
+    # redraw:
+    resize_delay = 0.02
 
-    def __init__(self, element=None, terminal=None, loop=None):
+    def __init__(self, element=None, terminal=None, loop=None, mouse=False):
         super().__init__()
         self._element = None
-        if element:
-            self.element = element
         # FIXME: should terminal and loop be passed in for run() only?
         self.terminal = terminal or get_terminal()
         self.loop = loop or asyncio.get_event_loop()
+        self.frame_clock = FrameClock(loop=self.loop, batch=self.batch)
         self.keyboard = Keyboard()
+        # Set up by run(), to read from and write to the terminal:
+        self.input_reader = None
+        self.output_writer = None
+        self.key_dispatcher = KeyDispatcher()
+        self.mouse = mouse
+        self.profiler = None
+        self.latency_tracer = None
+        self._hit_index = None
+        self._escape_timeout_handle = None
+        self._resize_handle = None
+        self._batch_depth = 0
+        # Calls made from other threads, waiting to be run on our loop:
+        self._thread_calls = deque()
+        self._thread_calls_lock = threading.Lock()
+        self._thread_calls_scheduled = False
+        self._last_thread_calls_time = None
+        self._pending_draw = False
+        self._pending_update = False
         # FIXME: we should probably inherit from ABCContainerElement so that we
         # get stuff like child.updated tracking by default:
         self._updated = True
+        # Elements may want to use our loop, etc., as soon as they're attached:
+        if element is not None:
+            self.element = element
 
     @property
     def element(self):
@@ -77,11 +129,12 @@ class Root(ABCUIElement):
 
     @element.setter
     def element(self, new_element):
-        if self._element:
+        if self._element is not None:
             self._element.root = None
         self._element = new_element
-        if new_element:
+        if new_element is not None:
             new_element.root = self
+        self.key_dispatcher.invalidate()
 
     @property
     def updated(self):
@@ -94,17 +147,271 @@ class Root(ABCUIElement):
     def updated(self, value):
         self._updated = True
 
+    def batch(self):
+        '''Returns a context manager that defers drawing while you make lots
+        of changes to the tree of UI elements. Any :meth:`draw` or
+        :meth:`update` requested by elements whilst the batch is open (e.g.
+        because you added an element to a container) is merely noted, and a
+        single draw or update is performed when the outermost batch exits::
+
+            with root.batch():
+                for row in rows:
+                    stack.add_element(Label(row))
+
+        Batches may be nested, and the returned object may also be used with
+        ``async with`` inside a coroutine.
+        '''
+        return _Batch(self)
+
+    @property
+    def batching(self):
+        '''``True`` whilst a :meth:`batch` is open.
+        '''
+        return self._batch_depth > 0
+
+    def _begin_batch(self):
+        self._batch_depth += 1
+
+    def _end_batch(self):
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return
+        pending_draw = self._pending_draw
+        pending_update = self._pending_update
+        self._pending_draw = self._pending_update = False
+        if pending_draw:
+            self.draw()
+        elif pending_update:
+            self.update()
+
+    def call_from_thread(self, callback, *args):
+        '''Arranges for ``callback(*args)`` to be called on our event loop.
+        This is the only method of :class:`Root` (or of any UI element) that
+        it is safe to call from another thread, so use it to update the UI
+        from worker threads::
+
+            root.call_from_thread(setattr, progress_bar, 'fraction', 0.5)
+
+        Calls are queued, and all those that have arrived by the time the
+        loop gets round to them are run together inside a :meth:`batch`, at
+        most once per frame (see :attr:`frame_clock`), so that however fast
+        other threads make calls the screen is only redrawn once per frame.
+        '''
+        self._thread_calls.append((callback, args))
+        with self._thread_calls_lock:
+            if self._thread_calls_scheduled:
+                return
+            self._thread_calls_scheduled = True
+        self.loop.call_soon_threadsafe(self._schedule_thread_calls)
+
+    def _schedule_thread_calls(self):
+        delay = 0
+        if self._last_thread_calls_time is not None:
+            delay = (
+                self._last_thread_calls_time + self.frame_clock.interval -
+                self.loop.time())
+        if delay > 0:
+            self.loop.call_later(delay, self._run_thread_calls)
+        else:
+            self._run_thread_calls()
+
+    def _run_thread_calls(self):
+        with self._thread_calls_lock:
+            # Any calls made from now on will need running again:
+            self._thread_calls_scheduled = False
+        self._last_thread_calls_time = self.loop.time()
+        with self.batch():
+            while self._thread_calls:
+                callback, args = self._thread_calls.popleft()
+                callback(*args)
+
+    def layout_changed(self):
+        '''Lets us know that the positions of elements on the screen have
+        changed, so that :meth:`element_at` has to look afresh.
+        '''
+        self._hit_index = None
+
+    def _build_hit_index(self):
+        hit_index = SpatialIndex()
+        # Parents are painted before their children so that we find the
+        # deepest element at any given position:
+        to_visit = [self.element] if self.element is not None else []
+        while to_visit:
+            element = to_visit.pop()
+            geometry = element._previous_geometry
+            if geometry is None:
+                continue
+            hit_index.add(
+                geometry.x, geometry.y, geometry.width, geometry.height,
+                element)
+            to_visit.extend(getattr(element, '_layout_keys', ()))
+        return hit_index
+
+    def element_at(self, x, y):
+        '''Returns the deepest element that was drawn at the given position
+        on the screen, or ``None`` if there wasn't one.
+        '''
+        if self._hit_index is None:
+            self._hit_index = self._build_hit_index()
+        return self._hit_index.get(x, y)
+
+    def focus(self, element):
+        '''Makes the given element the active element of each of its
+        ancestors, so that keyboard input will be routed to it.
+        '''
+        while element.parent is not None:
+            element.parent.active_element = element
+            element = element.parent
+
+    def handle_mouse(self, event):
+        '''Dispatches a :class:`MouseEvent` to the element under the mouse
+        pointer, focusing it if it was clicked on. If that element doesn't
+        handle the event, it is offered to each of its ancestors in turn.
+        '''
+        element = self.element_at(event.x, event.y)
+        if element is not None and event.name.endswith('press'):
+            self.focus(element)
+        while element is not None:
+            event = element.handle_mouse(event)
+            if not event:
+                return
+            element = element.parent
+        return event
+
+    def feed_input(self, data):
+        '''Decodes a chunk of raw input from the terminal into individual
+        keys (and mouse events) and dispatches each of them in turn. If the
+        chunk ends with what might be the start of an escape sequence, we wait
+        up to :attr:`Keyboard.escape_timeout` for the rest of it, before
+        treating it as a lone press of the escape key.
+
+        The keys are handled inside a :meth:`batch`, so that the screen is
+        updated just once for the whole chunk, however many keys it held.
+        '''
+        if self._escape_timeout_handle is not None:
+            self._escape_timeout_handle.cancel()
+            self._escape_timeout_handle = None
+        # However many keys the chunk holds, we only redraw once they've all
+        # been handled:
+        tracer = profiling.active_tracer
+        keys = self.keyboard.feed(data)
+        if tracer:
+            tracer.mark('decode')
+        with self.batch():
+            for key in keys:
+                self._dispatch_key(key)
+            if tracer:
+                tracer.mark('handler')
+        if self.keyboard.pending:
+            self._escape_timeout_handle = self.loop.call_later(
+                self.keyboard.escape_timeout, self._on_escape_timeout)
+
+    def _read_input(self):
+        tracer = self.latency_tracer
+        if tracer is not None:
+            tracer.begin()
+        try:
+            data = self.input_reader.read()
+            if tracer is not None:
+                tracer.mark('read')
+            self.feed_input(data)
+        finally:
+            if tracer is not None:
+                self._finish_trace(tracer)
+
+    def _finish_trace(self, tracer):
+        # Our output only reaches the terminal once the output writer has
+        # actually written it, which may be a while if the terminal is slow:
+        writer = self.output_writer
+        if writer is not None and writer.congested:
+            writer.when_drained(tracer.defer('write'))
+        else:
+            tracer.end('write')
+
+    def _on_escape_timeout(self):
+        self._escape_timeout_handle = None
+        with self.batch():
+            for key in self.keyboard.feed('', final=True):
+                self._dispatch_key(key)
+
+    def _dispatch_key(self, key):
+        if isinstance(key, MouseEvent):
+            self.handle_mouse(key)
+            return
+        # Key bindings (see ABCUIElement.bind) take precedence over the
+        # focused element's own handling of input:
+        if self.key_dispatcher.dispatch(self.element, key):
+            return
+        unhandled_input = self.element.handle_input(key)
+        if unhandled_input:
+            self.handle_input(unhandled_input)
+
     @contextmanager
     def _handle_screen_resize(self):
-        signal.signal(signal.SIGWINCH, self._on_screen_resize)
+        self.loop.add_signal_handler(signal.SIGWINCH, self._on_screen_resize)
         try:
-            yield
+            with self.terminal.cached_size():
+                yield
         finally:
-            signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+            self.loop.remove_signal_handler(signal.SIGWINCH)
+            if self._resize_handle is not None:
+                self._resize_handle.cancel()
+                self._resize_handle = None
+
+    def _on_screen_resize(self):
+        # Dragging the corner of a window produces a storm of SIGWINCHs, so
+        # rather than redrawing for each, we redraw once things settle down:
+        self.terminal.invalidate_size()
+        if self._resize_handle is None:
+            self._resize_handle = self.loop.call_later(
+                self.resize_delay, self._redraw_after_resize)
 
-    def _on_screen_resize(self, sig_num, stack_frame):
+    def _redraw_after_resize(self):
+        self._resize_handle = None
         self.draw()
 
+    @contextmanager
+    def _profile_frame(self, kind):
+        if self.profiler is not None:
+            with self.profiler.frame(kind):
+                yield
+        else:
+            yield
+
+    @contextmanager
+    def _output_frame(self):
+        if self.output_writer is not None:
+            with self.output_writer.frame():
+                yield
+        else:
+            yield
+
+    @contextmanager
+    def _nonblocking_output(self):
+        # Rather than blocking whilst a slow terminal catches up with what
+        # we've drawn, we drop frames until it has, then draw afresh:
+        stream = self.terminal.stream
+        if not self.terminal.is_a_tty:
+            yield
+            return
+        self.output_writer = OutputWriter(
+            stream.fileno(), self.loop, redraw=self.draw)
+        self.terminal.stream = self.output_writer
+        try:
+            yield
+        finally:
+            self.output_writer.close()
+            self.output_writer = None
+            self.terminal.stream = stream
+
+    @contextmanager
+    def _mouse_reporting(self):
+        if self.mouse:
+            with self.terminal.mouse_reporting():
+                yield
+        else:
+            yield
+
     def run(self):
         '''The main entry point of a :mod:`jcn`-based application. :meth:`run`
         sets up the terminal and then runs then event loop, continually
@@ -124,17 +431,20 @@ class Root(ABCUIElement):
         with self.terminal.fullscreen(), self.terminal.hidden_cursor(), (
                 self.terminal.unbuffered_input()), (
                 self.terminal.nonblocking_input()), (
-                self._handle_screen_resize()):
-            def read_stdin():
-                data = self.terminal.infile.read()
-                unhandled_input = self.element.handle_input(
-                    self.keyboard[data])
-                if unhandled_input:
-                    self.handle_input(unhandled_input)
+                self._handle_screen_resize()), (
+                self._mouse_reporting()), (
+                self.terminal.bracketed_paste()), (
+                self._nonblocking_output()):
             if self.terminal.infile.isatty():
-                self.loop.add_reader(self.terminal.infile, read_stdin)
+                self.input_reader = InputReader(self.terminal.infile.fileno())
+                self.loop.add_reader(self.input_reader.fd, self._read_input)
             self.draw()
-            self.loop.run_forever()
+            try:
+                self.loop.run_forever()
+            finally:
+                tracer = self.latency_tracer
+                if tracer is not None and tracer.dump_path:
+                    tracer.dump()
 
     def draw(self):
         '''Draw the tree of UI elements once directly to the terminal. The root
@@ -144,10 +454,18 @@ class Root(ABCUIElement):
         attributes of this instances :class:`Terminal`: instance. There is no
         async behaviour triggered from this method - see :meth:`run` if you
         want to :mod:`jcn` to take care redrawing when required.
+
+        If called whilst a :meth:`batch` is open, the draw is deferred until
+        the batch exits.
         '''
-        super().draw(
-            self.terminal.width, self.terminal.height, terminal=self.terminal,
-            styles=self.style)
+        if self.batching:
+            self._pending_draw = True
+            return
+        self.layout_changed()
+        with self._profile_frame('draw'), self._output_frame():
+            super().draw(
+                self.terminal.width, self.terminal.height,
+                terminal=self.terminal, styles=self.style)
 
     def update(self):
         '''Draws directly to the terminal any UI elements in the tree that are
@@ -156,12 +474,44 @@ class Root(ABCUIElement):
         the :attr:`updated` element may be set to ``True`` explicitly by your
         program. The drawing and layout logic are exactly the same as for
         :meth:`draw`.
+
+        If called whilst a :meth:`batch` is open, the update is deferred until
+        the batch exits.
         '''
-        super().update(
-            self.default_format, terminal=self.terminal, styles=self.style)
+        if self.batching:
+            self._pending_update = True
+            return
+        if self._previous_geometry is None:
+            # We haven't drawn anything yet, so there's nothing to update:
+            return
+        with self._profile_frame('update'), self._output_frame():
+            super().update(
+                self.default_format, terminal=self.terminal,
+                styles=self.style)
 
     def _get_all_blocks(self, *args, **kwargs):
         return self.element.get_all_blocks(*args, **kwargs)
 
     def _get_updated_blocks(self, *args, **kwargs):
         return self.element.get_updated_blocks(*args, **kwargs)
+
+
+class _Batch:
+    '''The context manager returned by :meth:`Root.batch`. It works with
+    both ``with`` and ``async with``.
+    '''
+    def __init__(self, root):
+        self.root = root
+
+    def __enter__(self):
+        self.root._begin_batch()
+        return self.root
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.root._end_batch()
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.__exit__(exc_type, exc_value, traceback)
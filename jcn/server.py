@@ -0,0 +1,335 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import codecs
+import re
+
+from .headless import (
+    HeadlessTerminal, Screen, _no_attributes, _sgr_attributes)
+
+
+# What a terminal sends in reply to '\x1b[18t', giving its size in rows and
+# columns. Clients may also send it unprompted when they're resized:
+_size_report = re.compile(r'\x1b\[8;(\d+);(\d+)t')
+# The start of a size report that hasn't all arrived yet (terminal sizes
+# don't run to more than five digits):
+_partial_size_report = re.compile(r'\x1b(\[(8(;\d{0,5}(;\d{0,5})?)?)?)?')
+
+_sgr_codes = {name: code for code, name in _sgr_attributes.items()}
+
+
+def _colour_codes(layer, colour):
+    base = 30 if layer == 'fg' else 40
+    if colour.startswith('#'):
+        red, green, blue = (
+            int(colour[i:i + 2], 16) for i in range(1, 7, 2))
+        return [base + 8, 2, red, green, blue]
+    colour = int(colour)
+    if colour < 8:
+        return [base + colour]
+    if colour < 16:
+        return [base + 60 + colour - 8]
+    return [base + 8, 5, colour]
+
+
+def _select_graphic_rendition(attributes):
+    '''Returns the escape sequence that sets exactly the given attributes.
+    '''
+    codes = [0]
+    for attribute in sorted(attributes):
+        if attribute in _sgr_codes:
+            codes.append(_sgr_codes[attribute])
+        else:
+            layer, colour = attribute.split(' ', 1)
+            codes.extend(_colour_codes(layer, colour))
+    return '\x1b[{}m'.format(';'.join(map(str, codes)))
+
+
+class Client:
+    '''A viewer attached to a :class:`Server`.
+
+    :parameter writer: The :class:`asyncio.StreamWriter` to send the screen
+        to.
+    :parameter width: The width of the client's terminal.
+    :parameter height: The height of the client's terminal.
+
+    We keep a :class:`Screen` of what the client's terminal is showing, so
+    that each time the shared screen changes we only send the client the
+    cells that differ from what it already has.
+    '''
+    def __init__(self, writer, width=80, height=24):
+        self.writer = writer
+        self.screen = Screen(width, height)
+        self.draining = False
+        self._input = ''
+        self._reset = True
+
+    @property
+    def congested(self):
+        '''``True`` if more has been written to the client than its
+        transport is willing to buffer, i.e. the client isn't keeping up.
+        '''
+        transport = self.writer.transport
+        low, high = transport.get_write_buffer_limits()
+        return transport.get_write_buffer_size() > high
+
+    @property
+    def width(self):
+        return self.screen.width
+
+    @property
+    def height(self):
+        return self.screen.height
+
+    def resize(self, width, height):
+        '''Changes the size of the client's terminal, after which it is
+        cleared and sent the whole screen afresh, since terminals differ in
+        what they do with their contents on being resized.
+        '''
+        self.screen = Screen(width, height)
+        self._reset = True
+
+    def feed_input(self, data):
+        '''Looks for reports of the client's terminal size in its input.
+        Returns ``True`` if the client has changed size.
+        '''
+        self._input += data
+        size = None
+        for match in _size_report.finditer(self._input):
+            size = int(match.group(2)), int(match.group(1))
+        # Keep anything that might be the start of a report, which is never
+        # more than a few characters:
+        start = self._input.rfind('\x1b')
+        if start >= 0 and _partial_size_report.fullmatch(self._input, start):
+            self._input = self._input[start:]
+        else:
+            self._input = ''
+        if size is None or size == (self.width, self.height):
+            return False
+        self.resize(*size)
+        return True
+
+    def render(self, source):
+        '''Returns what needs writing to the client's terminal to make it
+        show the given (shared) screen, cropped or padded to the client's
+        size.
+        '''
+        parts = []
+        screen = self.screen
+        if self._reset:
+            parts.append('\x1b[?25l\x1b[0m\x1b[H\x1b[2J')
+            screen.clear()
+            self._x = self._y = 0
+            self._attributes = _no_attributes
+            self._reset = False
+        width = screen.width
+        for y in range(screen.height):
+            chars, cell_attributes = screen.chars[y], screen.cell_attributes[y]
+            if y < source.height:
+                source_chars = source.chars[y][:width]
+                source_attributes = source.cell_attributes[y][:width]
+            else:
+                source_chars = source_attributes = []
+            if source_chars == chars and source_attributes == cell_attributes:
+                continue
+            for x in range(width):
+                if x < len(source_chars):
+                    char, attributes = source_chars[x], source_attributes[x]
+                else:
+                    char, attributes = screen.fillchar, _no_attributes
+                if chars[x] == char and cell_attributes[x] == attributes:
+                    continue
+                if (x, y) != (self._x, self._y):
+                    parts.append('\x1b[{};{}H'.format(y + 1, x + 1))
+                if attributes != self._attributes:
+                    parts.append(_select_graphic_rendition(attributes))
+                    self._attributes = attributes
+                parts.append(char)
+                chars[x], cell_attributes[x] = char, attributes
+                self._x, self._y = x + 1, y
+        return ''.join(parts)
+
+
+class _SharedScreen(Screen):
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+
+    def flush(self):
+        self.server.schedule_send()
+
+
+class Server:
+    '''Serves a single UI to any number of viewers over Unix sockets, e.g.
+    to show the same status screen on several terminals::
+
+        server = Server(root)
+        loop.run_until_complete(server.start('/tmp/status.sock'))
+        loop.run_forever()
+
+    after which each viewer attaches with something like
+    ``socat UNIX-CONNECT:/tmp/status.sock STDIO,raw,echo=0``.
+
+    :parameter root: The :class:`Root` to serve. Its terminal is replaced
+        with a :class:`HeadlessTerminal`, on which the UI is laid out and
+        drawn once however many clients there are.
+    :parameter width: The width to lay the UI out at. (Optional, defaults to
+        the width of the widest client.)
+    :parameter height: The height to lay the UI out at. (Optional, defaults to
+        the height of the tallest client.)
+
+    Each client has its own size, asked of its terminal when it connects,
+    and sees the top left of the UI cropped (or padded) to fit. Whenever
+    the UI is redrawn, each client is sent only the cells that have changed
+    since it was last sent anything. A client that isn't keeping up with
+    what we send isn't sent anything more until it catches up, at which
+    point it is sent everything that has changed in the meantime in one go,
+    so a slow viewer neither holds the others up nor makes us buffer every
+    frame for it. Clients are viewers only: apart from reports of their
+    size, what they send is ignored.
+    '''
+    default_size = 80, 24
+    encoding = 'utf-8'
+
+    def __init__(self, root, width=None, height=None):
+        self.root = root
+        self.loop = root.loop
+        self.width = width
+        self.height = height
+        self.clients = []
+        self.screen = _SharedScreen(self, *self._layout_size())
+        root.terminal = self.terminal = HeadlessTerminal(screen=self.screen)
+        self._server = None
+        self._send_scheduled = False
+        self._closing = False
+        # The tasks serving clients, and waiting for them to catch up:
+        self._tasks = set()
+
+    def _layout_size(self):
+        default_width, default_height = self.default_size
+        width = self.width or max(
+            (client.width for client in self.clients), default=default_width)
+        height = self.height or max(
+            (client.height for client in self.clients),
+            default=default_height)
+        return width, height
+
+    async def start(self, path):
+        '''Starts listening for clients on a Unix socket at the given path.
+        '''
+        self._closing = False
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, path)
+        self._resize()
+
+    def close(self):
+        '''Stops listening for clients and disconnects those attached. Use
+        :meth:`wait_closed` to wait for everything serving them to finish.
+        '''
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        for client in self.clients:
+            client.writer.close()
+        self.clients.clear()
+        for task in self._tasks:
+            task.cancel()
+
+    async def wait_closed(self):
+        '''Waits until everything started to serve clients has finished, after
+        :meth:`close`.
+        '''
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._server is not None:
+            await self._server.wait_closed()
+            self._server = None
+
+    def _track(self, task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle_connection(self, reader, writer):
+        await self.attach(reader, writer)
+
+    async def attach(self, reader, writer):
+        '''Serves the UI to a client that reads from ``writer`` and whose
+        input we read from ``reader`` (a pair of :mod:`asyncio` streams),
+        until it disconnects. A client needn't be on a socket: any pair of
+        streams will do, e.g. ones on the master side of a pty.
+        '''
+        self._track(asyncio.current_task())
+        client = Client(writer, *self.default_size)
+        self.clients.append(client)
+        # Ask the client's terminal how big it is:
+        writer.write(b'\x1b[18t')
+        self._resize()
+        decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                if client.feed_input(decoder.decode(data)):
+                    self._resize()
+        finally:
+            if client in self.clients:
+                self.clients.remove(client)
+            writer.close()
+            if not self._closing:
+                self._resize()
+
+    def _resize(self):
+        width, height = self._layout_size()
+        if (width, height) != (self.screen.width, self.screen.height):
+            self.screen.resize(width, height)
+            self.root.draw()
+        elif self.root._previous_geometry is None:
+            # We haven't drawn anything yet:
+            self.root.draw()
+        else:
+            self.schedule_send()
+
+    def schedule_send(self):
+        '''Arranges for every client to be sent what has changed on the
+        screen, once whatever is drawing to it has finished.
+        '''
+        if not self._send_scheduled:
+            self._send_scheduled = True
+            self.loop.call_soon(self._send)
+
+    def _send(self):
+        self._send_scheduled = False
+        for client in self.clients:
+            if client.draining:
+                # We'll send it everything that's changed once it catches up:
+                continue
+            data = client.render(self.screen)
+            if data:
+                client.writer.write(data.encode(self.encoding))
+            if client.congested:
+                client.draining = True
+                self._track(self.loop.create_task(self._drain(client)))
+
+    async def _drain(self, client):
+        try:
+            await client.writer.drain()
+        except ConnectionError:
+            return
+        finally:
+            client.draining = False
+        if client in self.clients:
+            self.schedule_send()
@@ -14,12 +14,15 @@
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
 import blessings
+import codecs
 import termios
 import tty
 import signal
 import os
 import sys
 import fcntl
+import re
+from collections import namedtuple
 from functools import wraps
 from contextlib import contextmanager
 
@@ -87,7 +90,11 @@ class Terminal(blessings.Terminal):
         # We track these to make SIGTSTP restore the terminal correctly:
         self._is_fullscreen = False
         self._has_hidden_cursor = False
+        self._has_mouse_reporting = False
+        self._has_bracketed_paste = False
         self._resolved_sugar_cache = {}
+        self._caching_size = False
+        self._cached_size = None
 
     def __getattr__(self, attr):
         '''We override ___getattr__ so that we don't do blessings' annoying
@@ -104,6 +111,34 @@ class Terminal(blessings.Terminal):
             self._resolved_sugar_cache[attr] = resolution
             return resolution
 
+    def _height_and_width(self):
+        if not self._caching_size:
+            return super()._height_and_width()
+        if self._cached_size is None:
+            self._cached_size = super()._height_and_width()
+        return self._cached_size
+
+    @contextmanager
+    def cached_size(self):
+        '''Context manager within which :attr:`width` and :attr:`height` are
+        only looked up (with an ioctl) once, and then remembered until
+        :meth:`invalidate_size` is called, e.g. because we got a SIGWINCH.
+
+        :meth:`Root.run` uses this context manager for you.
+        '''
+        self._caching_size = True
+        try:
+            yield
+        finally:
+            self._caching_size = False
+            self._cached_size = None
+
+    def invalidate_size(self):
+        '''Forgets the remembered size of the terminal, so that it's looked
+        up afresh next time it's needed.
+        '''
+        self._cached_size = None
+
     @_override_sugar
     def enter_fullscreen(self):
         self._is_fullscreen = True
@@ -128,12 +163,19 @@ class Terminal(blessings.Terminal):
                 self.stream, termios.TCSADRAIN, self._orig_tty_attrs)
         is_fullscreen = self._is_fullscreen
         has_hidden_cursor = self._has_hidden_cursor
+        has_mouse_reporting = self._has_mouse_reporting
+        has_bracketed_paste = self._has_bracketed_paste
         # Restore normal terminal state:
+        sequences = []
         if is_fullscreen:
-            self.stream.write(self.exit_fullscreen)
+            sequences.append(self.exit_fullscreen)
         if has_hidden_cursor:
-            self.stream.write(self.normal_cursor)
-        self.stream.flush()
+            sequences.append(self.normal_cursor)
+        if has_mouse_reporting:
+            sequences.append(self._disable_mouse_reporting)
+        if has_bracketed_paste:
+            sequences.append(self._disable_bracketed_paste)
+        self._write_now(''.join(sequences))
         # Unfortunately, we have to remove our signal handler and
         # reinstantiate it after we're continued, because the only way we
         # can get python to sleep is if we send the signal to ourselves again
@@ -145,13 +187,30 @@ class Terminal(blessings.Terminal):
             if self.is_a_tty:
                 termios.tcsetattr(
                     self.stream, termios.TCSADRAIN, cur_tty_attrs)
+            sequences = []
             if is_fullscreen:
-                self.stream.write(self.enter_fullscreen)
+                sequences.append(self.enter_fullscreen)
             if has_hidden_cursor:
-                self.stream.write(self.hide_cursor)
+                sequences.append(self.hide_cursor)
+            if has_mouse_reporting:
+                sequences.append(self._enable_mouse_reporting)
+            if has_bracketed_paste:
+                sequences.append(self._enable_bracketed_paste)
+            self._write_now(''.join(sequences))
         signal.signal(signal.SIGCONT, restore_on_sigcont)
         os.kill(os.getpid(), signal.SIGTSTP)
 
+    def _write_now(self, data):
+        # Our stream may be an OutputWriter, which could otherwise still be
+        # holding on to what we write (e.g. in a frame it's part way through)
+        # when we're stopped:
+        drain = getattr(self.stream, 'drain', None)
+        if drain is not None:
+            drain(data)
+        else:
+            self.stream.write(data)
+            self.stream.flush()
+
     @contextmanager
     def unbuffered_input(self):
         '''Context manager for setting the terminal to use unbuffered input.
@@ -209,6 +268,58 @@ class Terminal(blessings.Terminal):
         else:
             yield
 
+    # Basic button press/release reporting, using the SGR (1006) extended
+    # coordinate encoding, which isn't limited to 223 rows/columns:
+    _enable_mouse_reporting = '\x1b[?1000h\x1b[?1006h'
+    _disable_mouse_reporting = '\x1b[?1006l\x1b[?1000l'
+
+    @contextmanager
+    def mouse_reporting(self):
+        '''Context manager that asks the terminal to report mouse button
+        presses, releases and scroll wheel movement to us as input, which
+        :class:`Keyboard` turns into :class:`MouseEvent` objects.
+
+        :meth:`Root.run` uses this context manager for you if you have asked
+        your :class:`Root` for mouse input.
+        '''
+        if self.is_a_tty:
+            self.stream.write(self._enable_mouse_reporting)
+            self.stream.flush()
+            self._has_mouse_reporting = True
+            try:
+                yield
+            finally:
+                self.stream.write(self._disable_mouse_reporting)
+                self.stream.flush()
+                self._has_mouse_reporting = False
+        else:
+            yield
+
+    _enable_bracketed_paste = '\x1b[?2004h'
+    _disable_bracketed_paste = '\x1b[?2004l'
+
+    @contextmanager
+    def bracketed_paste(self):
+        '''Context manager that asks the terminal to mark the beginning and
+        end of any text the user pastes, so that :class:`Keyboard` can deliver
+        it to us as a single :class:`Paste`, rather than as a flood of
+        individual keystrokes.
+
+        :meth:`Root.run` uses this context manager for you.
+        '''
+        if self.is_a_tty:
+            self.stream.write(self._enable_bracketed_paste)
+            self.stream.flush()
+            self._has_bracketed_paste = True
+            try:
+                yield
+            finally:
+                self.stream.write(self._disable_bracketed_paste)
+                self.stream.flush()
+                self._has_bracketed_paste = False
+        else:
+            yield
+
     def draw_lines(self, lines, x=0, y=0):
         '''Write a collection of lines to the terminal stream at the given
         location. The lines are written as one 'block' (i.e. each new line
@@ -239,10 +350,248 @@ def get_terminal():
     return _terminal
 
 
+MouseEvent = namedtuple('MouseEvent', ['name', 'x', 'y'])
+MouseEvent.__doc__ = '''A mouse button or scroll wheel event reported by the
+terminal. ``name`` describes what happened in the same style as the key
+names produced by :class:`Keyboard` (e.g. ``'left press'``, ``'ctrl right
+release'``, ``'scroll up'``) and ``x`` and ``y`` are the zero-based column
+and row of the terminal display at which it happened.
+'''
+
+
+Paste = namedtuple('Paste', ['text'])
+Paste.__doc__ = '''A block of text that the user pasted into the terminal, which
+is delivered as a whole when :meth:`Terminal.bracketed_paste` is in effect.
+Line endings are normalised to ``'\\n'``.
+'''
+
+
+class InputReader:
+    '''Reads whatever input is waiting on a non-blocking file descriptor,
+    without going through Python's buffered file objects.
+
+    :parameter fd: The file descriptor to read from.
+    :parameter buffer_size: The most bytes to read with each system call.
+    :parameter encoding: The encoding of the input.
+
+    Bytes are read straight into a buffer that's reused for every read, and
+    then decoded incrementally, so that a multi-byte character split across
+    two reads comes out whole, once the rest of it has arrived.
+    '''
+    def __init__(self, fd, buffer_size=4096, encoding='utf-8'):
+        self.fd = fd
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._decoder = codecs.getincrementaldecoder(encoding)(
+            errors='replace')
+
+    def read(self):
+        '''Returns all the text that can be read without blocking (which may
+        be an empty string).
+        '''
+        chunks = []
+        while True:
+            try:
+                count = os.readv(self.fd, [self._buffer])
+            except BlockingIOError:
+                break
+            except InterruptedError:
+                continue
+            chunks.append(self._decoder.decode(self._view[:count]))
+            if count < len(self._buffer):
+                # We've either drained the input or reached the end of it:
+                break
+        return ''.join(chunks)
+
+
+class OutputWriter:
+    '''A file-like object that writes to a file descriptor without ever
+    blocking the event loop, for use as a :class:`Terminal`'s stream.
+
+    :parameter fd: The file descriptor to write to, which is made
+        non-blocking until :meth:`close` is called.
+    :parameter loop: The :mod:`asyncio` event loop to wait for the file
+        descriptor to be writable on.
+    :parameter redraw: A callable that writes the whole of the current frame
+        afresh (e.g. :meth:`Root.draw`).
+    :parameter encoding: The encoding of the output.
+
+    Anything written is sent when :meth:`flush` is called, and whatever the
+    file descriptor won't take straight away is sent when it's ready for
+    more. What's written inside a :meth:`frame` is a frame of drawing: if
+    the previous frame is still being sent when a new frame is flushed
+    (e.g. because the terminal is at the end of a slow connection), the new
+    frame is dropped, as is every one after it until the file descriptor
+    catches up, at which point ``redraw`` is called to send the newest state
+    of the screen in one go. Anything written outside of a frame (such as
+    turning on mouse reporting) is never dropped.
+    '''
+    def __init__(self, fd, loop, redraw=None, encoding='utf-8'):
+        self.fd = fd
+        self.loop = loop
+        self.redraw = redraw
+        self.encoding = encoding
+        self.frames_dropped = 0
+        self._flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, self._flags | os.O_NONBLOCK)
+        # What's been written but not flushed, inside and outside of frames:
+        self._frame = []
+        self._unframed = []
+        self._frame_depth = 0
+        # What's been flushed, but that the file descriptor hasn't taken yet:
+        self._sending = bytearray()
+        self._stale = False
+        self._waiting = False
+        self._drained_callbacks = []
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def congested(self):
+        '''``True`` whilst we're waiting for the file descriptor to take what
+        we've already sent it.
+        '''
+        return bool(self._sending)
+
+    @contextmanager
+    def frame(self):
+        '''Context manager within which everything written is one frame,
+        which is flushed (or dropped) as a whole when the context exits.
+        Frames may be nested, in which case they're one frame.
+        '''
+        self._frame_depth += 1
+        try:
+            yield
+        finally:
+            self._frame_depth -= 1
+            if not self._frame_depth:
+                self._flush_frame()
+
+    def write(self, data):
+        if self._frame_depth:
+            self._frame.append(data)
+        else:
+            self._unframed.append(data)
+        return len(data)
+
+    def flush(self):
+        if self._unframed:
+            self._sending += ''.join(self._unframed).encode(self.encoding)
+            self._unframed.clear()
+        if not self._frame_depth:
+            self._send()
+
+    def _flush_frame(self):
+        frame = ''.join(self._frame)
+        self._frame.clear()
+        if self.congested and self.redraw is not None:
+            if frame:
+                self.frames_dropped += 1
+                self._stale = True
+        else:
+            self._sending += frame.encode(self.encoding)
+        self.flush()
+
+    def _send(self):
+        while self._sending:
+            try:
+                count = os.write(self.fd, self._sending)
+            except BlockingIOError:
+                break
+            except InterruptedError:
+                continue
+            del self._sending[:count]
+        if self._sending and not self._waiting:
+            self.loop.add_writer(self.fd, self._on_writable)
+            self._waiting = True
+        elif not self._sending and self._waiting:
+            self.loop.remove_writer(self.fd)
+            self._waiting = False
+        if not self._sending and not self._stale:
+            self._drained()
+
+    def _drained(self):
+        callbacks = self._drained_callbacks
+        self._drained_callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def when_drained(self, callback):
+        '''Calls ``callback`` once everything flushed so far has been
+        written to the file descriptor, including a redraw in place of any
+        frames that were dropped, or straight away if it already has been.
+        '''
+        self._drained_callbacks.append(callback)
+        if not self.congested and not self._stale:
+            self._drained()
+
+    def _on_writable(self):
+        self._send()
+        if not self.congested and self._stale:
+            self._stale = False
+            self.redraw()
+
+    def _send_blocking(self, flags):
+        # The file descriptor may share its flags with one that was already
+        # non-blocking when we started (e.g. a tty that is also our input),
+        # so we explicitly block whilst we finish sending, and then set the
+        # given flags:
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, self._flags & ~os.O_NONBLOCK)
+        try:
+            while self._sending:
+                try:
+                    count = os.write(self.fd, self._sending)
+                except InterruptedError:
+                    continue
+                del self._sending[:count]
+        finally:
+            fcntl.fcntl(self.fd, fcntl.F_SETFL, flags)
+
+    def drain(self, data=''):
+        '''Sends ``data``, after everything that's waiting to be sent (other
+        than a frame that's still being written), blocking until it has all
+        been sent. Use this when the output mustn't wait, e.g. just before
+        the process is suspended.
+        '''
+        self._sending += (
+            ''.join(self._unframed) + data).encode(self.encoding)
+        self._unframed.clear()
+        self._send_blocking(self._flags | os.O_NONBLOCK)
+        self._send()
+        if self._stale:
+            # We can't redraw in place of the frames we dropped until we're
+            # back in the event loop:
+            self._stale = False
+            self.loop.call_soon(self.redraw)
+
+    def close(self):
+        '''Sends everything that's still waiting to be sent, blocking until
+        it has been, and then restores the file descriptor's original flags.
+        '''
+        if self._waiting:
+            self.loop.remove_writer(self.fd)
+            self._waiting = False
+        self._sending += ''.join(self._unframed).encode(self.encoding)
+        self._unframed.clear()
+        self._send_blocking(self._flags)
+        self._stale = False
+        self._drained()
+
+
 class Keyboard:
     '''Utility class for turning key escape sequences into human-parsable key
     names.
+
+    Looking up a single, complete sequence (``keyboard['\\x1b[A']``) gives
+    its name. Alternatively, arbitrary chunks of input, which may contain many
+    keystrokes or only part of one, can be fed to :meth:`feed`, which splits
+    them into individual keys.
     '''
+    # How long (in seconds) to wait for the rest of an escape sequence before
+    # deciding that the user really did just press escape:
+    escape_timeout = 0.05
+
     def __init__(self):
         self._sequence_to_name = {
             '\x1b': 'esc',
@@ -279,6 +628,12 @@ class Keyboard:
         self._sequence_to_name.update(self._create_high_f_keys())
         self._sequence_to_name.update(self._create_ctrl_keys())
         self._sequence_to_name.update(self._create_alt_keys())
+        self._sequence_to_name.update(self._create_modified_keys())
+        self._trie = self._create_trie()
+        self._pending = ''
+        # The chunks of a bracketed paste that we've received so far, if
+        # we're part way through one:
+        self._paste_chunks = None
 
     def _create_high_f_keys(self):
         # make normal key range:
@@ -290,7 +645,8 @@ class Keyboard:
     def _create_ctrl_keys(self):
         ctrl_keys = {}
         for i in range(26):
-            if i != 10:
+            # Tab and return keep their own names:
+            if i not in (9, 10):
                 name = 'ctrl ' + chr(ord('a') + i - 1)
                 sequence = chr(i)
                 ctrl_keys[sequence] = name
@@ -304,7 +660,163 @@ class Keyboard:
             alt_keys[sequence] = name
         return alt_keys
 
+    def _create_modified_keys(self):
+        # xterm reports modifiers held with the cursor keys as a parameter,
+        # e.g. '\x1b[1;2A' for shift up:
+        modifiers = {2: 'shift', 3: 'alt', 5: 'ctrl', 6: 'ctrl shift'}
+        keys = {
+            'A': 'up', 'B': 'down', 'C': 'right', 'D': 'left', 'F': 'end',
+            'H': 'home'}
+        modified_keys = {}
+        for number, modifier in modifiers.items():
+            for final, key in keys.items():
+                sequence = '\x1b[1;{}{}'.format(number, final)
+                modified_keys[sequence] = '{} {}'.format(modifier, key)
+        return modified_keys
+
+    def _create_trie(self):
+        # Each node maps a character to the next node, and maps None to the
+        # name of the key whose sequence ends at that node, if there is one:
+        trie = {}
+        for sequence, name in self._sequence_to_name.items():
+            node = trie
+            for char in sequence:
+                node = node.setdefault(char, {})
+            node[None] = name
+        return trie
+
+    def _match(self, data, start):
+        '''Finds the longest known key sequence at the start position of
+        data. Returns the key's name (or ``None``), the length of its sequence
+        and whether a longer sequence might yet match if we had more data.
+        '''
+        node = self._trie
+        name = None
+        length = 0
+        for i in range(start, len(data)):
+            try:
+                node = node[data[i]]
+            except KeyError:
+                return name, length, False
+            if None in node:
+                name = node[None]
+                length = i + 1 - start
+        return name, length, len(node) > (None in node)
+
+    @staticmethod
+    def _csi_length(data, start):
+        '''Returns the length of the control sequence (``ESC [`` followed by
+        parameter and intermediate bytes and a final byte) at the start
+        position of data, or ``None`` if it isn't complete.
+        '''
+        for i in range(start + 2, len(data)):
+            if '@' <= data[i] <= '~':
+                return i + 1 - start
+            elif not ' ' <= data[i] <= '?':
+                # Not a valid control sequence, so treat it as ending here:
+                return i - start
+        return
+
+    @property
+    def pending(self):
+        '''``True`` if :meth:`feed` is holding on to the start of a
+        sequence, waiting for the rest of it.
+        '''
+        return bool(self._pending) and self._paste_chunks is None
+
+    _paste_start = '\x1b[200~'
+    _paste_end = '\x1b[201~'
+
+    def _feed_paste(self, data, start, keys):
+        '''Collects pasted text from the start position of data, until the
+        end of the paste. Returns the position from which to continue
+        decoding.
+        '''
+        end = data.find(self._paste_end, start)
+        if end == -1:
+            # Hang on to anything that might be the start of the end marker:
+            keep_from = max(len(data) - len(self._paste_end) + 1, start)
+            self._paste_chunks.append(data[start:keep_from])
+            return keep_from
+        self._paste_chunks.append(data[start:end])
+        text = ''.join(self._paste_chunks)
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        self._paste_chunks = None
+        keys.append(Paste(text))
+        return end + len(self._paste_end)
+
+    def feed(self, data, final=False):
+        '''Splits the given chunk of input into individual keys, returning a
+        list of their names (or :class:`MouseEvent` objects). If the chunk ends
+        part way through what might be an escape sequence, that part is kept
+        until the next call. Pass ``final=True`` (e.g. when the
+        :attr:`escape_timeout` has elapsed) to stop waiting for more and decode
+        whatever we have as best we can. The text of a bracketed paste is
+        returned as a single :class:`Paste`, however many chunks it arrives
+        in.
+        '''
+        data = self._pending + data
+        self._pending = ''
+        keys = []
+        i = 0
+        if self._paste_chunks is not None:
+            i = self._feed_paste(data, i, keys)
+        while i < len(data) and self._paste_chunks is None:
+            if data.startswith(self._paste_start, i):
+                self._paste_chunks = []
+                i = self._feed_paste(data, i + len(self._paste_start), keys)
+                continue
+            name, length, incomplete = self._match(data, i)
+            if incomplete and not final:
+                break
+            if (data.startswith('\x1b[', i) and length <= 2 and
+                    len(data) > i + 2):
+                length = self._csi_length(data, i)
+                if length is None:
+                    if not final:
+                        break
+                    length = len(data) - i
+                keys.append(self[data[i:i + length]])
+            elif name:
+                keys.append(name)
+            else:
+                length = 1
+                keys.append(data[i])
+            i += length
+        self._pending = data[i:]
+        return keys
+
+    _mouse_sequence_regex = re.compile(r'\x1b\[<(\d+);(\d+);(\d+)([Mm])$')
+    _mouse_buttons = {0: 'left', 1: 'middle', 2: 'right'}
+
+    def _parse_mouse_sequence(self, sequence):
+        match = self._mouse_sequence_regex.match(sequence)
+        if not match:
+            return
+        code, x, y, final = match.groups()
+        code = int(code)
+        if code & 64:
+            name = 'scroll down' if code & 1 else 'scroll up'
+        else:
+            button = self._mouse_buttons.get(code & 3, 'no button')
+            if code & 32:
+                action = 'drag'
+            elif final == 'm':
+                action = 'release'
+            else:
+                action = 'press'
+            name = '{} {}'.format(button, action)
+        for mask, modifier in ((4, 'shift'), (8, 'alt'), (16, 'ctrl')):
+            if code & mask:
+                name = '{} {}'.format(modifier, name)
+        # The terminal counts from 1:
+        return MouseEvent(name, int(x) - 1, int(y) - 1)
+
     def __getitem__(self, sequence):
+        if sequence.startswith('\x1b[<'):
+            mouse_event = self._parse_mouse_sequence(sequence)
+            if mouse_event:
+                return mouse_event
         if sequence in self._sequence_to_name:
             return self._sequence_to_name[sequence]
         else:
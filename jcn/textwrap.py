@@ -20,9 +20,13 @@ from .formatting import StringWithFormatting
 
 
 class TextWrapper:
-    def __init__(self, width, break_on_hyphens=True):
+    ''':parameter keep_indent: Whether to keep any whitespace at the start of
+        the text, rather than dropping it as we do at each line break.
+    '''
+    def __init__(self, width, break_on_hyphens=True, keep_indent=False):
         self.width = width
         self.break_on_hyphens = break_on_hyphens
+        self.keep_indent = keep_indent
 
     def _chunk(self, string_like):
         if self.break_on_hyphens:
@@ -65,8 +69,11 @@ class TextWrapper:
         '''
         result = []
         chunks = self._chunk(text)
+        strip = not self.keep_indent
         while chunks:
-            self._lstrip(chunks)
+            if strip:
+                self._lstrip(chunks)
+            strip = True
             current_line = []
             current_line_length = 0
             current_chunk_length = 0
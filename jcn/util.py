@@ -14,6 +14,7 @@
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
 import asyncio
+from bisect import bisect_left, bisect_right
 from itertools import cycle
 
 
@@ -78,7 +79,398 @@ def weighted_round_robin(iterable):
     return cycle(cyclable_list)
 
 
+class FenwickTree:
+    '''A list of numbers that can efficiently compute sums of prefixes of
+    itself (i.e. a binary indexed tree). Getting and setting individual values,
+    appending, :meth:`prefix_sum` and :meth:`find` are all O(log n), though
+    inserting or deleting anywhere other than the end is O(n).
+    '''
+    def __init__(self, values=()):
+        self._values = []
+        self._tree = [0]
+        self._rebuild(values)
+
+    def _rebuild(self, values):
+        self._values = list(values)
+        tree = [0] + self._values
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += len(self._values)
+        delta = value - self._values[index]
+        self._values[index] = value
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def __delitem__(self, index):
+        values = self._values
+        del values[index]
+        self._rebuild(values)
+
+    def insert(self, index, value):
+        values = self._values
+        values.insert(index, value)
+        self._rebuild(values)
+
+    def append(self, value):
+        self._values.append(value)
+        i = len(self._values)
+        # The new node covers the values (i - lowbit(i), i]:
+        self._tree.append(
+            value + self.prefix_sum(i - 1) - self.prefix_sum(i - (i & -i)))
+
+    def prefix_sum(self, length):
+        '''Returns the sum of the first ``length`` values.
+        '''
+        result = 0
+        i = min(length, len(self._values))
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        return result
+
+    @property
+    def total(self):
+        return self.prefix_sum(len(self._values))
+
+    def find(self, offset):
+        '''Treating each value as the length of a consecutive span, returns
+        the index of the span that contains ``offset``, i.e. the largest index
+        for which ``prefix_sum(index) <= offset``. Values must not be negative.
+        Returns ``len(self)`` if ``offset`` lies beyond the last span.
+        '''
+        index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            next_index = index + step
+            if next_index < len(self._tree) and (
+                    self._tree[next_index] <= offset):
+                index = next_index
+                offset -= self._tree[next_index]
+            step >>= 1
+        return index
+
+
+class GapBuffer:
+    '''A sequence of characters that keeps a gap of free space at the
+    position of the most recent edit, so that inserting and deleting
+    characters at (or near) the same position, as happens when typing, is
+    amortized O(1) rather than requiring the whole string to be rebuilt.
+    '''
+    def __init__(self, text='', gap_size=16):
+        self._chars = list(text) + [None] * gap_size
+        self._gap_start = len(text)
+        self._gap_end = len(self._chars)
+
+    def __len__(self):
+        return len(self._chars) - (self._gap_end - self._gap_start)
+
+    def __str__(self):
+        return (
+            ''.join(self._chars[:self._gap_start]) +
+            ''.join(self._chars[self._gap_end:]))
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError('GapBuffer index out of range')
+        if index >= self._gap_start:
+            index += self._gap_end - self._gap_start
+        return self._chars[index]
+
+    def _move_gap(self, position):
+        chars = self._chars
+        gap_size = self._gap_end - self._gap_start
+        if position < self._gap_start:
+            # Shift the characters between position and the gap to after it:
+            moved = chars[position:self._gap_start]
+            chars[position + gap_size:self._gap_end] = moved
+        elif position > self._gap_start:
+            moved = chars[self._gap_end:position + gap_size]
+            chars[self._gap_start:position] = moved
+        self._gap_start = position
+        self._gap_end = position + gap_size
+
+    def _ensure_gap(self, size):
+        gap_size = self._gap_end - self._gap_start
+        if gap_size < size:
+            # Grow geometrically so that appending stays amortized O(1):
+            extra = max(size - gap_size, len(self._chars))
+            self._chars[self._gap_end:self._gap_end] = [None] * extra
+            self._gap_end += extra
+
+    def insert(self, position, text):
+        '''Inserts text before the character at the given position.
+        '''
+        if not 0 <= position <= len(self):
+            raise IndexError('GapBuffer position out of range')
+        self._move_gap(position)
+        self._ensure_gap(len(text))
+        self._chars[self._gap_start:self._gap_start + len(text)] = text
+        self._gap_start += len(text)
+
+    def delete(self, position, count=1):
+        '''Deletes up to ``count`` characters, starting with the one at the
+        given position.
+        '''
+        if not 0 <= position <= len(self):
+            raise IndexError('GapBuffer position out of range')
+        self._move_gap(position)
+        self._gap_end = min(self._gap_end + count, len(self._chars))
+
+
+class PieceTable:
+    '''A (potentially very large) string that supports insertions and
+    deletions anywhere without copying the text either side of the edit. The
+    original text is never modified; instead, inserted text is appended to a
+    separate buffer, and the document is described by a list of pieces, each
+    of which is a span of one of those two buffers.
+
+    We also keep track of where each line starts: the positions of the
+    newlines in each buffer are found once, when the text is added, and the
+    number of newlines in each piece is kept in a :class:`FenwickTree`
+    alongside the piece lengths. This makes finding the start of a line, or
+    the line that contains an offset, O(log p) in the number of pieces p.
+
+    Typing straight after the previous insertion just extends its piece,
+    which is also O(log p). Any other edit splits or removes pieces, and
+    inserting into or deleting from the middle of a :class:`FenwickTree`
+    means rebuilding it, so such edits are O(p) (though p only grows with
+    the number of separate edits, not with the size of the text).
+    '''
+    def __init__(self, text=''):
+        self._buffers = (text, [])
+        self._buffer_newlines = (self._find_newlines(text), [])
+        self._pieces = [[0, 0, len(text)]] if text else []
+        self._rebuild_indices()
+
+    @staticmethod
+    def _find_newlines(text, base=0):
+        newlines = []
+        position = text.find('\n')
+        while position != -1:
+            newlines.append(base + position)
+            position = text.find('\n', position + 1)
+        return newlines
+
+    def _rebuild_indices(self):
+        self._lengths = FenwickTree(piece[2] for piece in self._pieces)
+        self._newlines = FenwickTree(
+            self._count_newlines(piece) for piece in self._pieces)
+
+    def _count_newlines(self, piece):
+        buffer, start, length = piece
+        newlines = self._buffer_newlines[buffer]
+        return (
+            bisect_left(newlines, start + length) -
+            bisect_left(newlines, start))
+
+    def _buffer_text(self, buffer, start, end):
+        if buffer == 0:
+            return self._buffers[0][start:end]
+        return ''.join(self._buffers[1][start:end])
+
+    def _replace_pieces(self, start, end, new_pieces):
+        self._pieces[start:end] = new_pieces
+        # The trees can only be updated in place if no pieces have moved:
+        if len(new_pieces) == end - start:
+            for i, piece in enumerate(new_pieces, start=start):
+                self._lengths[i] = piece[2]
+                self._newlines[i] = self._count_newlines(piece)
+        else:
+            self._rebuild_indices()
+
+    def __len__(self):
+        return self._lengths.total
+
+    def __str__(self):
+        return self.text()
+
+    @property
+    def line_count(self):
+        return self._newlines.total + 1
+
+    def text(self, start=0, end=None):
+        '''Returns the text between the given offsets.
+        '''
+        if end is None or end > len(self):
+            end = len(self)
+        parts = []
+        index = self._lengths.find(start)
+        offset = self._lengths.prefix_sum(index)
+        while index < len(self._pieces) and offset < end:
+            buffer, piece_start, length = self._pieces[index]
+            parts.append(self._buffer_text(
+                buffer,
+                piece_start + max(start - offset, 0),
+                piece_start + min(end - offset, length)))
+            offset += length
+            index += 1
+        return ''.join(parts)
+
+    def insert(self, offset, text):
+        '''Inserts text before the character at the given offset.
+        '''
+        if not 0 <= offset <= len(self):
+            raise IndexError('PieceTable offset out of range')
+        if not text:
+            return
+        added = self._buffers[1]
+        start = len(added)
+        added.extend(text)
+        self._buffer_newlines[1].extend(self._find_newlines(text, start))
+        index = self._lengths.find(offset)
+        local_offset = offset - self._lengths.prefix_sum(index)
+        if local_offset == 0 and index > 0:
+            previous = self._pieces[index - 1]
+            if previous[0] == 1 and previous[1] + previous[2] == start:
+                # Typing extends the piece made by the previous keystroke:
+                previous[2] += len(text)
+                self._lengths[index - 1] = previous[2]
+                self._newlines[index - 1] = self._count_newlines(previous)
+                return
+        new_piece = [1, start, len(text)]
+        if local_offset == 0:
+            self._replace_pieces(index, index, [new_piece])
+        else:
+            buffer, piece_start, length = self._pieces[index]
+            self._replace_pieces(index, index + 1, [
+                [buffer, piece_start, local_offset],
+                new_piece,
+                [buffer, piece_start + local_offset, length - local_offset]])
+
+    def delete(self, start, end):
+        '''Deletes the text between the given offsets.
+        '''
+        end = min(end, len(self))
+        if start < 0:
+            raise IndexError('PieceTable offset out of range')
+        if start >= end:
+            return
+        new_pieces = []
+        first = self._lengths.find(start)
+        first_offset = self._lengths.prefix_sum(first)
+        if start > first_offset:
+            buffer, piece_start, length = self._pieces[first]
+            new_pieces.append([buffer, piece_start, start - first_offset])
+        last = self._lengths.find(end - 1)
+        last_end = self._lengths.prefix_sum(last + 1)
+        if end < last_end:
+            buffer, piece_start, length = self._pieces[last]
+            new_pieces.append(
+                [buffer, piece_start + length - (last_end - end),
+                 last_end - end])
+        self._replace_pieces(first, last + 1, new_pieces)
+
+    def line_start(self, line):
+        '''Returns the offset of the first character of the given line.
+        '''
+        if line == 0:
+            return 0
+        if not 0 < line < self.line_count:
+            raise IndexError('PieceTable line out of range')
+        # Find the piece that holds the newline that ends the previous line:
+        nth_newline = line - 1
+        index = self._newlines.find(nth_newline)
+        nth_newline -= self._newlines.prefix_sum(index)
+        buffer, piece_start, length = self._pieces[index]
+        newlines = self._buffer_newlines[buffer]
+        position = newlines[bisect_left(newlines, piece_start) + nth_newline]
+        return self._lengths.prefix_sum(index) + position - piece_start + 1
+
+    def line_end(self, line):
+        '''Returns the offset just past the last character of the given
+        line, not including its newline.
+        '''
+        if line + 1 < self.line_count:
+            return self.line_start(line + 1) - 1
+        if line + 1 == self.line_count:
+            return len(self)
+        raise IndexError('PieceTable line out of range')
+
+    def line(self, line):
+        '''Returns the text of the given line, without its newline.
+        '''
+        return self.text(self.line_start(line), self.line_end(line))
+
+    def line_of(self, offset):
+        '''Returns the line that contains the given offset.
+        '''
+        index = self._lengths.find(offset)
+        if index >= len(self._pieces):
+            return self._newlines.total
+        buffer, piece_start, length = self._pieces[index]
+        local_offset = offset - self._lengths.prefix_sum(index)
+        newlines = self._buffer_newlines[buffer]
+        return self._newlines.prefix_sum(index) + (
+            bisect_left(newlines, piece_start + local_offset) -
+            bisect_left(newlines, piece_start))
+
+
+class SpatialIndex:
+    '''Records which item covers each position of a 2D grid, given a series
+    of rectangles that are painted one over the other, like blocks drawn to
+    the screen. Each row is stored as a sorted list of runs, so looking up the
+    item at a position is O(log n) in the number of runs on that row.
+    '''
+    def __init__(self):
+        self._rows = {}
+
+    def clear(self):
+        self._rows.clear()
+
+    def add(self, x, y, width, height, item):
+        '''Paints the given rectangle with ``item``, obscuring whatever was
+        previously painted there.
+        '''
+        if width <= 0:
+            return
+        end = x + width
+        for row_y in range(y, y + height):
+            starts, items = self._rows.setdefault(row_y, ([], []))
+            # Whatever currently covers the position just after our rectangle
+            # must still start there afterwards:
+            i = bisect_right(starts, end) - 1
+            item_after = items[i] if i >= 0 else None
+            lo = bisect_left(starts, x)
+            hi = bisect_right(starts, end)
+            starts[lo:hi] = [x, end]
+            items[lo:hi] = [item, item_after]
+
+    def get(self, x, y):
+        '''Returns the item last painted over the given position, or ``None``
+        if nothing covers it.
+        '''
+        try:
+            starts, items = self._rows[y]
+        except KeyError:
+            return
+        i = bisect_right(starts, x) - 1
+        if i >= 0:
+            return items[i]
+
+
 class LoopingCall:
+    '''Calls a function repeatedly, every ``interval`` seconds. For
+    animating UI elements, subscribe to :attr:`Root.frame_clock` (a
+    :class:`FrameClock`) instead, so that all animations share one timer and
+    one redraw per frame.
+    '''
     def __init__(self, func, *args, **kwargs):
         self.func = func
         self.args = args
@@ -102,6 +494,77 @@ class LoopingCall:
         self.running = False
 
 
+class FrameClock:
+    '''A timer shared by everything that animates, which calls each of its
+    subscribers once per frame with the (event loop) time of the frame.
+
+    :parameter interval: The time between frames, in seconds.
+    :parameter loop: The :mod:`asyncio` event loop to run on.
+    :parameter batch: An optional callable returning a context manager to
+        call the subscribers within; :class:`Root` passes its
+        :meth:`Root.batch`, so that each frame is drawn just once, however
+        many elements changed.
+
+    Frames are scheduled at fixed times from when the clock started, rather
+    than an interval after the previous frame finished, so that slow frames
+    don't make animations drift; frames that we fall too far behind for are
+    skipped. When nothing is subscribed the clock stops altogether, so that
+    an idle application doesn't wake up for no reason.
+    '''
+    def __init__(self, interval=1 / 30, loop=None, batch=None):
+        self.interval = interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.batch = batch
+        # A dict rather than a set, so that subscribers are called in order:
+        self._subscribers = {}
+        self._handle = None
+        self._ticking = False
+        self._next_time = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    @property
+    def running(self):
+        return self._handle is not None or self._ticking
+
+    def subscribe(self, callback):
+        self._subscribers[callback] = None
+        if not self.running:
+            self._next_time = self.loop.time()
+            self._handle = self.loop.call_soon(self._tick)
+
+    def unsubscribe(self, callback):
+        self._subscribers.pop(callback, None)
+        if not self._subscribers and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _notify(self, frame_time):
+        for callback in list(self._subscribers):
+            callback(frame_time)
+
+    def _tick(self):
+        self._handle = None
+        self._ticking = True
+        try:
+            if self.batch is not None:
+                with self.batch():
+                    self._notify(self._next_time)
+            else:
+                self._notify(self._next_time)
+        finally:
+            self._ticking = False
+        if not self._subscribers:
+            return
+        self._next_time += self.interval
+        now = self.loop.time()
+        if self._next_time <= now:
+            missed = int((now - self._next_time) / self.interval) + 1
+            self._next_time += missed * self.interval
+        self._handle = self.loop.call_at(self._next_time, self._tick)
+
+
 class InheritDocstrings(type):
     def __new__(cls, cls_name, bases, classdict):
         for attr_name, attr in classdict.items():
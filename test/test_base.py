@@ -40,3 +40,8 @@ class TestBlock(TestCase):
         block = Block(3, 4, ['Milton', 'Jones'], 'spangly')
         self.assertEqual(
             repr(block), "Block(3, 4, ['Milton', 'Jones'], 'spangly')")
+
+    def test_eq(self):
+        block = Block(1, 2, ['hello'], None, element='an element')
+        self.assertEqual(block, Block(1, 2, ['hello'], None))
+        self.assertNotEqual(block, Block(1, 2, ['world'], None))
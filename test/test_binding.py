@@ -0,0 +1,124 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+from unittest import TestCase
+from mock import patch
+from io import StringIO
+
+from jcn.terminal import Terminal
+from jcn.root import Root
+from jcn.display_elements import Label, ProgressBar
+from jcn.container_elements import Stack
+
+
+class TestBinding(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_loop(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_bind_async_iterator(self):
+        received = asyncio.Event()
+
+        async def values():
+            for value in (0.25, 0.5, 0.5):
+                yield value
+            received.set()
+        progress_bar = ProgressBar()
+        binding = progress_bar.bind_attribute(
+            'fraction', values(), loop=self.loop)
+        self.loop.run_until_complete(received.wait())
+        self.run_loop(0)
+        self.assertEqual(progress_bar.fraction, 0.5)
+        self.assertFalse(binding.running)
+
+    def test_bind_polled_callable(self):
+        values = iter(['a', 'a', 'b'])
+        label = Label('')
+        received = []
+        with patch.object(
+                Label, 'content', property(
+                    lambda self: '', lambda self, value: received.append(
+                        value))):
+            label.bind_attribute(
+                'content', lambda: next(values, 'b'), 0.001, self.loop)
+            self.run_loop(0.05)
+            label.unbind_attribute('content')
+            self.run_loop(0)
+        # Repeated values are only set once:
+        self.assertEqual(received, ['a', 'b'])
+        self.assertFalse(label._attribute_bindings)
+
+    def test_bind_polled_coroutine(self):
+        label = Label('')
+
+        async def poll():
+            return 'polled'
+        label.bind_attribute('content', poll, 0.001, self.loop)
+        self.run_loop(0.01)
+        self.assertEqual(label.content, 'polled')
+        label.unbind_attribute('content')
+        self.run_loop(0)
+
+    def test_detaching_cancels_bindings(self):
+        label = Label('')
+        stack = Stack(label)
+        Root(stack, terminal=Terminal(stream=StringIO()), loop=self.loop)
+        binding = label.bind_attribute('content', lambda: 'x', 0.001)
+        self.assertIs(binding.loop, self.loop)
+        stack.remove_element(label)
+        self.run_loop(0)
+        self.assertFalse(binding.running)
+        self.assertFalse(label._attribute_bindings)
+
+    def test_source_errors_are_reported(self):
+        errors = []
+        self.loop.set_exception_handler(
+            lambda loop, context: errors.append(context['exception']))
+
+        def source():
+            raise ValueError('broken')
+        Label('').bind_attribute('content', source, 0.001, self.loop)
+        self.run_loop(0.01)
+        self.assertEqual([str(error) for error in errors], ['broken'])
+
+    def test_bind_requires_a_loop(self):
+        with self.assertRaises(RuntimeError):
+            Label('').bind_attribute('content', lambda: 'x', 0.001)
+
+    def test_bind_requires_interval_for_callables(self):
+        with self.assertRaises(TypeError):
+            Label('').bind_attribute('content', lambda: 'x', loop=self.loop)
+
+    def test_unchanged_values_dont_redraw(self):
+        terminal = Terminal(stream=StringIO())
+        label = Label('same')
+        root = Root(label, terminal=terminal, loop=self.loop)
+        with patch('jcn.Terminal.width', 5), patch('jcn.Terminal.height', 1):
+            root.draw()
+            label.updated = False
+            with patch.object(root, 'update') as update:
+                label.bind_attribute('content', lambda: 'same', 0.001)
+                self.run_loop(0.05)
+            self.assertFalse(update.called)
+            self.assertFalse(label.updated)
+            label.bind_attribute('content', lambda: 'new', 0.001)
+            self.run_loop(0.05)
+            self.assertEqual(label.content, 'new')
+            label.unbind_attribute('content')
+            self.run_loop(0)
@@ -0,0 +1,153 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+from io import StringIO
+from unittest import TestCase
+from mock import patch
+
+from jcn.completion import CompletionIndex, Completer
+from jcn.container_elements import Stack
+from jcn.input_elements import LineInput
+from jcn.root import Root
+from jcn.terminal import Terminal
+
+
+WORDS = ['apple', 'apricot', 'banana', 'apply', 'application', 'band']
+
+
+class TestCompletionIndex(TestCase):
+    def test_complete(self):
+        index = CompletionIndex(WORDS + ['apple'])
+        self.assertEqual(len(index), 6)
+        self.assertEqual(
+            index.complete('ap'),
+            ['apple', 'application', 'apply', 'apricot'])
+        self.assertEqual(index.complete('ban', limit=1), ['banana'])
+        self.assertEqual(index.complete('c'), [])
+        self.assertEqual(index(''), sorted(WORDS))
+        self.assertEqual(index('a', 2), ['apple', 'application'])
+
+    def test_search(self):
+        index = CompletionIndex(WORDS)
+        search, other_search = index.search(), index.search()
+        self.assertEqual(search('ap'), [
+            'apple', 'application', 'apply', 'apricot'])
+        # Each search narrows from its own previous query:
+        self.assertEqual(other_search('b'), ['banana', 'band'])
+        self.assertEqual(search._previous_range, (0, 4))
+        self.assertEqual(search('appl'), ['apple', 'application', 'apply'])
+        self.assertEqual(search._previous_range, (0, 3))
+        self.assertEqual(other_search('ban'), ['banana', 'band'])
+        # Starting again:
+        self.assertEqual(search('ban', 1), ['banana'])
+        self.assertEqual(search('c'), [])
+
+    def test_build(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        index = loop.run_until_complete(
+            CompletionIndex.build(WORDS, loop=loop))
+        self.assertEqual(index.complete('b'), ['banana', 'band'])
+
+
+class TestCompleter(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.line_input = LineInput('')
+        self.root = Root(
+            self.line_input, terminal=Terminal(stream=StringIO()),
+            loop=self.loop)
+        self.updates = []
+        self.line_input.content_updated_callback = (
+            lambda line_buffer: self.updates.append(line_buffer.content))
+
+    def _popup_lines(self, completer):
+        return [label.content for label in completer.popup]
+
+    def test_completion(self):
+        completer = Completer(
+            self.line_input, CompletionIndex(WORDS), max_items=3)
+        self.assertIsInstance(completer.popup, Stack)
+        self.root.feed_input('ap')
+        self.assertEqual(
+            self._popup_lines(completer), ['apple', 'application', 'apply'])
+        self.root.feed_input('pl')
+        self.assertEqual(completer.completions[0], 'apple')
+        # Wrapping around at both ends:
+        self.root.feed_input('\x1b[B' * 3 + '\x1b[A' * 2)
+        self.assertEqual(completer.selected, 1)
+        self.assertIsNotNone(completer.popup[1].default_format)
+        self.root.feed_input('\t')
+        self.assertEqual(str(self.line_input.line_buffer), 'application')
+        self.assertEqual(self.line_input.line_buffer.cursor_position, 11)
+        self.assertEqual(self._popup_lines(completer), [])
+        # We didn't get in the way of the existing callback:
+        self.assertEqual(self.updates[-1], 'application')
+        # Without completions, tab isn't ours:
+        with patch.object(self.line_input, 'handle_input') as (
+                mock_handle_input):
+            self.root.feed_input('\t')
+        mock_handle_input.assert_called_once_with('tab')
+
+    def test_shared_index(self):
+        index = CompletionIndex(WORDS)
+        other_input = LineInput('')
+        completer = Completer(self.line_input, index)
+        other_completer = Completer(other_input, index)
+        self.root.feed_input('ap')
+        other_input.line_buffer.content = 'b'
+        self.root.feed_input('r')
+        self.assertEqual(completer.completions, ['apricot'])
+        self.assertEqual(other_completer.completions, ['banana', 'band'])
+
+    def test_query_without_root(self):
+        async def provider(text, limit):
+            return [text]
+        completer = Completer(LineInput(''), provider)
+        # There's no loop to run the query on:
+        with self.assertRaises(RuntimeError):
+            completer.query('a')
+        completer.loop = self.loop
+        completer.query('a')
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(completer.completions, ['a'])
+
+    def test_limit(self):
+        limits = []
+
+        def provider(text, limit):
+            limits.append(limit)
+            return WORDS
+        completer = Completer(self.line_input, provider, max_items=2)
+        self.root.feed_input('a')
+        self.assertEqual(limits, [2])
+        self.assertEqual(completer.completions, WORDS[:2])
+
+    def test_async_provider(self):
+        queries = []
+
+        async def provider(text, limit):
+            queries.append(text)
+            await asyncio.sleep(0)
+            return [text + '!']
+        completer = Completer(self.line_input, provider)
+        self.root.feed_input('a')
+        self.root.feed_input('b')
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        # The query for 'a' was cancelled before it even started:
+        self.assertEqual(queries, ['ab'])
+        self.assertEqual(self._popup_lines(completer), ['ab!'])
@@ -22,8 +22,9 @@ from io import StringIO
 from jcn.terminal import Terminal
 from jcn.root import Root
 from jcn.base import Block
-from jcn.display_elements import Fill
-from jcn.container_elements import Box, Stack, Zebra, VerticalSplitContainer
+from jcn.display_elements import Fill, Label, Spinner
+from jcn.container_elements import (
+    Box, Stack, Zebra, VerticalSplitContainer, Grid, GridTrack)
 
 
 class TestBase(TestCase):
@@ -68,10 +69,8 @@ class TestBase(TestCase):
 
 class ContainerElementTestCase(TestCase):
     def setUp(self):
-        self.terminal = Terminal()
         self.stream = StringIO()
-        self.terminal.stream = self.stream
-        self.terminal.is_a_tty = False
+        self.terminal = Terminal(stream=self.stream)
         self.maxDiff = 0
 
     def check_get_all_blocks(self, element, width, height, expected):
@@ -100,6 +99,170 @@ class TestRoot(ContainerElementTestCase):
         self.assertIs(root.element, fill2)
         self.assertIs(fill2.root, root)
 
+    def test_detached_elements_stop_animating(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        spinner = Spinner()
+        stack = Stack(spinner)
+        root = Root(stack, terminal=self.terminal, loop=loop)
+        clock = root.frame_clock
+        self.assertTrue(clock.running)
+        stack.remove_element(spinner)
+        self.assertIsNone(spinner.root)
+        self.assertFalse(clock.running)
+        stack.add_element(spinner)
+        stack.replace_element(spinner, Fill())
+        self.assertFalse(clock.running)
+        for _ in range(3):
+            stack.content = [Spinner()]
+        self.assertEqual(len(clock), 1)
+        # Elements that stay in the content are still attached:
+        kept = stack[0]
+        stack.content = [kept, Fill()]
+        self.assertIs(kept.root, root)
+        self.assertEqual(len(clock), 1)
+        grid = Grid(columns=1, rows=1)
+        stack.content = [grid]
+        grid.add_element(Spinner())
+        grid.content = [Fill()]
+        self.assertFalse(clock.running)
+
+
+class TestLazySource(ContainerElementTestCase):
+    def _counting_source(self, pulled):
+        for i in range(100):
+            pulled.append(i)
+            yield Fill(str(i % 10))
+
+    def test_stack_materializes_on_demand(self):
+        pulled = []
+        stack = Stack(Fill('a'), source=self._counting_source(pulled))
+        self.assertEqual(len(stack), 1)
+        self.assertEqual(pulled, [])
+        self.check_get_all_blocks(
+            stack, 2, 3,
+            [Block(0, 0, ['aa'], None),
+             Block(0, 1, ['00'], None),
+             Block(0, 2, ['11'], None)])
+        self.assertEqual(pulled, [0, 1])
+        self.assertEqual(len(stack), 3)
+        stack.offset = 5
+        self.check_get_all_blocks(
+            stack, 2, 2,
+            [Block(0, 0, ['44'], None),
+             Block(0, 1, ['55'], None)])
+        self.assertEqual(len(stack), 7)
+        stack.valign = 'bottom'
+        stack.get_all_blocks(2, 2)
+        self.assertEqual(len(stack), 101)
+        self.assertIsNone(stack.source)
+
+    def test_split_materializes_everything(self):
+        vsplit = VerticalSplitContainer(source=iter([Fill('1'), Fill('2')]))
+        self.assertEqual(len(vsplit), 0)
+        self.check_get_all_blocks(
+            vsplit, 2, 1,
+            [Block(0, 0, ['1'], None),
+             Block(1, 0, ['2'], None)])
+
+    def test_grid_materializes_into_free_cells(self):
+        source = iter([Fill(str(i)) for i in range(5)])
+        grid = Grid(columns=2, rows=1, source=source)
+        self.check_get_all_blocks(
+            grid, 4, 1,
+            [Block(0, 0, ['00'], None),
+             Block(2, 0, ['11'], None)])
+        self.assertEqual(len(grid), 2)
+        # The rest are left in the source for when cells are freed:
+        grid.remove_element(grid[0])
+        self.check_get_all_blocks(grid, 4, 1, [Block(0, 0, ['22'], None)])
+        self.assertEqual(next(source).char, '3')
+
+    def test_nested_stack_materializes_tall_children(self):
+        def tall_fills():
+            for char in 'abc':
+                fill = Fill(char)
+                fill.min_height = 3
+                yield fill
+        inner = Stack(source=tall_fills())
+        outer = Stack(inner, Fill('z'))
+        # The inner stack's first child turns out to be taller than the
+        # inner stack was when empty, so the outer stack makes room for it:
+        self.check_get_all_blocks(
+            outer, 1, 5,
+            [Block(0, 0, ['a'] * 3, None),
+             Block(0, 3, ['z'], None)])
+        self.assertEqual(outer.min_height, 4)
+        # There's no more height to fill, so no more children are taken:
+        self.assertEqual(len(inner), 1)
+
+    def test_async_source(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def source():
+            for char in 'abc':
+                await asyncio.sleep(0)
+                yield Fill(char)
+
+        stack = Stack(source=source())
+        with patch('jcn.Terminal.width', 2), patch(
+                'jcn.Terminal.height', 3):
+            root = Root(stack, terminal=self.terminal, loop=loop)
+            root.draw()
+            self.assertEqual(len(stack), 0)
+            loop.run_until_complete(stack._source_task)
+        self.assertEqual([fill.char for fill in stack], ['a', 'b', 'c'])
+        self.assertIsNone(stack.source)
+        self.assertIn('cc', self.stream.getvalue())
+
+
+class TestIncrementalLayout(ContainerElementTestCase):
+    def _make_panes(self):
+        panes = [Stack(Fill(str(i))) for i in range(4)]
+        vsplit = VerticalSplitContainer(*panes)
+        vsplit.get_all_blocks(8, 3)
+        return panes, vsplit
+
+    def test_membership_change_relayouts_only_subtree(self):
+        panes, vsplit = self._make_panes()
+        panes[1].add_element(Fill('x'))
+        blocks = vsplit.get_updated_blocks()
+        self.assertEqual(blocks, [
+            Block(2, 0, ['  ', '  ', '  '], None),
+            Block(2, 0, ['11'], None),
+            Block(2, 1, ['xx'], None)])
+        self.assertEqual(vsplit.get_updated_blocks(), [])
+
+    def test_relevant_constraint_change_relayouts_parent(self):
+        panes, vsplit = self._make_panes()
+        # Stacks don't care about their children's widths, but the split
+        # does:
+        panes[0][0].min_width = 5
+        blocks = vsplit.get_updated_blocks()
+        self.assertIn(Block(0, 0, [' ' * 8] * 3, None), blocks)
+        self.assertIn(Block(0, 0, ['00000'], None), blocks)
+        # ...whereas the split ignores min_height for its panes:
+        panes[2][0].min_height = 2
+        blocks = vsplit.get_updated_blocks()
+        self.assertEqual(blocks, [
+            Block(6, 0, [' ', ' ', ' '], None),
+            Block(6, 0, ['2', '2'], None)])
+
+    def test_set_weight(self):
+        fill1 = Fill('1')
+        fill2 = Fill('2')
+        vsplit = VerticalSplitContainer(fill1, fill2)
+        vsplit.get_all_blocks(3, 1)
+        vsplit.set_weight(fill1, 2)
+        self.assertIn(Block(0, 0, ['11'], None), vsplit.get_updated_blocks())
+
+    def test_root_updates_before_drawing(self):
+        stack = Stack()
+        root = Root(stack, terminal=self.terminal)
+        stack.add_element(Fill())
+        self.assertEqual(self.stream.getvalue(), '')
+
 
 class TestBox(ContainerElementTestCase):
     def test_box(self):
@@ -180,6 +343,61 @@ class TestStack(ContainerElementTestCase):
             [Block(0, 3, ['33333'], fill3.default_format),
              Block(0, 2, ['11111'], fill1.default_format)])
 
+    def test_stack_offsets(self):
+        fills = [Fill(str(i)) for i in range(5)]
+        fills[1].min_height = 3
+        stack = Stack(*fills)
+        self.assertEqual(stack.min_height, 7)
+        self.assertEqual(stack.row_at_offset(0), 0)
+        self.assertEqual(stack.row_at_offset(3), 1)
+        self.assertEqual(stack.row_at_offset(4), 2)
+        self.assertEqual(stack.offset_of_row(4), 6)
+        with self.assertRaises(IndexError):
+            stack.row_at_offset(7)
+        fills[1].min_height = 1
+        self.assertEqual(stack.min_height, 5)
+        self.assertEqual(stack.row_at_offset(4), 4)
+        stack.remove_element(fills[0])
+        self.assertEqual(stack.offset_of_row(3), 3)
+
+    def test_stack_label_constraints(self):
+        labels = [Label('a'), Label('b'), Label('c')]
+        stack = Stack(*labels)
+        labels[0].min_height = labels[0].max_height = 2
+        self.assertEqual(stack.min_height, 4)
+        self.check_get_all_blocks(
+            stack, 1, 4,
+            [Block(0, 0, ['a', ' '], None),
+             Block(0, 2, ['b'], None)])
+        # After a removal the indices of later children move up:
+        stack.remove_element(labels[0])
+        labels[2].min_height = labels[2].max_height = 3
+        self.assertEqual(stack.min_height, 4)
+        self.assertEqual(stack.row_at_offset(1), 1)
+
+    def test_stack_scrolling(self):
+        fills = [Fill(str(i)) for i in range(5)]
+        fills[1].min_height = 2
+        stack = Stack(*fills)
+        stack.scroll_to(2)
+        self.assertEqual(stack.offset, 3)
+        self.check_get_all_blocks(
+            stack, 2, 2,
+            [Block(0, 0, ['22'], None),
+             Block(0, 1, ['33'], None)])
+        # Offsets part way through a child start at the child:
+        stack.offset = 2
+        self.check_get_all_blocks(
+            stack, 2, 2,
+            [Block(0, 0, ['11', '11'], None)])
+        stack.valign = 'bottom'
+        stack.scroll_to(2)
+        self.assertEqual(stack.offset, 2)
+        self.check_get_all_blocks(
+            stack, 2, 3,
+            [Block(0, 2, ['22'], None),
+             Block(0, 0, ['11', '11'], None)])
+
     def test_update_stack(self):
         fill1 = Fill('1')
         fill2 = Fill('2')
@@ -343,3 +561,78 @@ class TestVerticalSplitContainer(ContainerElementTestCase):
         self.assertEqual(vsplit.min_width, 7)
         fill2.min_width = 35
         self.assertEqual(vsplit.min_width, 42)
+
+
+class TestGrid(ContainerElementTestCase):
+    def test_auto_placement(self):
+        fills = [Fill(str(i)) for i in range(4)]
+        grid = Grid(*fills, columns=2, rows=2)
+        blocks = grid.get_all_blocks(5, 3)
+        self.assertEqual(blocks, [
+            Block(0, 0, ['     '] * 3, None),
+            Block(0, 0, ['000', '000'], None),
+            Block(3, 0, ['11', '11'], None),
+            Block(0, 2, ['222'], None),
+            Block(3, 2, ['33'], None)])
+        with self.assertRaises(ValueError):
+            grid.add_element(Fill())
+        grid.remove_element(fills[1])
+        grid.add_element(fills[1])
+        self.assertEqual(len(grid), 4)
+        grid.content = [Fill('x')]
+        self.assertIsNone(fills[0].parent)
+        grid.add_element(Fill('y'))
+        self.assertEqual(grid.get_all_blocks(5, 3)[1:], [
+            Block(0, 0, ['xxx', 'xxx'], None),
+            Block(3, 0, ['yy', 'yy'], None)])
+
+    def test_tracks(self):
+        grid = Grid(
+            columns=[
+                GridTrack(size=2), GridTrack(weight=2),
+                GridTrack(min_size=1, max_size=2)],
+            rows=1)
+        self.assertEqual(grid.min_width, 3)
+        self.assertIsNone(grid.max_width)
+        self.assertEqual(grid.min_height, 0)
+        grid.add_element(Fill('a'), row=0, column=0)
+        grid.add_element(Fill('b'), row=0, column=1)
+        grid.add_element(Fill('c'), row=0, column=2)
+        self.check_get_all_blocks(
+            grid, 10, 1,
+            [Block(0, 0, ['aa'], None),
+             Block(2, 0, ['bbbbbb'], None),
+             Block(8, 0, ['cc'], None)])
+        self.check_get_all_blocks(
+            grid, 4, 1,
+            [Block(0, 0, ['aa'], None),
+             Block(2, 0, ['b'], None),
+             Block(3, 0, ['c'], None)])
+
+    def test_spans(self):
+        grid = Grid(columns=3, rows=2)
+        grid.add_element(Fill('a'), row=0, column=0, column_span=2)
+        grid.add_element(Fill('b'), row=0, column=2, row_span=2)
+        with self.assertRaises(ValueError):
+            grid.add_element(Fill('x'), row=1, column=2)
+        with self.assertRaises(ValueError):
+            grid.add_element(Fill('x'), row=2, column=0)
+        grid.add_element(Fill('c'))
+        self.check_get_all_blocks(
+            grid, 3, 2,
+            [Block(0, 0, ['aa'], None),
+             Block(2, 0, ['b', 'b'], None),
+             Block(0, 1, ['c'], None)])
+
+    def test_track_cache(self):
+        grid = Grid(Fill(), columns=1, rows=1)
+        with patch.object(
+                grid, '_size_tracks', wraps=grid._size_tracks) as mock_size:
+            grid.get_all_blocks(4, 4)
+            grid.get_all_blocks(4, 4)
+            self.assertEqual(mock_size.call_count, 2)
+            grid.get_all_blocks(5, 4)
+            self.assertEqual(mock_size.call_count, 4)
+            grid.rows = [GridTrack(size=2)]
+            grid.get_all_blocks(5, 4)
+            self.assertEqual(mock_size.call_count, 6)
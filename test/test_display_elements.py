@@ -15,9 +15,10 @@
 
 # coding=utf-8
 from unittest import TestCase
+from mock import Mock
 
 from jcn.root import Root
-from jcn.display_elements import Fill, Text, Label, ProgressBar
+from jcn.display_elements import Fill, Text, Label, ProgressBar, Spinner
 from jcn.formatting import null_placeholder, StringComponent
 
 
@@ -143,6 +144,38 @@ class TestDisplayElements(TestCase):
         progress_bar.fraction = -0.1
         self.assertEqual(progress_bar.fraction, 0)
 
+    def test_progress_bar_indeterminate(self):
+        progress_bar = ProgressBar(indeterminate=True)
+        progress_bar.root = Mock()
+        progress_bar.root.frame_clock.subscribe.assert_called_once_with(
+            progress_bar._on_frame)
+        lines = []
+        for frame_time in (0, 0.5, 1, 1.5, 2):
+            progress_bar._on_frame(frame_time)
+            lines.extend(progress_bar._get_lines(10, 1))
+        self.assertEqual(lines, [
+            '[==      ]', '[   ==   ]', '[      ==]', '[   ==   ]',
+            '[==      ]'])
+        progress_bar.indeterminate = False
+        progress_bar.root.frame_clock.unsubscribe.assert_called_once_with(
+            progress_bar._on_frame)
+        self.assertEqual(progress_bar._get_lines(10, 1), ['[        ]'])
+
+    def test_spinner(self):
+        spinner = Spinner(interval=0.1)
+        root = Mock()
+        spinner.root = root
+        root.frame_clock.subscribe.assert_called_once_with(spinner._on_frame)
+        self.assertEqual(spinner._get_lines(1, 1), ['|'])
+        spinner._on_frame(0.05)
+        self.assertEqual(root.update.call_count, 0)
+        spinner._on_frame(0.25)
+        self.assertEqual(root.update.call_count, 1)
+        self.assertEqual(spinner._get_lines(1, 1), ['-'])
+        spinner.root = None
+        root.frame_clock.unsubscribe.assert_called_once_with(
+            spinner._on_frame)
+
     def test_progress_bar_unicode(self):
         progress_bar = ProgressBar(':*█:')
         progress_bar.fraction = 0.5
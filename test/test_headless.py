@@ -0,0 +1,78 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+from unittest import TestCase
+
+from jcn.headless import HeadlessTerminal, Screen
+from jcn.root import Root
+from jcn.container_elements import Stack
+from jcn.display_elements import Label
+
+
+class TestScreen(TestCase):
+    def test_write(self):
+        screen = Screen(6, 3)
+        screen.write('ab\x1b[2;3Hcd\x1b[?25l\x1b(B\rX\nlonger than six')
+        self.assertEqual(screen.lines(), ['ab    ', 'X cd  ', 'longer'])
+        self.assertEqual(str(screen), 'ab    \nX cd  \nlonger')
+        screen.write('\x1b[2;2H\x1b[K\x1b[1;2H\x1b[1K')
+        self.assertEqual(screen.lines(), ['      ', 'X     ', 'longer'])
+        screen.write('\x1b[2J')
+        self.assertEqual(screen.lines(), ['      '] * 3)
+
+    def test_attributes(self):
+        screen = Screen(8, 1)
+        screen.write(
+            '\x1b[1;7ma\x1b[27;31mb\x1b[38;5;200;48;2;255;0;16mc\x1b[39md'
+            '\x1b[0me\x1b[96;101mf\x1b[mg')
+        self.assertEqual(screen.cell(0, 0), ('a', {'bold', 'reverse'}))
+        self.assertEqual(screen.cell(1, 0), ('b', {'bold', 'fg 1'}))
+        self.assertEqual(
+            screen.cell(2, 0), ('c', {'bold', 'fg 200', 'bg #ff0010'}))
+        self.assertEqual(screen.cell(3, 0), ('d', {'bold', 'bg #ff0010'}))
+        self.assertEqual(screen.cell(4, 0), ('e', set()))
+        self.assertEqual(screen.cell(5, 0), ('f', {'fg 14', 'bg 9'}))
+        self.assertEqual(screen.cell(6, 0), ('g', set()))
+
+    def test_resize(self):
+        screen = Screen(3, 2)
+        screen.write('abc\x1b[2;1Hdef')
+        screen.resize(4, 1)
+        self.assertEqual(screen.lines(), ['abc '])
+
+
+class TestHeadlessTerminal(TestCase):
+    def test_render(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        terminal = HeadlessTerminal(width=12, height=3)
+        label = Label(Root.format.bold('Hello') + ' world')
+        root = Root(
+            Stack(label, Label(Root.format.reverse('x'))), terminal=terminal,
+            loop=loop)
+        root.draw()
+        self.assertEqual(
+            terminal.screen.lines(),
+            ['Hello world ', 'x           ', '            '])
+        self.assertEqual(terminal.screen.cell(0, 0), ('H', {'bold'}))
+        self.assertEqual(terminal.screen.cell(5, 0), (' ', set()))
+        self.assertEqual(terminal.screen.cell(0, 1), ('x', {'reverse'}))
+        label.content = 'Bye'
+        root.update()
+        self.assertEqual(terminal.screen.lines()[0], 'Bye         ')
+        terminal.resize(5, 2)
+        root.draw()
+        self.assertEqual(terminal.screen.lines(), ['Bye  ', 'x    '])
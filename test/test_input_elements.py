@@ -16,8 +16,11 @@
 from unittest import TestCase
 from mock import Mock
 
-from jcn.input_elements import LineBuffer, LineInput
-from jcn.terminal import Terminal
+from jcn.input_elements import (
+    LineBuffer, LineInput, TextEditor, EditHistory, Edit)
+from jcn.keymap import KeyDispatcher
+from jcn.terminal import Terminal, Paste
+from jcn.textwrap import wrap
 
 
 class TestInputElements(TestCase):
@@ -43,6 +46,57 @@ class TestInputElements(TestCase):
         self.line_buffer.clear()
         self.assertEqual(str(self.line_buffer), '')
 
+    def test_line_buffer_undo(self):
+        self.line_buffer = LineBuffer()
+        self._buffer_input_helper('hello world', 'hello world')
+        self._buffer_input_helper(['backspace'] * 3, 'hello wo')
+        self._buffer_input_helper(['home', 'delete', 'delete'], 'llo wo')
+        self.assertEqual(len(self.line_buffer.history), 3)
+        self.assertTrue(self.line_buffer.undo())
+        self.assertEqual(str(self.line_buffer), 'hello wo')
+        self.assertEqual(self.line_buffer.cursor_position, 2)
+        self.line_buffer.undo()
+        self.assertEqual(str(self.line_buffer), 'hello world')
+        self.line_buffer.undo()
+        self.assertEqual(str(self.line_buffer), '')
+        self.assertFalse(self.line_buffer.undo())
+        self.assertTrue(self.line_buffer.redo())
+        self.assertEqual(str(self.line_buffer), 'hello world')
+        self.assertEqual(self.line_buffer.cursor_position, 11)
+        # Editing forgets what was undone:
+        self._buffer_input_helper('!', 'hello world!')
+        self.assertFalse(self.line_buffer.redo())
+
+    def test_edit_history(self):
+        history = EditHistory(max_size=10)
+        history.record(0, '', 'abc')
+        history.record(3, '', 'def')
+        history.seal()
+        history.record(6, '', 'g')
+        history.record(3, '', 'x')
+        self.assertEqual(len(history), 3)
+        # The oldest edits are forgotten to keep within max_size:
+        history.record(4, '', 'hijk')
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history.undo(), Edit(3, 'xhijk', ''))
+        self.assertEqual(history.undo(), Edit(6, 'g', ''))
+        self.assertIsNone(history.undo())
+        self.assertEqual(history.redo(), Edit(6, '', 'g'))
+
+    def test_line_buffer_paste(self):
+        self.line_buffer = LineBuffer()
+        updates = []
+        self.line_buffer.content_updated_callback = updates.append
+        self._buffer_input_helper('held', 'held')
+        self._buffer_input_helper(['left', 'left'], 'held')
+        self._buffer_input_helper([Paste('llo\nwor')], 'hello world')
+        self.assertEqual(updates, [self.line_buffer] * 5)
+        self.assertEqual(self.line_buffer.cursor_position, 9)
+        # The content is only joined into a string when it's asked for:
+        self.line_buffer.handle_input('!')
+        self.assertIsNone(self.line_buffer._content)
+        self.assertEqual(updates[-1].content, 'hello wor!ld')
+
     def _buffer_input_helper(self, sequence, expected_result):
         for char in sequence:
             self.line_buffer.handle_input(char)
@@ -59,3 +113,144 @@ class TestInputElements(TestCase):
         block = line_input._get_lines(0, 0)
         self.assertEqual(
             block, ['some important input' + terminal.reverse(' ')])
+
+
+    def test_line_input_keymap(self):
+        dispatcher = KeyDispatcher()
+        line_input = LineInput('')
+        line_input.root = Mock(key_dispatcher=dispatcher)
+        line_input.line_buffer.content = 'hello'
+        line_input.line_buffer.cursor_position = 5
+        # The editing keys are bindings, which go through the dispatcher...
+        self.assertEqual(line_input.handle_input('left'), 'left')
+        self.assertEqual(line_input.line_buffer.cursor_position, 5)
+        self.assertTrue(dispatcher.dispatch(line_input, 'left'))
+        self.assertEqual(line_input.line_buffer.cursor_position, 4)
+        self.assertTrue(line_input.updated)
+        # ...and so can be rebound:
+        line_input.bind('home', line_input.line_buffer.clear)
+        self.assertTrue(dispatcher.dispatch(line_input, 'home'))
+        self.assertEqual(str(line_input.line_buffer), '')
+        line_input.keymap.unbind('backspace')
+        self.assertFalse(dispatcher.dispatch(line_input, 'backspace'))
+        self.assertEqual(line_input.handle_input('backspace'), 'backspace')
+
+class TestTextEditor(TestCase):
+    def setUp(self):
+        self.editor = TextEditor('hello world\nsecond line\nthird')
+
+    def _press(self, *keys):
+        for key in keys:
+            self.assertIsNone(self.editor.handle_input(key))
+
+    def test_cursor_motion(self):
+        self._press('down', 'end')
+        self.assertEqual(self.editor.cursor_position, 23)
+        # Up and down remember which column we were aiming for:
+        self._press('down', 'up')
+        self.assertEqual(self.editor.cursor_position, 23)
+        self._press('up')
+        self.assertEqual(self.editor.cursor_position, 11)
+        self._press('home', 'left', 'right', 'right')
+        self.assertEqual(self.editor.cursor_position, 2)
+        self._press('pagedown')
+        self.assertEqual(self.editor.cursor_position, 14)
+        self.assertEqual(self.editor.handle_input('f1'), 'f1')
+
+    def test_editing(self):
+        self._press('down', 'end', 'return', *'new')
+        self._press('space', 'backspace', 'backspace')
+        self._press('up', 'home', 'delete')
+        self.assertEqual(
+            self.editor.content, 'hello world\necond line\nne\nthird')
+        self.editor.handle_input(Paste('s\nS'))
+        self.assertEqual(
+            self.editor.content, 'hello world\ns\nSecond line\nne\nthird')
+        self.assertEqual(self.editor.cursor_position, 15)
+
+    def test_selection(self):
+        self._press('right', 'shift right', 'shift right', 'shift down')
+        self.assertEqual(self.editor.selection, (1, 15))
+        self.assertEqual(self.editor.selected_text, 'ello world\nsec')
+        self._press('X')
+        self.assertEqual(self.editor.content, 'hXond line\nthird')
+        self.assertIsNone(self.editor.selection)
+        self.editor.select(0, 2)
+        self._press('backspace')
+        self.assertEqual(self.editor.content, 'ond line\nthird')
+        self.editor.select(0, 4)
+        self._press('left')
+        self.assertIsNone(self.editor.selection)
+        self.assertEqual(self.editor.cursor_position, 3)
+
+    def test_viewport(self):
+        rows = self.editor._get_lines(6, 4)
+        self.assertEqual(
+            [str(row) for row in rows], ['hello', 'world', 'second', 'line'])
+        self.assertEqual(rows[0], TextEditor.cursor_format('h') + 'ello')
+        # Moving the cursor off the bottom scrolls by whole lines:
+        self._press('down', 'down', 'end')
+        rows = self.editor._get_lines(6, 4)
+        self.assertEqual(self.editor.top_line, 1)
+        self.assertEqual(
+            [str(row) for row in rows], ['second', 'line', 'third '])
+        self.editor.wrap = False
+        self.editor.top_line = 0
+        rows = self.editor._get_lines(6, 2)
+        self.assertEqual(self.editor.top_line, 1)
+        # Lines that aren't wrapped are only read as far as we can show:
+        self.assertEqual([str(row) for row in rows], ['second', 'third '])
+
+    def test_long_line(self):
+        self.editor.content = ('word ' * 400000) + 'end'
+        rows = self.editor._get_lines(12, 3)
+        self.assertEqual(
+            [str(row) for row in rows],
+            ['word word', 'word word', 'word word'])
+        self._press('end')
+        rows = self.editor._get_lines(12, 3)
+        self.assertTrue(str(rows[-1]).endswith('end '))
+        self.assertEqual(self.editor.top_line, 0)
+        self._press('home')
+        rows = self.editor._get_lines(12, 3)
+        self.assertEqual(str(rows[0]), 'word word')
+        self.assertEqual(self.editor._top_column, 0)
+
+    def _rows(self, text, width, cursor=0):
+        self.editor.content = text
+        self.editor.cursor_position = cursor
+        return self.editor._get_lines(width, 10)
+
+    def test_wrapping_matches_textwrap(self):
+        for text, width in [
+                ('hello world again', 5), ('well-known words', 6),
+                ('exactly five chars', 7), ('abcdefghij klm', 5),
+                # Wide characters count as one column each, as they do in
+                # jcn.textwrap:
+                ('日本語のテキスト です', 4)]:
+            rows = self._rows(text, width, len(text) + 1)
+            self.assertEqual([str(row) for row in rows], wrap(text, width))
+        # Unlike when wrapping paragraphs, indentation is kept:
+        self.assertEqual(
+            [str(row) for row in self._rows('  ab cd ef', 8, 20)],
+            ['  ab cd', 'ef'])
+
+    def test_cursor_at_break(self):
+        cursor_format = TextEditor.cursor_format
+        # The cursor on the space dropped at a break stays in the last column
+        # rather than going past the edge:
+        rows = self._rows('hello world', 5, 5)
+        self.assertEqual(rows, ['hell' + cursor_format('o'), 'world'])
+        rows = self._rows('ab    cd', 5, 3)
+        self.assertEqual(rows, ['ab ' + cursor_format(' '), 'cd'])
+        rows = self._rows('hello world', 5, 6)
+        self.assertEqual(rows, ['hello', cursor_format('w') + 'orld'])
+
+    def test_large_content(self):
+        self.editor.content = 'line\n' * 1000000
+        self.editor.cursor_position = 2500000
+        self._press(*'edit')
+        rows = self.editor._get_lines(10, 3)
+        self.assertEqual(self.editor.top_line, 499998)
+        self.assertEqual(
+            [str(row) for row in rows], ['line', 'line', 'editline'])
@@ -0,0 +1,119 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+from unittest import TestCase
+from mock import Mock
+from io import StringIO
+
+from jcn.keymap import Keymap
+from jcn.terminal import Terminal
+from jcn.root import Root
+from jcn.container_elements import Stack
+from jcn.display_elements import Fill
+
+
+class TestKeymap(TestCase):
+    def test_compile(self):
+        save, quit_, other = Mock(), Mock(), Mock()
+        keymap = Keymap({'ctrl s': save, ('ctrl x', 'ctrl c'): quit_})
+        self.assertEqual(len(keymap), 2)
+        self.assertIn(['ctrl x', 'ctrl c'], keymap)
+        self.assertIs(keymap['ctrl s'], save)
+        self.assertEqual(
+            keymap.compile(), {'ctrl s': save, 'ctrl x': {'ctrl c': quit_}})
+        keymap.bind('ctrl x', other)
+        keymap.unbind('ctrl s')
+        self.assertEqual(keymap.compile(), {'ctrl x': other})
+        with self.assertRaises(ValueError):
+            keymap.bind((), other)
+
+
+class TestKeyDispatcher(TestCase):
+    def setUp(self):
+        self.fill = Fill()
+        self.inner = Stack(self.fill)
+        self.outer = Stack(self.inner)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.root = self.make_root(self.outer)
+        self.dispatcher = self.root.key_dispatcher
+
+    def make_root(self, element):
+        return Root(
+            element, terminal=Terminal(stream=StringIO()), loop=self.loop)
+
+    def test_inheritance(self):
+        outer, inner = Mock(), Mock()
+        self.outer.bind('a', outer)
+        self.outer.bind('b', outer)
+        self.inner.bind('a', inner)
+        self.assertTrue(self.dispatcher.dispatch(self.outer, 'a'))
+        self.assertTrue(self.dispatcher.dispatch(self.outer, 'b'))
+        self.assertFalse(self.dispatcher.dispatch(self.outer, 'c'))
+        self.assertEqual(inner.call_count, 1)
+        self.assertEqual(outer.call_count, 1)
+
+    def test_resolved_chain_is_cached(self):
+        handler = Mock()
+        self.inner.bind('a', handler)
+        self.dispatcher.dispatch(self.outer, 'a')
+        trie = self.dispatcher.resolve(self.fill)
+        self.dispatcher.dispatch(self.outer, 'a')
+        self.assertIs(self.dispatcher.resolve(self.fill), trie)
+        # Moving the focus elsewhere means looking again:
+        other = Fill()
+        self.inner.add_element(other)
+        self.inner.active_element = other
+        self.dispatcher.dispatch(self.outer, 'a')
+        self.assertEqual(handler.call_count, 3)
+        self.inner.keymap = None
+        self.assertFalse(self.dispatcher.dispatch(self.outer, 'a'))
+
+    def test_chords(self):
+        handler = Mock()
+        self.fill.bind(('ctrl x', 'ctrl s'), handler)
+        self.assertTrue(self.dispatcher.dispatch(self.outer, 'ctrl x'))
+        self.assertTrue(self.dispatcher.pending)
+        self.assertTrue(self.dispatcher.dispatch(self.outer, 'ctrl s'))
+        self.assertFalse(self.dispatcher.pending)
+        handler.assert_called_once_with()
+        self.dispatcher.dispatch(self.outer, 'ctrl x')
+        self.assertFalse(self.dispatcher.dispatch(self.outer, 'q'))
+        self.assertFalse(self.dispatcher.pending)
+
+    def test_unfocused_changes_keep_cache(self):
+        handler = Mock()
+        self.inner.bind('a', handler)
+        elsewhere = Stack()
+        self.outer.add_element(elsewhere)
+        self.dispatcher.dispatch(self.outer, 'a')
+        trie = self.dispatcher.resolve(self.fill)
+        # Nothing on the way down to the focused element has changed:
+        elsewhere.add_element(Fill())
+        elsewhere.bind('a', Mock())
+        self.make_root(Stack(Fill())).element.add_element(Fill())
+        self.dispatcher.dispatch(self.outer, 'a')
+        self.assertIs(self.dispatcher.resolve(self.fill), trie)
+        self.assertEqual(handler.call_count, 2)
+        # But a new binding on the way down is picked up:
+        replacement = Mock()
+        self.fill.bind('a', replacement)
+        self.dispatcher.dispatch(self.outer, 'a')
+        replacement.assert_called_once_with()
+        # As is the focused element being removed:
+        self.inner.remove_element(self.fill)
+        self.assertTrue(self.dispatcher.dispatch(self.outer, 'a'))
+        self.assertEqual(handler.call_count, 3)
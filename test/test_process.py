@@ -0,0 +1,119 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import sys
+from unittest import TestCase
+from mock import patch
+from io import StringIO
+
+from jcn.terminal import Terminal
+from jcn.root import Root
+from jcn.process import SGRParser, ProcessOutput
+from jcn.formatting import (
+    FormatPlaceholderFactory, StringWithFormatting, null_placeholder)
+
+
+class TestSGRParser(TestCase):
+    def test_parse(self):
+        format = FormatPlaceholderFactory()
+        parser = SGRParser()
+        self.assertEqual(parser.parse('plain'), 'plain')
+        self.assertEqual(
+            parser.parse('a \x1b[1;31mbold red\x1b[0m b'),
+            StringWithFormatting(
+                'a ' + (format.bold + format.red)('bold red') + ' b'))
+        # Formatting carries on to the next line:
+        self.assertEqual(
+            parser.parse('\x1b[38;5;200mpink'),
+            StringWithFormatting(format.color(200)('pink')))
+        self.assertEqual(
+            parser.parse('still'),
+            StringWithFormatting(format.color(200)('still')))
+        # Other escape sequences are dropped:
+        self.assertEqual(parser.parse('\x1b[39mcleared\x1b[K'), 'cleared')
+
+    def test_track(self):
+        parser = SGRParser()
+        parser.track('\x1b[4munderlined')
+        self.assertEqual(list(parser.state), ['underline'])
+        parser.track('\x1b[32mgreen\x1b[0m then \x1b[44mblue background')
+        self.assertEqual(list(parser.state), ['bg'])
+        self.assertEqual(parser.placeholder.attr_name, 'on_blue')
+        parser.track('\x1b[49m')
+        self.assertIs(parser.placeholder, null_placeholder)
+
+
+class TestProcessOutput(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_python(self, output, code):
+        return self.loop.run_until_complete(
+            output.run(sys.executable, '-c', code))
+
+    def test_run(self):
+        format = FormatPlaceholderFactory()
+        output = ProcessOutput()
+        returncode = self.run_python(output, '\n'.join([
+            'import sys',
+            'print("one")',
+            'print("\\x1b[31mtwo\\x1b[0m")',
+            'print("three\\tfour\\rfive")',
+            'sys.stdout.flush()',
+            'sys.stderr.write("error")',
+            'sys.exit(3)']))
+        self.assertEqual(returncode, 3)
+        self.assertFalse(output.running)
+        self.assertEqual(output.lines, [
+            'one', StringWithFormatting(format.red('two')), 'five', 'error'])
+        self.assertEqual(
+            output.get_all_blocks(5, 2)[0].lines, ['five ', 'error'])
+
+    def test_max_lines(self):
+        output = ProcessOutput(max_lines=3)
+        self.run_python(output, '\n'.join([
+            'print("\\x1b[1m")',
+            'for i in range(100000):',
+            '    print(i)']))
+        self.assertEqual(output.max_lines, 3)
+        self.assertEqual([str(line) for line in output.lines], [
+            '99997', '99998', '99999'])
+        # The formatting from long-gone lines is still in effect:
+        format = FormatPlaceholderFactory()
+        self.assertEqual(
+            output.lines[0], StringWithFormatting(format.bold('99997')))
+
+    def test_redraws_once_per_frame(self):
+        output = ProcessOutput()
+        root = Root(
+            output, terminal=Terminal(stream=StringIO()), loop=self.loop)
+        with patch('jcn.Terminal.width', 10), \
+                patch('jcn.Terminal.height', 2):
+            root.draw()
+            with patch.object(root, 'update') as update:
+                start = self.loop.time()
+                self.run_python(output, '\n'.join([
+                    'import sys',
+                    'for i in range(2000):',
+                    '    print(i, flush=True)']))
+                frames = (
+                    (self.loop.time() - start) / root.frame_clock.interval)
+                self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertFalse(root.frame_clock.running)
+        self.assertGreaterEqual(update.call_count, 1)
+        self.assertLessEqual(update.call_count, frames + 2)
+        self.assertEqual(output.lines[-2:], ['1998', '1999'])
@@ -0,0 +1,168 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+from itertools import count
+from mock import patch, Mock
+from io import StringIO
+
+from jcn import profiling
+from jcn.profiling import Profiler, LatencyHistogram, LatencyTracer
+from jcn.terminal import Terminal, OutputWriter
+from jcn.root import Root
+from jcn.display_elements import Fill
+from jcn.container_elements import Stack
+from jcn.input_elements import LineInput
+
+
+class TestProfiler(TestCase):
+    def test_call_tree(self):
+        # Every reading of the clock advances it by one 'second':
+        profiler = Profiler(clock=count().__next__)
+        with profiler.frame('draw') as frame:
+            self.assertIs(profiling.active_profiler, profiler)
+            profiler.enter('a', 'outer')
+            profiler.enter('b', 'inner')
+            profiler.exit()
+            profiler.enter('b', 'inner')
+            profiler.exit()
+            profiler.exit()
+            self.assertEqual(
+                list(profiler.profile_iterator('c', 'iter', 'xy')),
+                ['x', 'y'])
+        self.assertIsNone(profiling.active_profiler)
+        self.assertEqual(list(profiler.frames), [frame])
+        self.assertEqual(frame.duration, 13)
+        stats = {
+            (stat.element, stat.phase): stat[2:] for stat in frame.stats()}
+        self.assertEqual(stats, {
+            ('a', 'outer'): (1, 5, 3),
+            ('b', 'inner'): (2, 2, 2),
+            ('c', 'iter'): (1, 3, 3)})
+        report = frame.report(bar_width=13).splitlines()
+        self.assertEqual(report[0], 'draw 13000.000ms')
+        self.assertTrue(report[1].startswith('#####         a outer (1 calls'))
+        self.assertTrue(
+            report[2].startswith('##              b inner (2 calls'))
+
+    def test_max_frames(self):
+        profiler = Profiler(max_frames=2)
+        for kind in 'abc':
+            with profiler.frame(kind):
+                pass
+        self.assertEqual([frame.kind for frame in profiler.frames], ['b', 'c'])
+
+    def test_root_profiling(self):
+        fills = [Fill(str(i)) for i in range(3)]
+        stack = Stack(*fills)
+        root = Root(stack, terminal=Terminal(stream=StringIO()))
+        root.profiler = Profiler()
+        with patch('jcn.Terminal.width', 3), patch(
+                'jcn.Terminal.height', 2):
+            root.draw()
+        frame, = root.profiler.frames
+        phases = {(stat.element, stat.phase) for stat in frame.stats()}
+        self.assertIn((root, 'get_all_blocks'), phases)
+        self.assertIn((stack, '_get_elements_and_parameters'), phases)
+        self.assertIn((fills[1], '_get_lines'), phases)
+        self.assertIn((fills[1], '_do_crop'), phases)
+        self.assertIn((fills[1], 'draw_lines'), phases)
+        self.assertIn((fills[1], '_populate_lines'), phases)
+        # The third fill didn't fit:
+        self.assertNotIn((fills[2], '_get_lines'), phases)
+        fills[0].updated = True
+        root.update()
+        self.assertEqual(root.profiler.frames[-1].kind, 'update')
+
+
+class TestLatencyTracer(TestCase):
+    def test_histogram(self):
+        histogram = LatencyHistogram(resolution=1, minimum=1)
+        self.assertIsNone(histogram.percentile(50))
+        for duration in (0.5, 3, 3, 3, 7, 100):
+            histogram.add(duration)
+        self.assertEqual(
+            histogram.buckets(), [(1, 1), (4, 3), (8, 1), (128, 1)])
+        self.assertEqual(histogram.percentile(50), 4)
+        self.assertEqual(histogram.percentile(75), 8)
+        # The largest bucket is bounded by the largest duration seen:
+        self.assertEqual(histogram.percentile(99), 100)
+        self.assertEqual(histogram.count, 6)
+
+    def test_root_tracing(self):
+        line_input = LineInput('')
+        root = Root(line_input, terminal=Terminal(stream=StringIO()))
+        root.input_reader = Mock(read=Mock(return_value='hi'))
+        # Every reading of the clock advances it by one 'second':
+        root.latency_tracer = LatencyTracer(clock=count().__next__)
+        with patch('jcn.Terminal.width', 3), patch(
+                'jcn.Terminal.height', 2):
+            root.draw()
+            root._read_input()
+        self.assertIsNone(profiling.active_tracer)
+        self.assertEqual(str(line_input.line_buffer), 'hi')
+        percentiles = root.latency_tracer.percentiles(50)
+        for stage in ('read', 'decode', 'handler', 'layout'):
+            self.assertEqual(percentiles[stage], (1,))
+        # One block is populated, then written and flushed:
+        self.assertEqual(percentiles['populate'], (1,))
+        self.assertEqual(percentiles['write'], (2,))
+        self.assertEqual(percentiles['total'], (8,))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'latency.txt')
+            root.latency_tracer.dump(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines[0].split(), [
+            'stage', 'count', 'p50', 'ms', 'p99', 'ms', 'max', 'ms'])
+        self.assertEqual(lines[-1].split()[:2], ['total', '1'])
+
+    def test_write_is_timed_until_output_is_sent(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.set_blocking(read_fd, False)
+        terminal = Terminal(stream=StringIO())
+        line_input = LineInput('')
+        root = Root(line_input, terminal=terminal, loop=loop)
+        root.output_writer = terminal.stream = OutputWriter(
+            write_fd, loop, lambda: root.draw())
+        root.input_reader = Mock(read=Mock(return_value='hi'))
+        tracer = root.latency_tracer = LatencyTracer()
+        with patch('jcn.Terminal.width', 3), patch(
+                'jcn.Terminal.height', 2):
+            root.draw()
+            # Stuff the pipe full so that the terminal appears to be slow:
+            terminal.stream.write('.' * 1000000)
+            terminal.stream.flush()
+            root._read_input()
+            self.assertIsNone(profiling.active_tracer)
+            # Nothing has reached the terminal yet:
+            self.assertEqual(tracer.histograms['total'].count, 0)
+            while root.output_writer.congested:
+                loop.run_until_complete(asyncio.sleep(0))
+                while True:
+                    try:
+                        os.read(read_fd, 65536)
+                    except BlockingIOError:
+                        break
+        self.assertEqual(tracer.histograms['total'].count, 1)
+        self.assertEqual(tracer.histograms['write'].count, 1)
+        root.output_writer.close()
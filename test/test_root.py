@@ -0,0 +1,271 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import os
+import signal
+import threading
+from unittest import TestCase
+from mock import patch
+from io import StringIO
+
+from jcn.terminal import Terminal, MouseEvent, InputReader, OutputWriter
+from jcn.root import Root
+from jcn.display_elements import Fill, Label
+from jcn.input_elements import LineInput
+from jcn.container_elements import Stack, VerticalSplitContainer
+
+
+class RootTestCase(TestCase):
+    def setUp(self):
+        self.stream = StringIO()
+        self.terminal = Terminal(stream=self.stream)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        width_patch = patch('jcn.Terminal.width', 5)
+        height_patch = patch('jcn.Terminal.height', 4)
+        width_patch.start()
+        height_patch.start()
+        self.addCleanup(width_patch.stop)
+        self.addCleanup(height_patch.stop)
+
+
+class TestBatch(RootTestCase):
+    def test_batch_defers_drawing(self):
+        stack = Stack()
+        root = Root(stack, terminal=self.terminal, loop=self.loop)
+        root.draw()
+        self.stream.truncate(0)
+        self.stream.seek(0)
+        with patch.object(
+                root, '_do_draw', wraps=root._do_draw) as mock_do_draw:
+            with root.batch():
+                self.assertTrue(root.batching)
+                for char in '123':
+                    stack.add_element(Fill(char))
+                with root.batch():
+                    stack.add_element(Fill('4'))
+                self.assertEqual(mock_do_draw.call_count, 0)
+            self.assertFalse(root.batching)
+            self.assertEqual(mock_do_draw.call_count, 1)
+        for char in '1234':
+            self.assertIn(char * 5, self.stream.getvalue())
+
+    def test_async_batch(self):
+        stack = Stack()
+        root = Root(stack, terminal=self.terminal, loop=self.loop)
+        root.draw()
+
+        async def populate():
+            async with root.batch():
+                stack.add_element(Fill('1'))
+                await asyncio.sleep(0)
+                stack.add_element(Fill('2'))
+                self.assertNotIn('22222', self.stream.getvalue())
+
+        self.loop.run_until_complete(populate())
+        self.assertIn('22222', self.stream.getvalue())
+
+
+class TestMouse(RootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fills = [Fill(str(i)) for i in range(4)]
+        self.left = Stack(*self.fills[:2])
+        self.right = Stack(*self.fills[2:])
+        self.split = VerticalSplitContainer(self.left, self.right)
+        self.root = Root(self.split, terminal=self.terminal, loop=self.loop)
+        self.root.draw()
+
+    def test_element_at(self):
+        self.assertIs(self.root.element_at(0, 0), self.fills[0])
+        self.assertIs(self.root.element_at(2, 1), self.fills[1])
+        self.assertIs(self.root.element_at(3, 1), self.fills[3])
+        # Below the stacks' children we find the stacks themselves:
+        self.assertIs(self.root.element_at(4, 3), self.right)
+        self.assertIsNone(self.root.element_at(5, 0))
+        self.right.remove_element(self.fills[2])
+        self.assertIs(self.root.element_at(3, 0), self.fills[3])
+
+    def test_handle_mouse(self):
+        handled = []
+
+        def handle_mouse(event):
+            handled.append(event)
+        self.right.handle_mouse = handle_mouse
+        self.assertIs(self.split.active_element, self.left)
+        event = MouseEvent('left press', 3, 1)
+        self.assertIsNone(self.root.handle_mouse(event))
+        self.assertEqual(handled, [event])
+        self.assertIs(self.split.active_element, self.right)
+        self.assertIs(self.right.active_element, self.fills[3])
+        event = MouseEvent('left press', 0, 0)
+        self.assertEqual(self.root.handle_mouse(event), event)
+
+
+class TestResize(RootTestCase):
+    def test_resize_storm_redraws_once(self):
+        root = Root(Fill(), terminal=self.terminal, loop=self.loop)
+        root.resize_delay = 0.01
+        with patch.object(root, 'draw') as mock_draw, patch.object(
+                self.terminal, 'invalidate_size') as mock_invalidate_size:
+            with root._handle_screen_resize():
+                for _ in range(5):
+                    os.kill(os.getpid(), signal.SIGWINCH)
+                    self.loop.run_until_complete(asyncio.sleep(0))
+                self.loop.run_until_complete(asyncio.sleep(0.05))
+                self.assertEqual(mock_draw.call_count, 1)
+                self.assertEqual(mock_invalidate_size.call_count, 5)
+                os.kill(os.getpid(), signal.SIGWINCH)
+                self.loop.run_until_complete(asyncio.sleep(0))
+            # Leaving cancels the pending redraw:
+            self.loop.run_until_complete(asyncio.sleep(0.05))
+            self.assertEqual(mock_draw.call_count, 1)
+
+
+class TestInput(RootTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fill = Fill()
+        self.received = []
+        self.fill.handle_input = self.received.append
+        self.root = Root(self.fill, terminal=self.terminal, loop=self.loop)
+
+    def test_feed_input(self):
+        self.root.feed_input('hi\x1b[Athere')
+        self.assertEqual(
+            self.received, ['h', 'i', 'up', 't', 'h', 'e', 'r', 'e'])
+
+    def test_escape_timeout(self):
+        self.root.keyboard.escape_timeout = 0.001
+        self.root.feed_input('a\x1b')
+        self.assertEqual(self.received, ['a'])
+        self.root.feed_input('[')
+        self.assertEqual(self.received, ['a'])
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(self.received, ['a', 'alt ['])
+        self.root.feed_input('\x1b')
+        self.root.feed_input('[D')
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertEqual(self.received, ['a', 'alt [', 'left'])
+
+    def test_key_bindings(self):
+        stack = Stack(self.fill)
+        self.root.element = stack
+        pressed = []
+        stack.bind('ctrl s', lambda: pressed.append('save'))
+        stack.bind(('ctrl x', 'ctrl c'), lambda: pressed.append('quit'))
+        self.fill.bind('ctrl s', lambda: pressed.append('fill save'))
+        self.root.feed_input('\x13a\x18\x03\x18b')
+        self.assertEqual(pressed, ['fill save', 'quit'])
+        # An abandoned chord doesn't swallow the key that abandoned it:
+        self.assertEqual(self.received, ['a', 'b'])
+        self.fill.keymap = None
+        self.root.feed_input('\x13')
+        self.assertEqual(pressed, ['fill save', 'quit', 'save'])
+
+    def test_input_coalesced(self):
+        line_input = LineInput('')
+        self.root.element = line_input
+        self.root.draw()
+        with patch.object(
+                self.root, '_do_draw', wraps=self.root._do_draw) as do_draw:
+            self.root.feed_input('hello\x1b[D\x7f')
+        self.assertEqual(str(line_input.line_buffer), 'helo')
+        self.assertEqual(do_draw.call_count, 1)
+
+    def test_read_input(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.set_blocking(read_fd, False)
+        self.root.input_reader = InputReader(read_fd)
+        os.write(write_fd, 'h\x1b[A'.encode() + 'é'.encode()[:1])
+        self.root._read_input()
+        self.assertEqual(self.received, ['h', 'up'])
+        os.write(write_fd, 'é'.encode()[1:])
+        self.root._read_input()
+        self.assertEqual(self.received, ['h', 'up', 'é'])
+
+
+class TestThreads(RootTestCase):
+    def test_call_from_thread(self):
+        label = Label('')
+        root = Root(label, terminal=self.terminal, loop=self.loop)
+        root.draw()
+        received = []
+
+        def worker(n):
+            for i in range(100):
+                root.call_from_thread(received.append, (n, i))
+            root.call_from_thread(setattr, label, 'content', 'done')
+        threads = [
+            threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        with patch.object(root, '_do_draw', wraps=root._do_draw) as do_draw:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(len(received), 400)
+        # Each thread's calls are run in order:
+        for n in range(4):
+            self.assertEqual(
+                [i for m, i in received if m == n], list(range(100)))
+        self.assertEqual(label.content, 'done')
+        # Everything that arrived whilst the loop was busy drew just once:
+        self.assertLessEqual(do_draw.call_count, 2)
+        self.assertGreaterEqual(do_draw.call_count, 1)
+
+
+class TestOutput(RootTestCase):
+    def test_frames_dropped_whilst_congested(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.set_blocking(read_fd, False)
+        label = Label('one')
+        root = Root(label, terminal=self.terminal, loop=self.loop)
+        # Look draw up when it's called, so that we can patch it below:
+        root.output_writer = OutputWriter(
+            write_fd, self.loop, lambda: root.draw())
+        self.terminal.stream = root.output_writer
+
+        def read_all():
+            chunks = []
+            while True:
+                try:
+                    chunks.append(os.read(read_fd, 65536))
+                except BlockingIOError:
+                    return b''.join(chunks)
+
+        root.draw()
+        self.assertIn(b'one', read_all())
+        # Stuff the pipe full so that the terminal appears to be slow:
+        self.terminal.stream.write('.' * 1000000)
+        self.terminal.stream.flush()
+        with patch.object(root, 'draw', wraps=root.draw) as draw:
+            label.content = 'two'
+            label.content = 'six'
+            self.assertEqual(root.output_writer.frames_dropped, 2)
+            data = b''
+            while not draw.called:
+                self.loop.run_until_complete(asyncio.sleep(0))
+                data += read_all()
+            data += read_all()
+        # Only the newest state was drawn, once the terminal caught up:
+        self.assertNotIn(b'two', data)
+        self.assertIn(b'six', data)
+        root.output_writer.close()
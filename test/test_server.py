@@ -0,0 +1,150 @@
+# Copyright (C) 2013 Paul Weaver <p.weaver@ruthorn.co.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from mock import Mock
+
+from jcn.headless import Screen
+from jcn.root import Root
+from jcn.container_elements import Stack
+from jcn.display_elements import Label
+from jcn.server import Client, Server
+
+
+class TestClient(TestCase):
+    def test_render(self):
+        source = Screen(6, 2)
+        source.write('ab\x1b[1mcd\x1b[2;1Hxyz')
+        client = Client(Mock(), 4, 3)
+        data = client.render(source)
+        self.assertTrue(data.startswith('\x1b[?25l\x1b[0m\x1b[H\x1b[2J'))
+        viewer = Screen(4, 3)
+        viewer.write(data)
+        self.assertEqual(viewer.lines(), ['abcd', 'xyz ', '    '])
+        self.assertEqual(viewer.cell(2, 0), ('c', {'bold'}))
+        self.assertEqual(client.render(source), '')
+        # Only the changed cells are sent:
+        source.write('\x1b[0m\x1b[2;2HY\x1b[1;6Hoff screen')
+        data = client.render(source)
+        self.assertEqual(data, '\x1b[2;2H\x1b[0mY')
+        viewer.write(data)
+        self.assertEqual(viewer.lines(), ['abcd', 'xYz ', '    '])
+
+    def test_colours(self):
+        source = Screen(3, 1)
+        source.write(
+            '\x1b[31;7ma\x1b[0;38;5;200;104mb\x1b[0;38;2;1;2;3;1mc')
+        viewer = Screen(3, 1)
+        viewer.write(Client(Mock(), 3, 1).render(source))
+        for x in range(3):
+            self.assertEqual(viewer.cell(x, 0), source.cell(x, 0))
+
+    def test_size_report(self):
+        client = Client(Mock(), 80, 24)
+        self.assertFalse(client.feed_input('x\x1b[8;24;80t\x1b[8;1'))
+        self.assertTrue(client.feed_input('0;40t'))
+        self.assertEqual((client.width, client.height), (40, 10))
+        # A stray escape doesn't make us hold on to everything after it:
+        client.feed_input('\x1b' + 'typing' * 1000)
+        self.assertEqual(client._input, '')
+        client.feed_input('\x1b[8;123456')
+        self.assertEqual(client._input, '')
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'socket')
+
+    def test_serve(self):
+        label = Label('hello')
+        root = Root(Stack(label, Label('world')), loop=self.loop)
+        server = Server(root)
+
+        async def connect(width, height):
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            self.assertEqual(await reader.readexactly(5), b'\x1b[18t')
+            writer.write('\x1b[8;{};{}t'.format(height, width).encode())
+            return reader, writer
+
+        async def read(reader, screen):
+            data = await asyncio.wait_for(reader.read(4096), 1)
+            screen.write(data.decode())
+            return data
+
+        async def go():
+            await server.start(self.path)
+            first, first_writer = await connect(8, 3)
+            second, second_writer = await connect(3, 1)
+            first_screen, second_screen = Screen(8, 3), Screen(3, 1)
+            while first_screen.lines() != ['hello   ', 'world   ', '        ']:
+                await read(first, first_screen)
+            while second_screen.lines() != ['hel']:
+                await read(second, second_screen)
+            # The UI is laid out at the size of the largest client:
+            self.assertEqual(root.terminal.width, 8)
+            label.content = 'help'
+            self.assertEqual(await read(first, first_screen), b'\x1b[1;4Hp ')
+            self.assertEqual(first_screen.lines()[0], 'help    ')
+            await read(second, second_screen)
+            self.assertEqual(second_screen.lines(), ['hel'])
+            first_writer.close()
+            while len(server.clients) > 1:
+                await asyncio.sleep(0.01)
+            self.assertEqual(root.terminal.width, 3)
+            server.close()
+            second_writer.close()
+            await server.wait_closed()
+
+        self.loop.run_until_complete(go())
+
+    def test_slow_client(self):
+        label = Label('')
+        root = Root(label, loop=self.loop)
+        server = Server(root, width=1000, height=1)
+
+        async def go():
+            await server.start(self.path)
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            writer.write(b'\x1b[8;1;1000t')
+            while not server.clients or server.clients[0].width != 1000:
+                await asyncio.sleep(0.01)
+            client, = server.clients
+            # The viewer reads nothing, so before long it can't keep up:
+            for i in range(2000):
+                label.content = str(i % 10) * 1000
+                await asyncio.sleep(0)
+            self.assertTrue(client.draining)
+            transport = client.writer.transport
+            self.assertLess(
+                transport.get_write_buffer_size(),
+                transport.get_write_buffer_limits()[1] + 4096)
+            # Once it catches up, it's sent the latest screen:
+            screen = Screen(1000, 1)
+            while screen.lines() != ['9' * 1000]:
+                data = await asyncio.wait_for(reader.read(65536), 1)
+                screen.write(data.decode())
+            server.close()
+            writer.close()
+            await server.wait_closed()
+
+        self.loop.run_until_complete(go())
@@ -14,15 +14,18 @@
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
 from unittest import TestCase
-from mock import patch
+from mock import Mock, patch
 
+import asyncio
 import blessings
 import signal
+import threading
 import os
 from io import StringIO
 
 from jcn import Terminal, get_terminal
-from jcn.terminal import Keyboard
+from jcn.terminal import (
+    Keyboard, MouseEvent, Paste, InputReader, OutputWriter)
 
 
 class TestTerminal(TestCase):
@@ -112,6 +115,23 @@ class TestTerminal(TestCase):
             blessings_term.move(4, 3) + 'hello' +
             blessings_term.move(5, 3) + 'world')
 
+    @patch('blessings.Terminal._height_and_width')
+    def test_cached_size(self, mock_height_and_width):
+        mock_height_and_width.return_value = (24, 80)
+        terminal = Terminal(stream=StringIO())
+        self.assertEqual((terminal.height, terminal.width), (24, 80))
+        self.assertEqual(mock_height_and_width.call_count, 2)
+        with terminal.cached_size():
+            self.assertEqual((terminal.height, terminal.width), (24, 80))
+            self.assertEqual(mock_height_and_width.call_count, 3)
+            mock_height_and_width.return_value = (30, 100)
+            self.assertEqual(terminal.width, 80)
+            terminal.invalidate_size()
+            self.assertEqual((terminal.height, terminal.width), (30, 100))
+            self.assertEqual(mock_height_and_width.call_count, 4)
+        self.assertEqual(terminal.width, 100)
+        self.assertEqual(mock_height_and_width.call_count, 5)
+
     def test_get_terminal(self):
         terminal = get_terminal()
         self.assertIsInstance(terminal, Terminal)
@@ -122,3 +142,161 @@ class TestTerminal(TestCase):
         keyboard = Keyboard()
         self.assertEqual(keyboard['\x1b[7~'], 'home')
         self.assertEqual(keyboard['\x1btosh'], '\x1btosh')
+
+    def test_keyboard_mouse(self):
+        keyboard = Keyboard()
+        self.assertEqual(
+            keyboard['\x1b[<0;5;3M'], MouseEvent('left press', 4, 2))
+        self.assertEqual(
+            keyboard['\x1b[<2;5;3m'], MouseEvent('right release', 4, 2))
+        self.assertEqual(
+            keyboard['\x1b[<20;1;1M'],
+            MouseEvent('ctrl shift left press', 0, 0))
+        self.assertEqual(
+            keyboard['\x1b[<65;10;200M'], MouseEvent('scroll down', 9, 199))
+        self.assertEqual(keyboard['\x1b[<0;1M'], '\x1b[<0;1M')
+
+    def test_keyboard_feed(self):
+        keyboard = Keyboard()
+        self.assertEqual(
+            keyboard.feed('ab\x1b[A\x1b[<0;5;3Mx\x1b[3~ \n'),
+            ['a', 'b', 'up', MouseEvent('left press', 4, 2), 'x', 'delete',
+             'space', 'return'])
+        self.assertFalse(keyboard.pending)
+        # Sequences split across chunks:
+        self.assertEqual(keyboard.feed('q\x1b'), ['q'])
+        self.assertTrue(keyboard.pending)
+        self.assertEqual(keyboard.feed('[B\x1b[<2;1'), ['down'])
+        self.assertEqual(
+            keyboard.feed(';1m'), [MouseEvent('right release', 0, 0)])
+        # Ambiguous prefixes are resolved when we stop waiting:
+        self.assertEqual(keyboard.feed('\x1b'), [])
+        self.assertEqual(keyboard.feed('', final=True), ['esc'])
+        self.assertEqual(keyboard.feed('\x1bO'), [])
+        self.assertEqual(keyboard.feed('', final=True), ['alt O'])
+        self.assertFalse(keyboard.pending)
+        # Longest matches win, and unknown control sequences are kept whole:
+        self.assertEqual(
+            keyboard.feed('\x1bx\x1b[[A\x1bOP\x1b[99Z\x7f\x01'),
+            ['alt x', 'f1', 'f1', '\x1b[99Z', 'backspace', 'ctrl a'])
+        self.assertEqual(
+            keyboard.feed('\x1b[1;2A\x1b[1;5D\x1b[1;6H'),
+            ['shift up', 'ctrl left', 'ctrl shift home'])
+        self.assertEqual(keyboard.feed('\t\x1b[Z'), ['tab', 'shift tab'])
+
+    def test_input_reader(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        os.set_blocking(read_fd, False)
+        reader = InputReader(read_fd, buffer_size=4)
+        self.assertEqual(reader.read(), '')
+        # More than fits in the buffer, ending part way through a character:
+        data = 'abc\u00e9\u20ac'.encode()
+        os.write(write_fd, data[:-1])
+        self.assertEqual(reader.read(), 'abc\u00e9')
+        os.write(write_fd, data[-1:])
+        os.close(write_fd)
+        self.assertEqual(reader.read(), '\u20ac')
+        self.assertEqual(reader.read(), '')
+
+    def test_output_writer(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        os.set_blocking(read_fd, False)
+        redrawn = asyncio.Event()
+        writer = OutputWriter(write_fd, loop, redraw=redrawn.set)
+
+        def read_all():
+            chunks = []
+            while True:
+                try:
+                    chunks.append(os.read(read_fd, 65536))
+                except BlockingIOError:
+                    return b''.join(chunks)
+
+        with writer.frame():
+            writer.write('first')
+            writer.flush()
+            self.assertEqual(read_all(), b'')
+        self.assertEqual(read_all(), b'first')
+        self.assertFalse(writer.congested)
+        # A frame that's more than the pipe will take:
+        with writer.frame():
+            writer.write('x' * 1000000)
+        self.assertTrue(writer.congested)
+        # ...so the frames after it are dropped, but other output isn't:
+        with writer.frame():
+            writer.write('dropped')
+        writer.write('kept')
+        writer.flush()
+        self.assertEqual(writer.frames_dropped, 1)
+
+        async def drain():
+            data = b''
+            while not redrawn.is_set():
+                await asyncio.sleep(0)
+                data += read_all()
+            return data + read_all()
+        data = loop.run_until_complete(drain())
+        self.assertEqual(data, b'x' * 1000000 + b'kept')
+        self.assertFalse(writer.congested)
+        writer.write('end')
+        writer.close()
+        self.assertEqual(read_all(), b'end')
+        self.assertTrue(os.get_blocking(write_fd))
+
+    def test_output_writer_drain(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        redraw = Mock()
+        writer = OutputWriter(write_fd, loop, redraw=redraw)
+        with writer.frame():
+            writer.write('x' * 1000000)
+        with writer.frame():
+            writer.write('dropped')
+        self.assertTrue(writer.congested)
+        chunks = []
+
+        def read():
+            while sum(map(len, chunks)) < 1000000 + len('bye'):
+                chunks.append(os.read(read_fd, 65536))
+        reader = threading.Thread(target=read)
+        reader.start()
+        with writer.frame():
+            writer.write('unfinished')
+            # Everything outside of the frame is sent before we return:
+            writer.drain('bye')
+            reader.join()
+        self.assertEqual(b''.join(chunks), b'x' * 1000000 + b'bye')
+        self.assertFalse(writer.congested)
+        self.assertFalse(os.get_blocking(write_fd))
+        # ...and the dropped frame is redrawn once we're back in the loop:
+        redraw.assert_not_called()
+        loop.run_until_complete(asyncio.sleep(0))
+        redraw.assert_called_once_with()
+
+    def test_keyboard_paste(self):
+        keyboard = Keyboard()
+        self.assertEqual(
+            keyboard.feed('a\x1b[200~pasted\x1b[A\rtext\x1b[201~b'),
+            ['a', Paste('pasted\x1b[A\ntext'), 'b'])
+        # Pastes split across chunks, including the markers:
+        self.assertEqual(keyboard.feed('\x1b[20'), [])
+        self.assertEqual(keyboard.feed('0~some '), [])
+        self.assertFalse(keyboard.pending)
+        self.assertEqual(keyboard.feed('', final=True), [])
+        self.assertEqual(keyboard.feed('more\x1b[2'), [])
+        self.assertEqual(
+            keyboard.feed('01~\x1b[B'), [Paste('some more'), 'down'])
+
+    def test_mouse_reporting(self):
+        term = Terminal(stream=StringIO())
+        with term.mouse_reporting():
+            self.assertFalse(term._has_mouse_reporting)
+        self.assertEqual(term.stream.getvalue(), '')
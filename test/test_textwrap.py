@@ -18,7 +18,7 @@ from unittest import TestCase
 from jcn.formatting import (
     FormatPlaceholderFactory, StringComponent, StringWithFormatting,
     null_placeholder)
-from jcn.textwrap import wrap
+from jcn.textwrap import TextWrapper, wrap
 
 
 class TestTextWrapper(TestCase):
@@ -36,6 +36,12 @@ class TestTextWrapper(TestCase):
         self.assertEqual(result, expected)
         self.assertEqual(wrap('', 10), [])
 
+    def test_keep_indent(self):
+        wrapper = TextWrapper(8, keep_indent=True)
+        self.assertEqual(wrapper.wrap('  ab cd ef'), ['  ab cd', 'ef'])
+        # An indented word that doesn't fit moves to the next line whole:
+        self.assertEqual(wrapper.wrap('  indented'), ['', 'indented'])
+
     def test_wrap_str_with_formatting(self):
         long_swf = (
             '  This  is a    rather ' + self.format.bold('loooong ') +
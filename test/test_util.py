@@ -14,11 +14,12 @@
 # along with this program.  If not, see [http://www.gnu.org/licenses/].
 
 import asyncio
+import time
 from unittest import TestCase
 
 from jcn.util import (
-    clamp, weighted_round_robin, crop_or_expand, LoopingCall,
-    InheritDocstrings)
+    clamp, weighted_round_robin, crop_or_expand, FenwickTree, GapBuffer,
+    PieceTable, SpatialIndex, LoopingCall, FrameClock, InheritDocstrings)
 
 
 class TestUtil(TestCase):
@@ -90,6 +91,90 @@ class TestUtil(TestCase):
             crop_or_expand('y', 8, scheme='middle'),
             '    y   ')
 
+    def test_fenwick_tree(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        tree = FenwickTree(values[:5])
+        for value in values[5:]:
+            tree.append(value)
+        self.assertEqual(list(tree), values)
+        self.assertEqual(len(tree), 8)
+        for i in range(len(values) + 1):
+            self.assertEqual(tree.prefix_sum(i), sum(values[:i]))
+        self.assertEqual(tree.total, 31)
+        self.assertEqual(tree.find(0), 0)
+        self.assertEqual(tree.find(2), 0)
+        self.assertEqual(tree.find(3), 1)
+        self.assertEqual(tree.find(4), 2)
+        self.assertEqual(tree.find(30), 7)
+        self.assertEqual(tree.find(31), 8)
+        tree[2] = 0
+        self.assertEqual(tree.prefix_sum(3), 4)
+        self.assertEqual(tree.find(4), 3)
+        del tree[0]
+        self.assertEqual(list(tree), [1, 0, 1, 5, 9, 2, 6])
+        self.assertEqual(tree.total, 24)
+        tree.insert(1, 10)
+        self.assertEqual(tree.prefix_sum(2), 11)
+        self.assertEqual(tree.find(11), 3)
+
+    def test_gap_buffer(self):
+        buffer = GapBuffer('held', gap_size=1)
+        self.assertEqual(len(buffer), 4)
+        buffer.insert(2, 'llo wor')
+        self.assertEqual(str(buffer), 'hello world')
+        buffer.insert(0, '>')
+        buffer.insert(len(buffer), '!')
+        self.assertEqual(str(buffer), '>hello world!')
+        buffer.delete(0)
+        buffer.delete(5, 6)
+        self.assertEqual(str(buffer), 'hello!')
+        buffer.delete(5, 10)
+        self.assertEqual(str(buffer), 'hello')
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual([buffer[i] for i in range(5)], list('hello'))
+        with self.assertRaises(IndexError):
+            buffer[5]
+        with self.assertRaises(IndexError):
+            buffer.insert(6, 'x')
+
+    def test_piece_table(self):
+        table = PieceTable('one\ntwo\nthree')
+        table.insert(4, 'tw')
+        table.insert(6, 'o and a half\n')
+        table.insert(len(table), '\n')
+        self.assertEqual(str(table), 'one\ntwo and a half\ntwo\nthree\n')
+        self.assertEqual(table.line_count, 5)
+        self.assertEqual(
+            [table.line(line) for line in range(5)],
+            ['one', 'two and a half', 'two', 'three', ''])
+        self.assertEqual(table.line_start(2), 19)
+        self.assertEqual(table.line_end(1), 18)
+        self.assertEqual(
+            [table.line_of(offset) for offset in (0, 3, 4, 18, 19, 29)],
+            [0, 0, 1, 1, 2, 4])
+        table.delete(2, 21)
+        self.assertEqual(str(table), 'ono\nthree\n')
+        self.assertEqual(table.text(1, 6), 'no\nth')
+        self.assertEqual(table.line_count, 3)
+        self.assertEqual(table.line_start(1), 4)
+        with self.assertRaises(IndexError):
+            table.line_start(3)
+
+    def test_spatial_index(self):
+        index = SpatialIndex()
+        index.add(0, 0, 10, 3, 'parent')
+        index.add(0, 0, 5, 3, 'left')
+        index.add(5, 0, 5, 3, 'right')
+        index.add(1, 1, 2, 1, 'nested')
+        self.assertEqual(
+            [index.get(x, 1) for x in range(11)],
+            ['left', 'nested', 'nested', 'left', 'left'] + ['right'] * 5 +
+            [None])
+        self.assertEqual(index.get(1, 0), 'left')
+        self.assertIsNone(index.get(0, 3))
+        index.clear()
+        self.assertIsNone(index.get(0, 0))
+
     def test_looping_call(self):
         result = []
         future = asyncio.Future()
@@ -109,6 +194,33 @@ class TestUtil(TestCase):
         loop.run_until_complete(future)
         self.assertEqual(result, [0, 1, 2, 3])
 
+    def test_frame_clock(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        clock = FrameClock(interval=0.01, loop=loop)
+        self.assertFalse(clock.running)
+        frames = []
+
+        def slow_subscriber(frame_time):
+            frames.append(frame_time)
+            if len(frames) == 2:
+                # Take long enough that we miss a couple of frames:
+                time.sleep(0.025)
+            elif len(frames) == 4:
+                clock.unsubscribe(slow_subscriber)
+        clock.subscribe(slow_subscriber)
+        self.assertTrue(clock.running)
+        loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertFalse(clock.running)
+        self.assertEqual(len(frames), 4)
+        # Frames stay on the original schedule, skipping those we missed:
+        intervals = [(frame - frames[0]) / 0.01 for frame in frames]
+        for interval in intervals:
+            self.assertAlmostEqual(interval, round(interval))
+        self.assertEqual([round(i) for i in intervals[:2]], [0, 1])
+        self.assertGreaterEqual(intervals[2], 3.5)
+        self.assertAlmostEqual(intervals[3], intervals[2] + 1)
+
     def test_inherit_docstrings(self):
         class A(metaclass=InheritDocstrings):
             def foo(self):